@@ -0,0 +1,51 @@
+"""
+Compare two benchmark result files and fail on regressions.
+
+Usage: python -m benchmarks.compare baseline.json current.json [tolerance]
+
+A run regresses when its throughput drops, or its p99 latency or peak
+backends grow, by more than ``tolerance`` (default 0.2, i.e. 20%).
+"""
+
+import json
+import sys
+
+KEY = ("benchmark", "phase", "databases", "items", "concurrency")
+# metric -> whether higher is better
+METRICS = {"throughput": True, "p99": False, "peak_backends": False}
+
+
+def load(path):
+    with open(path) as f:
+        return {tuple(r[k] for k in KEY): r for r in json.load(f)["results"]}
+
+
+def regressions(baseline, current, tolerance=0.2):
+    found = []
+    for key, new in sorted(current.items()):
+        old = baseline.get(key)
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            before, after = old[metric], new[metric]
+            if not before:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > tolerance:
+                found.append((key, metric, before, after))
+    return found
+
+
+def main(argv):
+    if len(argv) not in (2, 3):
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    tolerance = float(argv[2]) if len(argv) == 3 else 0.2
+    found = regressions(load(argv[0]), load(argv[1]), tolerance)
+    for key, metric, before, after in found:
+        print(f"{'/'.join(map(str, key))}: {metric} {before} -> {after}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
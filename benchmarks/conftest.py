@@ -0,0 +1,135 @@
+# To get nicer type annotations in Python 3.7 and 3.8.
+from __future__ import annotations
+
+import json
+import os
+import platform
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg  # type: ignore
+import pytest  # type: ignore
+
+from database_operator.databases import PostgresConnection
+
+SCALES = {
+    "smoke": {
+        "databases": [1, 10],
+        "items": [1, 20],
+        "concurrency": [1, 4],
+    },
+    "full": {
+        "databases": [1, 10, 100, 1000],
+        "items": [1, 20, 200],
+        "concurrency": [1, 10, 50],
+    },
+}
+SCALE = os.getenv("BENCHMARK_SCALE", "smoke")
+OUTPUT = os.getenv("BENCHMARK_OUTPUT", "benchmark-results.json")
+MAX_CONNECTIONS = int(os.getenv("BENCHMARK_MAX_CONNECTIONS", 20))
+PREFIX = "bench_"
+
+
+def pytest_generate_tests(metafunc):
+    """
+    Parametrize benchmarks over the axes of BENCHMARK_SCALE, leaving out
+    runs with more workers than databases
+    """
+    scale = SCALES[SCALE]
+    names = [n for n in ("databases", "items", "concurrency") if n in scale]
+    names = [n for n in names if n in metafunc.fixturenames]
+    if not names:
+        return
+    combos = [()]
+    for name in names:
+        combos = [c + (v,) for c in combos for v in scale[name]]
+    if "databases" in names and "concurrency" in names:
+        db, conc = names.index("databases"), names.index("concurrency")
+        combos = [c for c in combos if c[conc] <= c[db]]
+    metafunc.parametrize(names, combos)
+
+
+@pytest.fixture(scope="session")
+def server(request):
+    """
+    Connection parameters of the Postgres to benchmark against: the
+    server at POSTGRES_HOST if set, otherwise one started by
+    pytest-postgresql
+    """
+    if os.getenv("POSTGRES_HOST"):
+        return {
+            "user": os.getenv("POSTGRES_USER", "postgres"),
+            "password": os.getenv("POSTGRES_PASSWORD", ""),
+            "host": os.environ["POSTGRES_HOST"],
+            "port": int(os.getenv("POSTGRES_PORT", 5432)),
+        }
+    proc = request.getfixturevalue("postgresql_proc")
+    return {
+        "user": proc.user,
+        "password": proc.password or "",
+        "host": proc.host,
+        "port": proc.port,
+    }
+
+
+def dsn(server, database="postgres"):
+    return (
+        f"postgresql://{server['user']}:{server['password']}"
+        f"@{server['host']}:{server['port']}/{database}"
+    )
+
+
+@pytest.fixture(scope="session")
+def results(server):
+    records = []
+    yield records
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "scale": SCALE,
+        "max_connections": MAX_CONNECTIONS,
+        "python": platform.python_version(),
+        "results": records,
+    }
+    with open(OUTPUT, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+async def drop_leftovers(server):
+    conn = await asyncpg.connect(dsn(server))
+    try:
+        names = await conn.fetch(
+            "SELECT datname FROM pg_database WHERE datname LIKE $1",
+            PREFIX + "%",
+        )
+        for row in names:
+            await conn.execute(
+                f'DROP DATABASE IF EXISTS "{row["datname"]}" WITH (FORCE)'
+                if conn.get_server_version().major >= 13
+                else f'DROP DATABASE IF EXISTS "{row["datname"]}"'
+            )
+    finally:
+        await conn.close()
+
+
+@asynccontextmanager
+async def connection(server):
+    """
+    An open PostgresConnection, with leftover benchmark databases dropped
+    before and after
+    """
+    await drop_leftovers(server)
+    conn_obj = PostgresConnection(
+        server["user"],
+        server["password"],
+        server["host"],
+        server["port"],
+        "postgres",
+        max_connections=MAX_CONNECTIONS,
+        name="benchmark",
+    )
+    await conn_obj.open()
+    try:
+        yield conn_obj
+    finally:
+        await conn_obj.close()
+        await drop_leftovers(server)
@@ -0,0 +1,495 @@
+"""
+An in-memory stand-in for the parts of the Kubernetes API that kopf and
+pykube use: discovery, list, watch, get, create, patch, replace and delete
+of core and custom resources, with finalizers, status subresources and
+owner-based garbage collection. Every request is counted by verb and
+resource.
+"""
+
+# To get nicer type annotations in Python 3.7 and 3.8.
+from __future__ import annotations
+
+import asyncio
+import bisect
+import copy
+import json
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import attr  # type: ignore
+import yaml  # type: ignore
+from aiohttp import web  # type: ignore
+
+KUBECONFIG = """\
+apiVersion: v1
+kind: Config
+clusters:
+- name: fake
+  cluster:
+    server: {server}
+users:
+- name: fake
+  user:
+    token: fake
+contexts:
+- name: fake
+  context:
+    cluster: fake
+    user: fake
+current-context: fake
+"""
+VERBS = ["create", "delete", "get", "list", "patch", "update", "watch"]
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class ResourceType:
+    group: str
+    version: str
+    plural: str
+    singular: str
+    kind: str
+    namespaced: bool = True
+    status: bool = False
+
+    @property
+    def api_version(self):
+        return f"{self.group}/{self.version}" if self.group else self.version
+
+    def discovery(self):
+        return {
+            "name": self.plural,
+            "singularName": self.singular,
+            "namespaced": self.namespaced,
+            "kind": self.kind,
+            "verbs": VERBS,
+        }
+
+
+CORE_RESOURCES = [
+    ResourceType("", "v1", "secrets", "secret", "Secret"),
+    ResourceType("", "v1", "events", "event", "Event"),
+    ResourceType("", "v1", "namespaces", "namespace", "Namespace", False),
+]
+
+
+def crd_resources(paths):
+    """
+    The resource types declared by CustomResourceDefinition YAML files
+    """
+    resources = []
+    for path in paths:
+        with open(path) as f:
+            crd = yaml.safe_load(f)
+        spec = crd["spec"]
+        for version in spec["versions"]:
+            resources.append(
+                ResourceType(
+                    spec["group"],
+                    version["name"],
+                    spec["names"]["plural"],
+                    spec["names"]["singular"],
+                    spec["names"]["kind"],
+                    spec["scope"] == "Namespaced",
+                    "status" in version.get("subresources", {}),
+                )
+            )
+    return resources
+
+
+def merge_patch(target, patch):
+    """
+    Apply an RFC 7386 JSON merge patch
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def json_patch(target, operations):
+    """
+    Apply the add, replace and remove operations of an RFC 6902 JSON patch
+    """
+    result = copy.deepcopy(target)
+    for op in operations:
+        *parents, last = [
+            p.replace("~1", "/").replace("~0", "~")
+            for p in op["path"].lstrip("/").split("/")
+        ]
+        node = result
+        for part in parents:
+            node = node[int(part)] if isinstance(node, list) else node[part]
+        if isinstance(node, list):
+            index = len(node) if last == "-" else int(last)
+            if op["op"] == "remove":
+                del node[index]
+            elif op["op"] == "add":
+                node.insert(index, op["value"])
+            else:
+                node[index] = op["value"]
+        elif op["op"] == "remove":
+            del node[last]
+        else:
+            node[last] = op["value"]
+    return result
+
+
+def status(code, reason, message=""):
+    return web.json_response(
+        {
+            "kind": "Status",
+            "apiVersion": "v1",
+            "status": "Failure",
+            "reason": reason,
+            "message": message,
+            "code": code,
+        },
+        status=code,
+    )
+
+
+@attr.s(auto_attribs=True)
+class FakeKube:
+    """
+    Objects are kept per resource type and namespace/name. Each write bumps
+    a global resourceVersion and is appended to the type's event history,
+    which watches replay from the version they ask for. ``on_write``
+    callbacks see every event, e.g. to detect when objects converge.
+    """
+
+    resources: List[ResourceType]
+    calls: Counter = attr.ib(factory=Counter, init=False)
+    # Request body bytes of writes, by the same keys as calls
+    written: Counter = attr.ib(factory=Counter, init=False)
+    on_write: List[Callable[[str, ResourceType, dict], None]] = attr.ib(
+        factory=list, init=False
+    )
+    _objects: Dict[ResourceType, Dict[Tuple[str, str], dict]] = attr.ib(
+        init=False
+    )
+    _history: Dict[ResourceType, List[Tuple[int, str, dict]]] = attr.ib(
+        init=False
+    )
+    _version: int = attr.ib(default=0, init=False)
+    _changed: asyncio.Event = attr.ib(factory=asyncio.Event, init=False)
+    _runner: Optional[web.AppRunner] = attr.ib(default=None, init=False)
+    url: Optional[str] = attr.ib(default=None, init=False)
+
+    @_objects.default
+    def _objects_default(self):
+        return {r: {} for r in self.resources}
+
+    @_history.default
+    def _history_default(self):
+        return {r: [] for r in self.resources}
+
+    def resource(self, group, version, plural):
+        for r in self.resources:
+            if (r.group, r.version, r.plural) == (group, version, plural):
+                return r
+        return None
+
+    def kind(self, kind):
+        return next(r for r in self.resources if r.kind == kind)
+
+    def get(self, rtype, namespace, name):
+        return self._objects[rtype].get((namespace or "", name))
+
+    def objects(self, rtype):
+        return list(self._objects[rtype].values())
+
+    def _record(self, event, rtype, obj):
+        self._version += 1
+        obj["metadata"]["resourceVersion"] = str(self._version)
+        self._history[rtype].append((self._version, event, copy.deepcopy(obj)))
+        self._changed.set()
+        self._changed = asyncio.Event()
+        for callback in self.on_write:
+            callback(event, rtype, obj)
+
+    # Writes, used both by the HTTP handlers and directly by load drivers
+
+    def create(self, rtype, body):
+        meta = body.setdefault("metadata", {})
+        namespace = meta.get("namespace", "") if rtype.namespaced else ""
+        key = (namespace, meta["name"])
+        if key in self._objects[rtype]:
+            return None
+        obj = copy.deepcopy(body)
+        obj.update(apiVersion=rtype.api_version, kind=rtype.kind)
+        obj["metadata"].update(
+            uid=str(uuid.uuid4()),
+            generation=1,
+            creationTimestamp=time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
+            ),
+        )
+        self._objects[rtype][key] = obj
+        self._record("ADDED", rtype, obj)
+        return obj
+
+    def replace(self, rtype, obj, new):
+        """
+        Store a modified copy of an object, removing it once it is being
+        deleted and has no finalizers left
+        """
+        key = (obj["metadata"].get("namespace", ""), obj["metadata"]["name"])
+        if new.get("spec") != obj.get("spec"):
+            new["metadata"]["generation"] = obj["metadata"]["generation"] + 1
+        meta = new["metadata"]
+        if meta.get("deletionTimestamp") and not meta.get("finalizers"):
+            self._remove(rtype, key)
+            return new
+        self._objects[rtype][key] = new
+        self._record("MODIFIED", rtype, new)
+        return new
+
+    def patch(self, rtype, namespace, name, patch, subresource=None):
+        obj = self.get(rtype, namespace, name)
+        if obj is None:
+            return None
+        if isinstance(patch, list):
+            new = json_patch(obj, patch)
+        elif subresource == "status":
+            new = merge_patch(obj, {"status": patch.get("status")})
+        else:
+            if rtype.status:
+                patch = {k: v for k, v in patch.items() if k != "status"}
+            new = merge_patch(obj, patch)
+        for field in ("uid", "name", "namespace", "creationTimestamp"):
+            if field in obj["metadata"]:
+                new["metadata"][field] = obj["metadata"][field]
+        return self.replace(rtype, obj, new)
+
+    def delete(self, rtype, namespace, name):
+        obj = self.get(rtype, namespace, name)
+        if obj is None:
+            return None
+        if obj["metadata"].get("finalizers"):
+            if not obj["metadata"].get("deletionTimestamp"):
+                new = copy.deepcopy(obj)
+                new["metadata"]["deletionTimestamp"] = time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
+                )
+                return self.replace(rtype, obj, new)
+            return obj
+        self._remove(rtype, (namespace or "", name))
+        return obj
+
+    def _remove(self, rtype, key):
+        obj = self._objects[rtype].pop(key)
+        self._record("DELETED", rtype, obj)
+        # Garbage collect the objects it owned
+        uid = obj["metadata"]["uid"]
+        for other in self.resources:
+            for owned in list(self._objects[other].values()):
+                refs = owned["metadata"].get("ownerReferences", [])
+                if any(ref.get("uid") == uid for ref in refs):
+                    meta = owned["metadata"]
+                    self.delete(other, meta.get("namespace"), meta["name"])
+
+    # HTTP
+
+    def _resolve(self, request):
+        info = request.match_info
+        rtype = self.resource(
+            info.get("group", ""), info["version"], info["plural"]
+        )
+        if rtype is None:
+            raise web.HTTPNotFound()
+        return rtype, info.get("namespace"), info.get("name")
+
+    def _group(self, group):
+        versions = [
+            {"groupVersion": f"{group}/{v}", "version": v}
+            for v in sorted(
+                {r.version for r in self.resources if r.group == group}
+            )
+        ]
+        return {
+            "name": group,
+            "versions": versions,
+            "preferredVersion": versions[0],
+        }
+
+    async def _discovery(self, request):
+        self.calls["get", "discovery"] += 1
+        path = request.path.rstrip("/")
+        if path == "/version":
+            return web.json_response({"major": "1", "minor": "24"})
+        if path == "/api":
+            return web.json_response(
+                {"kind": "APIVersions", "versions": ["v1"]}
+            )
+        if path == "/apis":
+            groups = sorted({r.group for r in self.resources if r.group})
+            return web.json_response(
+                {
+                    "kind": "APIGroupList",
+                    "groups": [self._group(group) for group in groups],
+                }
+            )
+        group = request.match_info.get("group", "")
+        version = request.match_info["version"]
+        resources = [
+            r
+            for r in self.resources
+            if (r.group, r.version) == (group, version)
+        ]
+        if not resources:
+            raise web.HTTPNotFound()
+        listed = [r.discovery() for r in resources]
+        listed += [
+            {**r.discovery(), "name": f"{r.plural}/status"}
+            for r in resources
+            if r.status
+        ]
+        return web.json_response(
+            {
+                "kind": "APIResourceList",
+                "groupVersion": resources[0].api_version,
+                "resources": listed,
+            }
+        )
+
+    async def _collection(self, request):
+        rtype, namespace, _ = self._resolve(request)
+        if request.method == "POST":
+            body = await self._body(request, "create", rtype)
+            if namespace:
+                body.setdefault("metadata", {})["namespace"] = namespace
+            if rtype.kind == "Event" and not body["metadata"].get("name"):
+                body["metadata"]["name"] = uuid.uuid4().hex
+            obj = self.create(rtype, body)
+            if obj is None:
+                return status(409, "AlreadyExists")
+            return web.json_response(obj, status=201)
+        if request.query.get("watch") in ("true", "1"):
+            self.calls["watch", rtype.plural] += 1
+            return await self._watch(request, rtype, namespace)
+        self.calls["list", rtype.plural] += 1
+        return web.json_response(
+            {
+                "apiVersion": rtype.api_version,
+                "kind": f"{rtype.kind}List",
+                "metadata": {"resourceVersion": str(self._version)},
+                "items": [
+                    obj
+                    for obj in self.objects(rtype)
+                    if namespace is None
+                    or obj["metadata"].get("namespace") == namespace
+                ],
+            }
+        )
+
+    async def _watch(self, request, rtype, namespace):
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/json"}
+        )
+        await response.prepare(request)
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + float(
+            request.query.get("timeoutSeconds") or 300
+        )
+        history = self._history[rtype]
+        since = request.query.get("resourceVersion")
+        if since:
+            position = bisect.bisect_right(
+                [v for v, _, _ in history], int(since)
+            )
+            pending = []
+        else:
+            position = len(history)
+            pending = [("ADDED", obj) for obj in self.objects(rtype)]
+        try:
+            while True:
+                # Writes made while sending wake the wait below at once
+                changed = self._changed
+                pending += [(e, o) for _, e, o in history[position:]]
+                position = len(history)
+                lines = [
+                    json.dumps({"type": event, "object": obj}) + "\n"
+                    for event, obj in pending
+                    if namespace is None
+                    or obj["metadata"].get("namespace") == namespace
+                ]
+                pending = []
+                if lines:
+                    await response.write("".join(lines).encode())
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        return response
+
+    async def _body(self, request, verb, rtype):
+        self.calls[verb, rtype.plural] += 1
+        self.written[verb, rtype.plural] += len(await request.read())
+        return await request.json()
+
+    async def _item(self, request):
+        rtype, namespace, name = self._resolve(request)
+        subresource = request.match_info.get("subresource")
+        if request.method == "GET":
+            self.calls["get", rtype.plural] += 1
+            obj = self.get(rtype, namespace, name)
+        elif request.method == "DELETE":
+            self.calls["delete", rtype.plural] += 1
+            obj = self.delete(rtype, namespace, name)
+        elif request.method == "PATCH":
+            body = await self._body(request, "patch", rtype)
+            obj = self.patch(rtype, namespace, name, body, subresource)
+        else:
+            body = await self._body(request, "update", rtype)
+            obj = self.get(rtype, namespace, name)
+            if obj is not None:
+                obj = self.replace(rtype, obj, body)
+        if obj is None:
+            return status(404, "NotFound", f"{rtype.plural} {name} not found")
+        return web.json_response(obj)
+
+    def app(self):
+        app = web.Application()
+        for prefix in ("/api/{version}", "/apis/{group}/{version}"):
+            namespaced = prefix + "/namespaces/{namespace}/{plural}"
+            app.router.add_route("*", namespaced, self._collection)
+            app.router.add_route("*", namespaced + "/{name}", self._item)
+            app.router.add_route(
+                "*", namespaced + "/{name}/{subresource}", self._item
+            )
+            app.router.add_get(prefix, self._discovery)
+            app.router.add_get(prefix + "/", self._discovery)
+            app.router.add_route("*", prefix + "/{plural}", self._collection)
+            app.router.add_route("*", prefix + "/{plural}/{name}", self._item)
+        for path in ("/version", "/api", "/apis"):
+            app.router.add_get(path, self._discovery)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def kubeconfig(self):
+        return KUBECONFIG.format(server=self.url)
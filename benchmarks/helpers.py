@@ -0,0 +1,152 @@
+# To get nicer type annotations in Python 3.7 and 3.8.
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from typing import Awaitable, Callable, List
+
+import asyncpg  # type: ignore
+import attr  # type: ignore
+
+BACKENDS_QUERY = (
+    "SELECT count(*) FROM pg_stat_activity "
+    "WHERE backend_type = 'client backend' AND pid <> pg_backend_pid()"
+)
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of a list of numbers
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class ErrorCounter(logging.Handler):
+    """
+    Counts the "Error info" records the Database methods log instead of
+    raising
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.errors = 0
+
+    def emit(self, record):
+        if record.getMessage().startswith("Error info"):
+            self.errors += 1
+
+
+def quiet_logger(name):
+    logger = logging.getLogger(f"benchmarks.{name}")
+    logger.propagate = False
+    logger.handlers = [ErrorCounter()]
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+@attr.s(auto_attribs=True)
+class BackendSampler:
+    """
+    Polls pg_stat_activity on its own connection and keeps the highest
+    number of client backends seen
+    """
+
+    dsn: str
+    interval: float = 0.01
+    peak: int = 0
+    _conn: asyncpg.Connection = attr.ib(default=None, init=False)
+    _task: asyncio.Task = attr.ib(default=None, init=False)
+
+    async def _sample(self):
+        self.peak = max(self.peak, await self._conn.fetchval(BACKENDS_QUERY))
+
+    async def _run(self):
+        while True:
+            await self._sample()
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self._conn = await asyncpg.connect(self.dsn)
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        try:
+            # Pooled connections left open count towards the peak too
+            await self._sample()
+        finally:
+            await self._conn.close()
+
+
+@attr.s(auto_attribs=True)
+class Measurement:
+    operations: int
+    failed: int
+    errors: int
+    seconds: float
+    latencies: List[float]
+    peak_backends: int
+
+    def as_dict(self):
+        return {
+            "operations": self.operations,
+            "failed": self.failed,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 6),
+            "throughput": (
+                round(self.operations / self.seconds, 3)
+                if self.seconds
+                else 0.0
+            ),
+            "p50": round(percentile(self.latencies, 50), 6),
+            "p99": round(percentile(self.latencies, 99), 6),
+            "peak_backends": self.peak_backends,
+        }
+
+
+async def measure(
+    dsn,
+    operations: List[Callable[[], Awaitable[object]]],
+    concurrency,
+    logger,
+):
+    """
+    Run the operations with at most ``concurrency`` in flight, timing each
+    one and sampling server backends while they run. An operation fails if
+    it returns False or logs an error.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    counter = logger.handlers[0]
+    counter.errors = 0
+    failed = 0
+
+    async def timed(operation):
+        nonlocal failed
+        async with semaphore:
+            start = time.monotonic()
+            result = await operation()
+            latencies.append(time.monotonic() - start)
+            if result is False:
+                failed += 1
+
+    async with BackendSampler(dsn) as sampler:
+        start = time.monotonic()
+        await asyncio.gather(*(timed(op) for op in operations))
+        seconds = time.monotonic() - start
+    return Measurement(
+        len(operations),
+        failed,
+        counter.errors,
+        seconds,
+        latencies,
+        sampler.peak,
+    )
@@ -0,0 +1,386 @@
+"""
+Load test of the operator without Kubernetes: the real handlers run under
+kopf against a fake API server (benchmarks.fakekube) and a local Postgres,
+while streams of create, update, delete and resume events for thousands
+of CRs are applied to the fake API. Reports how long each phase took to
+converge and the API calls the operator made.
+
+    python -m benchmarks.load --databases 1000 --users 1
+    python -m benchmarks.load --databases 100 --record events.jsonl
+    python -m benchmarks.load --replay events.jsonl
+
+The operator reads its usual POSTGRES_* settings from the environment.
+"""
+
+# To get nicer type annotations in Python 3.7 and 3.8.
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import asyncpg  # type: ignore
+import attr  # type: ignore
+import kopf  # type: ignore
+from prometheus_client import REGISTRY  # type: ignore
+
+# Registers the operator's handlers with kopf
+from database_operator import handlers  # noqa: F401
+
+from .fakekube import CORE_RESOURCES, FakeKube, crd_resources
+from .helpers import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CRDS = [
+    os.path.join(ROOT, f)
+    for f in (
+        "postgres_crd.yaml",
+        "postgresuser_crd.yaml",
+        "postgresfleet_crd.yaml",
+    )
+]
+NAMESPACE = "load"
+PREFIX = "load_"
+# Handlers that run on resume, by the kind they handle
+RESUME_HANDLERS = {
+    "Postgres": "resume_fn",
+    "PostgresUser": "create_user_fn",
+    "PostgresFleet": "reconcile_fleet_fn",
+}
+
+
+def generate(databases, users, items, extensions):
+    """
+    The events of a create, grant, update, resume and delete run over
+    ``databases`` Postgres CRs with ``users`` PostgresUsers each
+    """
+    events: List[dict] = []
+    specs = {}
+    for i in range(databases):
+        specs[i] = {
+            "database": f"{PREFIX}{i}",
+            "schemas": [f"s{j}" for j in range(items)],
+            "extensions": list(extensions),
+            "dropOnDelete": True,
+        }
+        events.append(
+            event("create", "create", "Postgres", f"load-{i}", specs[i])
+        )
+    for i, u in itertools.product(range(databases), range(users)):
+        spec = {
+            "database": f"{PREFIX}{i}",
+            "role": f"{PREFIX}{i}_{u}",
+            "secretName": f"load-{i}-{u}",
+        }
+        events.append(
+            event("grant", "create", "PostgresUser", f"load-{i}-{u}", spec)
+        )
+    for i in range(databases):
+        spec = {**specs[i], "schemas": specs[i]["schemas"] + ["added"]}
+        events.append(event("update", "update", "Postgres", f"load-{i}", spec))
+    events.append({"phase": "resume", "action": "resume"})
+    for i, u in itertools.product(range(databases), range(users)):
+        events.append(
+            event("delete", "delete", "PostgresUser", f"load-{i}-{u}")
+        )
+    for i in range(databases):
+        events.append(event("delete", "delete", "Postgres", f"load-{i}"))
+    return events
+
+
+def event(phase, action, kind, name, spec=None):
+    record = {
+        "phase": phase,
+        "action": action,
+        "kind": kind,
+        "namespace": NAMESPACE,
+        "name": name,
+    }
+    if spec is not None:
+        record["spec"] = spec
+    return record
+
+
+def phases(events):
+    """
+    Group consecutive events of the same phase
+    """
+    return [
+        (phase, list(group))
+        for phase, group in itertools.groupby(events, lambda e: e["phase"])
+    ]
+
+
+def handler_successes(handler):
+    calls = REGISTRY.get_sample_value(
+        "dboperator_handler_duration_seconds_count", {"handler": handler}
+    )
+    errors = REGISTRY.get_sample_value(
+        "dboperator_handler_errors_total", {"handler": handler}
+    )
+    return (calls or 0) - (errors or 0)
+
+
+@attr.s(auto_attribs=True)
+class Convergence:
+    """
+    Tracks objects until the operator has handled their latest spec, as
+    recorded in kopf's diffbase, or until they are gone after a delete
+    """
+
+    kube: FakeKube
+    settings: kopf.OperatorSettings
+    pending: Dict[Tuple[str, str, str], Tuple[str, float]] = attr.ib(
+        factory=dict, init=False
+    )
+    latencies: List[float] = attr.ib(factory=list, init=False)
+
+    def __attrs_post_init__(self):
+        self.kube.on_write.append(self.observe)
+
+    def expect(self, action, kind, namespace, name):
+        self.pending[kind, namespace, name] = (action, time.monotonic())
+
+    def converged(self, action, obj):
+        if action == "delete":
+            return obj is None
+        if obj is None:
+            return False
+        essence = self.settings.persistence.diffbase_storage.fetch(
+            body=kopf.Body(obj)
+        )
+        return essence is not None and essence.get("spec") == obj.get("spec")
+
+    def observe(self, event, rtype, obj):
+        meta = obj["metadata"]
+        key = (rtype.kind, meta.get("namespace", ""), meta["name"])
+        if key not in self.pending:
+            return
+        action, start = self.pending[key]
+        if self.converged(action, None if event == "DELETED" else obj):
+            del self.pending[key]
+            self.latencies.append(time.monotonic() - start)
+
+
+@attr.s(auto_attribs=True)
+class Operator:
+    """
+    Runs the operator's kopf handlers in this process until stopped
+    """
+
+    settings: kopf.OperatorSettings
+    _stop: Optional[asyncio.Event] = attr.ib(default=None, init=False)
+    _task: Optional[asyncio.Future] = attr.ib(default=None, init=False)
+
+    async def start(self):
+        self._stop, ready = asyncio.Event(), asyncio.Event()
+        self._task = asyncio.ensure_future(
+            kopf.operator(
+                settings=self.settings,
+                clusterwide=True,
+                standalone=True,
+                stop_flag=self._stop,
+                ready_flag=ready,
+            )
+        )
+        await ready.wait()
+
+    async def stop(self):
+        self._stop.set()
+        await self._task
+
+
+async def run_phase(kube, operator, convergence, phase, events, rate, timeout):
+    calls, written = Counter(kube.calls), Counter(kube.written)
+    start = time.monotonic()
+    convergence.latencies = []
+    resumed: Dict[str, float] = {}
+    expected_resumes = 0
+    unresumed = 0
+    for record in events:
+        action = record["action"]
+        if action == "resume":
+            await operator.stop()
+            for kind, handler in RESUME_HANDLERS.items():
+                count = len(kube.objects(kube.kind(kind)))
+                resumed[handler] = handler_successes(handler) + count
+                expected_resumes += count
+            start = time.monotonic()
+            await operator.start()
+            continue
+        rtype = kube.kind(record["kind"])
+        namespace, name = record["namespace"], record["name"]
+        convergence.expect(action, record["kind"], namespace, name)
+        if action == "create":
+            kube.create(
+                rtype,
+                {
+                    "metadata": {"namespace": namespace, "name": name},
+                    "spec": record["spec"],
+                },
+            )
+        elif action == "update":
+            kube.patch(rtype, namespace, name, {"spec": record["spec"]})
+        else:
+            kube.delete(rtype, namespace, name)
+        if rate:
+            await asyncio.sleep(1 / rate)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        unresumed = sum(
+            max(0, n - handler_successes(h)) for h, n in resumed.items()
+        )
+        if not convergence.pending and not unresumed:
+            break
+        await asyncio.sleep(0.05)
+    seconds = time.monotonic() - start
+    made = Counter(kube.calls)
+    made.subtract(calls)
+    sent = Counter(kube.written)
+    sent.subtract(written)
+    latencies = convergence.latencies
+    return {
+        "phase": phase,
+        "events": len(events),
+        "seconds": round(seconds, 3),
+        "converged": len(latencies),
+        # Resumes are counted from handler metrics, without latencies
+        "resumed": expected_resumes - unresumed,
+        "pending": len(convergence.pending) + unresumed,
+        "p50": round(percentile(latencies, 50), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(max(latencies, default=0.0), 3),
+        "api_calls": sum(made.values()),
+        "api_calls_by_request": {
+            f"{verb} {plural}": n
+            for (verb, plural), n in sorted(made.items())
+            if n
+        },
+        "api_write_bytes": sum(sent.values()),
+        "api_write_bytes_by_request": {
+            f"{verb} {plural}": n
+            for (verb, plural), n in sorted(sent.items())
+            if n
+        },
+    }
+
+
+async def drop_leftovers():
+    conn = await asyncpg.connect(
+        user=os.getenv("POSTGRES_USER", "postgres"),
+        password=os.getenv("POSTGRES_PASS", "somePassword"),
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=int(os.getenv("POSTGRES_PORT", 5432)),
+        database=os.getenv("POSTGRES_DEFAULT_DATABASE", "postgres"),
+    )
+    try:
+        like = PREFIX.replace("_", r"\_") + "%"
+        for row in await conn.fetch(
+            "SELECT datname FROM pg_database WHERE datname LIKE $1", like
+        ):
+            await conn.execute(
+                f'DROP DATABASE IF EXISTS "{row["datname"]}" WITH (FORCE)'
+                if conn.get_server_version().major >= 13
+                else f'DROP DATABASE IF EXISTS "{row["datname"]}"'
+            )
+        for row in await conn.fetch(
+            "SELECT rolname FROM pg_roles WHERE rolname LIKE $1", like
+        ):
+            await conn.execute(f'DROP ROLE IF EXISTS "{row["rolname"]}"')
+    finally:
+        await conn.close()
+
+
+async def run(events, rate=0.0, timeout=600.0):
+    """
+    Apply the events phase by phase, returning a report per phase
+    """
+    kube = FakeKube(CORE_RESOURCES + crd_resources(CRDS))
+    await kube.start()
+    kube.create(kube.kind("Namespace"), {"metadata": {"name": NAMESPACE}})
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml") as kubeconfig:
+        kubeconfig.write(kube.kubeconfig())
+        kubeconfig.flush()
+        os.environ["KUBECONFIG"] = kubeconfig.name
+        os.environ.setdefault("METRICS_PORT", "0")
+        await drop_leftovers()
+        settings = kopf.OperatorSettings()
+        operator = Operator(settings)
+        convergence = Convergence(kube, settings)
+        await operator.start()
+        try:
+            return [
+                await run_phase(
+                    kube, operator, convergence, phase, group, rate, timeout
+                )
+                for phase, group in phases(events)
+            ]
+        finally:
+            await operator.stop()
+            await kube.stop()
+            await drop_leftovers()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--databases", type=int, default=100)
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--schemas", type=int, default=5)
+    parser.add_argument("--extensions", default="plpgsql")
+    parser.add_argument("--replay", help="JSON lines of events to apply")
+    parser.add_argument("--record", help="write the generated events here")
+    parser.add_argument(
+        "--rate", type=float, default=0.0, help="events/s, 0 for bursts"
+    )
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--output", default="load-results.json")
+    args = parser.parse_args(argv)
+    if args.replay:
+        with open(args.replay) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = generate(
+            args.databases,
+            args.users,
+            args.schemas,
+            [e for e in args.extensions.split(",") if e],
+        )
+    if args.record:
+        with open(args.record, "w") as f:
+            f.writelines(json.dumps(e) + "\n" for e in events)
+    # Log at INFO like `kopf run`, so as many k8s Events are posted, but
+    # only print warnings
+    logging.basicConfig()
+    logging.getLogger().handlers[0].setLevel(logging.WARNING)
+    logging.getLogger().setLevel(logging.INFO)
+    results = asyncio.run(run(events, args.rate, args.timeout))
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "events": len(events),
+        "phases": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for result in results:
+        done = result["converged"] + result["resumed"]
+        print(
+            f"{result['phase']:>8}: {done}/{done + result['pending']} "
+            f"converged in {result['seconds']}s "
+            f"(p50 {result['p50']}s, p99 {result['p99']}s), "
+            f"{result['api_calls']} API calls "
+            f"({result['api_write_bytes']} bytes written), "
+            f"{result['pending']} pending"
+        )
+    return 1 if any(r["pending"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+"""
+A small run of the load harness, checking that every phase converges
+"""
+
+import pytest  # type: ignore
+
+from . import load
+
+
+@pytest.mark.asyncio
+async def test_load_harness_converges(server, monkeypatch):
+    monkeypatch.setenv("POSTGRES_HOST", server["host"])
+    monkeypatch.setenv("POSTGRES_PORT", str(server["port"]))
+    monkeypatch.setenv("POSTGRES_USER", server["user"])
+    monkeypatch.setenv("POSTGRES_PASS", server["password"])
+    monkeypatch.setenv("SPEC_QUIET_WINDOW", "0.1")
+    results = await load.run(load.generate(5, 1, 2, ["plpgsql"]), timeout=60)
+    assert [r["phase"] for r in results] == [
+        "create",
+        "grant",
+        "update",
+        "resume",
+        "delete",
+    ]
+    assert all(r["pending"] == 0 for r in results)
+    assert results[3]["resumed"] == 10
+    assert results[-1]["converged"] == 10
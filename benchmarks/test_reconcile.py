@@ -0,0 +1,89 @@
+"""
+Benchmarks of the Database reconcile paths against a real Postgres.
+
+Run with ``tox -e bench`` or ``pytest benchmarks``; BENCHMARK_SCALE=full
+covers up to 1,000 databases and 200 schemas per database. Results are
+written as JSON to BENCHMARK_OUTPUT and can be compared across runs with
+``python -m benchmarks.compare old.json new.json``.
+"""
+
+import os
+
+import pytest  # type: ignore
+
+from database_operator.databases import Database
+
+from .conftest import PREFIX, connection, dsn
+from .helpers import measure, quiet_logger
+
+# Extensions must be installed on the server; only plpgsql is everywhere
+EXTENSIONS = [
+    e for e in os.getenv("BENCHMARK_EXTENSIONS", "plpgsql").split(",") if e
+]
+
+
+async def run_phases(server, results, benchmark, concurrency, count, items):
+    """
+    Create, update and delete ``count`` databases with ``items`` schemas
+    each, recording every phase
+    """
+    logger = quiet_logger(benchmark)
+    phases = [
+        ("create", lambda db: db.create_database(logger)),
+        (
+            "update",
+            lambda db: db.update_database(
+                [], [], ["added"], db.schemas[:1], logger
+            ),
+        ),
+        ("delete", lambda db: db.delete_database(logger)),
+    ]
+    async with connection(server) as conn_obj:
+        databases = [
+            Database(
+                f"{PREFIX}{i}",
+                True,
+                [f"s{j}" for j in range(items)],
+                list(EXTENSIONS),
+                conn_obj,
+            )
+            for i in range(count)
+        ]
+        for phase, operation in phases:
+            measurement = await measure(
+                dsn(server),
+                [lambda db=db: operation(db) for db in databases],
+                concurrency,
+                logger,
+            )
+            results.append(
+                {
+                    "benchmark": benchmark,
+                    "phase": phase,
+                    "databases": count,
+                    "items": items + len(EXTENSIONS),
+                    "concurrency": concurrency,
+                    **measurement.as_dict(),
+                }
+            )
+            assert measurement.failed == measurement.errors == 0, results[-1]
+
+
+@pytest.mark.asyncio
+async def test_database_count(server, results, databases, concurrency):
+    """
+    Many small databases: connection handling and pool churn
+    """
+    await run_phases(
+        server, results, "database_count", concurrency, databases, 2
+    )
+
+
+@pytest.mark.asyncio
+async def test_items_per_database(server, results, items, concurrency):
+    """
+    One database per worker with many schemas: DDL batching
+    """
+    await run_phases(
+        server, results, "items_per_database", concurrency, concurrency, items
+    )
@@ -36,6 +36,7 @@ setup(
         "asyncio>=3.4.3",
         "asyncpg>=0.25.0",
         "psycopg2==2.9.3",
+        "prometheus-client",
     ],
     extras_require={
         "dev": [
@@ -0,0 +1,104 @@
+"""
+Protecting unhealthy Postgres servers from reconnect storms
+"""
+
+import asyncio
+import random
+import time
+
+import asyncpg  # type: ignore
+import attr  # type: ignore
+
+from .metrics import CIRCUIT_OPEN
+
+# Errors that say the server cannot be reached or cannot take connections
+# right now, as opposed to a problem with what was asked of it
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.AdminShutdownError,
+    asyncpg.CrashShutdownError,
+)
+# Errors about objects other sessions are using, which clear up by
+# themselves, e.g. a template being copied while someone is connected
+BUSY_ERRORS = (asyncpg.ObjectInUseError,)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, server, retry_after):
+        super().__init__(
+            f"Postgres server {server} is unavailable, "
+            f"retrying in {retry_after:.0f}s"
+        )
+        self.retry_after = retry_after
+
+
+def is_transient(exc):
+    return isinstance(exc, (CircuitOpenError, *TRANSIENT_ERRORS, *BUSY_ERRORS))
+
+
+def backoff_delay(retry, base=5.0, cap=300.0, minimum=0.0):
+    """
+    Exponential backoff for the ``retry``-th retry with equal jitter, so
+    reconciles failing together do not all come back at once
+    """
+    delay = max(min(cap, base * 2**retry), minimum)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+@attr.s(auto_attribs=True)
+class CircuitBreaker:
+    """
+    Opens after ``threshold`` consecutive transient connection failures to
+    a server. While open, connection attempts fail immediately; after
+    ``reset_timeout`` seconds a single attempt is let through, closing the
+    breaker if it succeeds and reopening it if not.
+    """
+
+    name: str = "default"
+    threshold: int = 5
+    reset_timeout: float = 10.0
+    _failures: int = attr.ib(default=0, init=False)
+    _opened_at: float = attr.ib(default=None, init=False)
+    _probing: bool = attr.ib(default=False, init=False)
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def check(self):
+        """
+        Raise CircuitOpenError unless a connection may be attempted
+        """
+        if self._opened_at is None:
+            return
+        retry_after = self._opened_at + self.reset_timeout - time.monotonic()
+        if retry_after > 0 or self._probing:
+            raise CircuitOpenError(self.name, max(retry_after, 0))
+        self._probing = True
+
+    def abandon_probe(self):
+        """
+        Let another attempt probe the server after one was cancelled
+        before its outcome was known
+        """
+        self._probing = False
+
+    def record(self, error=None):
+        """
+        Record the outcome of a connection attempt
+        """
+        if error is None or not is_transient(error):
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            CIRCUIT_OPEN.labels(self.name).set(0)
+            return
+        self._failures += 1
+        if self._probing or self._failures >= self.threshold:
+            self._opened_at = time.monotonic()
+            self._probing = False
+            CIRCUIT_OPEN.labels(self.name).set(1)
@@ -0,0 +1,201 @@
+"""
+Reading the state of databases, schemas and extensions from the Postgres
+catalogs, probing what a server supports, and fingerprinting Postgres
+specs to compare against it
+"""
+
+import abc
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+import attr  # type: ignore
+
+DATABASES_QUERY = (
+    "SELECT datname FROM pg_database "
+    "WHERE NOT datistemplate AND datallowconn"
+)
+OBJECTS_QUERY = (
+    "SELECT 'schema' AS kind, nspname AS name FROM pg_namespace "
+    "UNION ALL SELECT 'extension', extname FROM pg_extension"
+)
+CAPABILITIES_QUERY = (
+    "SELECT current_setting('server_version_num')::int AS version, "
+    "array(SELECT name FROM pg_available_extensions) AS extensions, "
+    "(SELECT json_object_agg(e.name, coalesce(v.requires, '{}')) "
+    "FROM pg_available_extensions e JOIN pg_available_extension_versions v "
+    "ON v.name = e.name AND v.version = e.default_version) AS requires"
+)
+# DROP DATABASE ... WITH (FORCE) was added in PostgreSQL 13
+FORCE_DROP_VERSION = 130000
+
+
+def objects_fingerprint(schemas, extensions):
+    """
+    Hash a set of schemas and extensions, ignoring their order
+    """
+    state = {
+        "schemas": sorted(set(schemas)),
+        "extensions": sorted(set(extensions)),
+    }
+    encoded = json.dumps(state, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def spec_fingerprint(spec):
+    """
+    Hash the parts of a Postgres spec that describe database state.
+    Schemas and extensions are sorted since their order does not matter.
+    """
+    state = {
+        "database": spec["database"],
+        "schemas": sorted(set(spec.get("schemas", []))),
+        "extensions": sorted(set(spec.get("extensions", []))),
+    }
+    encoded = json.dumps(state, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class DatabaseObjects:
+    schemas: FrozenSet[str]
+    extensions: FrozenSet[str]
+
+    @classmethod
+    async def fetch(cls, conn):
+        """
+        Read the schemas and extensions of a database in one query
+        """
+        rows = await conn.fetch(OBJECTS_QUERY)
+        return cls(
+            frozenset(r["name"] for r in rows if r["kind"] == "schema"),
+            frozenset(r["name"] for r in rows if r["kind"] == "extension"),
+        )
+
+    def missing(self, schemas, extensions):
+        """
+        Return the requested schemas and extensions that do not exist,
+        preserving their order
+        """
+        return (
+            [s for s in schemas if s not in self.schemas],
+            [e for e in extensions if e not in self.extensions],
+        )
+
+
+async def fetch_databases(conn):
+    return frozenset(r["datname"] for r in await conn.fetch(DATABASES_QUERY))
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class ServerCapabilities:
+    version: int
+    extensions: FrozenSet[str]
+    # The extensions each available extension's default version requires
+    requires: Dict[str, Tuple[str, ...]] = attr.ib(factory=dict, eq=False)
+
+    @classmethod
+    async def fetch(cls, conn):
+        row = await conn.fetchrow(CAPABILITIES_QUERY)
+        requires = json.loads(row["requires"] or "{}")
+        return cls(
+            row["version"],
+            frozenset(row["extensions"]),
+            {name: tuple(deps) for name, deps in requires.items()},
+        )
+
+    @property
+    def force_drop(self):
+        return self.version >= FORCE_DROP_VERSION
+
+
+@attr.s(auto_attribs=True)
+class CachedProbe(abc.ABC):
+    """
+    Caches the result of ``fetch`` against a server for ``ttl`` seconds.
+    Callers arriving while a refresh is running share its result, so a
+    burst of reconciles costs one query.
+    """
+
+    conn_obj: object
+    ttl: float = 10.0
+    _value: Optional[Any] = attr.ib(default=None, init=False)
+    _fetched_at: float = attr.ib(default=0.0, init=False)
+    _refresh: Optional[asyncio.Future] = attr.ib(default=None, init=False)
+
+    def invalidate(self):
+        self._value = None
+        self._fetched_at = 0.0
+
+    @abc.abstractmethod
+    async def fetch(self, conn):
+        """
+        Query the value to cache on a master connection
+        """
+
+    async def _fetch(self):
+        async with self.conn_obj.master_connection() as conn:  # type: ignore
+            return await self.fetch(conn)
+
+    def _refreshed(self, fut):
+        self._refresh = None
+        if not fut.cancelled() and fut.exception() is None:
+            self._value = fut.result()
+            self._fetched_at = time.monotonic()
+
+    def _start_refresh(self):
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._fetch())
+            self._refresh.add_done_callback(self._refreshed)
+        return self._refresh
+
+    async def get(self):
+        fresh = time.monotonic() - self._fetched_at < self.ttl
+        if self._value is not None and fresh:
+            return self._value
+        return await asyncio.shield(self._start_refresh())
+
+    def peek(self):
+        """
+        Return the cached value, or None, without waiting. A stale value
+        is returned as is while it is refreshed in the background.
+        """
+        if time.monotonic() - self._fetched_at >= self.ttl:
+            self._start_refresh()
+        return self._value
+
+    async def close(self):
+        """
+        Cancel a refresh still running in the background
+        """
+        refresh = self._refresh
+        if refresh is not None:
+            refresh.cancel()
+            await asyncio.gather(refresh, return_exceptions=True)
+
+
+class CatalogCache(CachedProbe):
+    """
+    The databases on a server, refreshed every ``ttl`` seconds
+    """
+
+    async def fetch(self, conn):
+        return await fetch_databases(conn)
+
+    async def databases(self):
+        return await self.get()
+
+
+@attr.s(auto_attribs=True)
+class CapabilityCache(CachedProbe):
+    """
+    The version and available extensions of a server. These only change
+    on upgrades, so they are probed once an hour.
+    """
+
+    ttl: float = 3600.0
+
+    async def fetch(self, conn):
+        return await ServerCapabilities.fetch(conn)
@@ -0,0 +1,103 @@
+"""
+Coalescing concurrent requests into batches and debouncing bursts of
+changes
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import attr  # type: ignore
+
+
+@attr.s(auto_attribs=True)
+class Batcher:
+    """
+    Collects items submitted under the same key for ``window`` seconds, or
+    until ``max_batch`` items are waiting, and passes them to
+    ``flush(key, items)`` in one call. ``flush`` returns one result per
+    item; a result that is an exception is raised to that item's caller,
+    and if ``flush`` itself raises, every caller in the batch gets the error.
+    """
+
+    flush: Callable[[Any, List[Any]], Awaitable[List[Any]]]
+    window: float = 0.1
+    max_batch: int = 100
+    _pending: Dict[Any, List[Tuple[Any, asyncio.Future]]] = attr.ib(
+        factory=dict, init=False
+    )
+
+    async def submit(self, key, item):
+        future = asyncio.get_event_loop().create_future()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            asyncio.get_event_loop().call_later(
+                self.window, self._start, key, batch
+            )
+        batch.append((item, future))
+        if len(batch) >= self.max_batch:
+            self._start(key, batch)
+        return await future
+
+    def _start(self, key, batch):
+        # The timer of a batch that was already started early is a no-op
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+            asyncio.ensure_future(self._run(key, batch))
+
+    async def _run(self, key, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await self.flush(key, items)
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+@attr.s(auto_attribs=True)
+class Debouncer:
+    """
+    Tracks when the desired state of each key last changed, so changes
+    are only acted on once a key has been quiet for ``window`` seconds.
+    """
+
+    window: float = 2.0
+    _changed: Dict[Any, Tuple[str, float]] = attr.ib(factory=dict, init=False)
+    _waits: Dict[Any, int] = attr.ib(factory=dict, init=False)
+
+    def remaining(self, key, state):
+        """
+        Return how many seconds to wait before acting on ``state``, which
+        restarts the wait if it differs from the last state seen for key
+        """
+        now = time.monotonic()
+        seen = self._changed.get(key)
+        if seen is None or seen[0] != state:
+            self._changed[key] = (state, now)
+            wait = self.window
+        else:
+            wait = max(0.0, seen[1] + self.window - now)
+        if wait > 0:
+            self._waits[key] = self._waits.get(key, 0) + 1
+        return wait
+
+    def waits(self, key):
+        """
+        How many times ``remaining`` asked to wait for key since it was
+        last settled
+        """
+        return self._waits.get(key, 0)
+
+    def settle(self, key):
+        self._waits.pop(key, None)
+
+    def forget(self, key):
+        self._changed.pop(key, None)
+        self._waits.pop(key, None)
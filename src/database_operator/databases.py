@@ -1,21 +1,58 @@
 import asyncio
-from contextlib import asynccontextmanager
-from typing import List
+import logging
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
 
 import asyncpg  # type: ignore
 import attr  # type: ignore
 
+from .breaker import CircuitBreaker, backoff_delay, is_transient
+from .catalog import (
+    CapabilityCache,
+    CatalogCache,
+    DatabaseObjects,
+    objects_fingerprint,
+)
+from .coalesce import Batcher
+from .metrics import (
+    CONNECTION_ACQUIRE,
+    OPERATION_ERRORS,
+    statement_kind,
+    timed_statement,
+)
+from .pools import PoolManager
+from .scheduler import PRIORITY_DELETE, Scheduler
+from .tracing import span
+
 LOG_SUCCESSFUL = "Successfully created {} {} in database {}"
 LOG_ESTABLISH = "Successfully established connection to database {}"
 SUCCESSFUL_REMOVE = "Successfully removed {} {} from database {}"
+TERMINATE_QUERY = (
+    "SELECT count(pg_terminate_backend(pid)) FROM pg_stat_activity "
+    "WHERE pid <> pg_backend_pid() AND datname = ANY($1::text[])"
+)
+TEMPLATE_PREFIX = "dbop_tpl_"
+TEMPLATES_QUERY = (
+    "SELECT datname FROM pg_database WHERE datistemplate AND datname LIKE $1"
+)
+
+
+def quote_literal(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def quote_ident(name):
+    return '"{}"'.format(name.replace('"', '""'))
 
 
 def add_creation(x, y):
-    return f'CREATE {y} IF NOT EXISTS "{x}"'
+    return f"CREATE {y} IF NOT EXISTS {quote_ident(x)}"
 
 
 def drop_items(x, y):
-    return f'DROP {y} IF EXISTS "{x}"'
+    return f"DROP {y} IF EXISTS {quote_ident(x)}"
 
 
 def construct_items_map(items, postgres_construct, log_stat):
@@ -23,6 +60,426 @@ def construct_items_map(items, postgres_construct, log_stat):
     return {tuple(items): [postgres_construct, log_stat]}
 
 
+@attr.s(auto_attribs=True, frozen=True)
+class DDLStep:
+    """
+    A group of statements and the message logged once they have all run
+    """
+
+    statements: Tuple[str, ...]
+    message: str
+
+
+def compile_items(items_maps, statement, log_msg, database_name):
+    """
+    Turn maps from construct_items_map into DDL steps, skipping empty ones
+    """
+    return [
+        DDLStep(
+            tuple(statement(item, construct) for item in items),
+            log_msg.format(kind, items, database_name),
+        )
+        for items_map in items_maps
+        for items, (construct, kind) in items_map.items()
+        if items
+    ]
+
+
+def update_steps(
+    database_name,
+    new_ext,
+    dropped_ext,
+    new_schemas,
+    dropped_schemas,
+    requires=None,
+):
+    """
+    The DDL steps that create new and drop removed schemas and extensions.
+    Extensions are created after, and dropped before, the extensions they
+    require.
+    """
+    new_ext = extension_order(new_ext, requires or {})
+    dropped_ext = extension_order(dropped_ext, requires or {})[::-1]
+    return compile_items(
+        [
+            construct_items_map(new_schemas, "SCHEMA", "schemas"),
+            construct_items_map(new_ext, "EXTENSION", "extensions"),
+        ],
+        add_creation,
+        LOG_SUCCESSFUL,
+        database_name,
+    ) + compile_items(
+        [
+            construct_items_map(dropped_schemas, "SCHEMA", "schemas"),
+            construct_items_map(dropped_ext, "EXTENSION", "extensions"),
+        ],
+        drop_items,
+        SUCCESSFUL_REMOVE,
+        database_name,
+    )
+
+
+def extension_order(extensions, requires):
+    """
+    Order extensions so that each comes after the requested extensions it
+    requires, which CREATE EXTENSION without CASCADE needs. Otherwise the
+    requested order is kept.
+    """
+    requested = set(extensions)
+    ordered: Dict[str, None] = {}
+    visiting = set()
+
+    def visit(name):
+        if name in ordered or name in visiting:
+            return
+        visiting.add(name)
+        for dependency in requires.get(name, ()):
+            if dependency in requested:
+                visit(dependency)
+        ordered[name] = None
+
+    for name in extensions:
+        visit(name)
+    return list(ordered)
+
+
+def creation_steps(database_name, schemas, extensions, requires=None):
+    """
+    The DDL steps that lock down a new database and create its schemas
+    and extensions, ordered by what the extensions require
+    """
+    extensions = extension_order(extensions, requires or {})
+    return [
+        DDLStep(
+            (
+                "REVOKE CREATE ON SCHEMA public FROM PUBLIC",
+                f"REVOKE ALL ON DATABASE {quote_ident(database_name)} "
+                "FROM PUBLIC",
+            ),
+            f"Revoked PUBLIC role access on {database_name}",
+        ),
+        *compile_items(
+            [
+                construct_items_map(schemas, "SCHEMA", "schemas"),
+                construct_items_map(extensions, "EXTENSION", "extensions"),
+            ],
+            add_creation,
+            LOG_SUCCESSFUL,
+            database_name,
+        ),
+    ]
+
+
+def creation_graph(database_name, schemas, extensions, requires):
+    """
+    The steps of creation_steps with one step per extension, each mapped
+    to the steps that must run before it: those of the requested
+    extensions it requires
+    """
+    graph: Dict[DDLStep, Tuple[DDLStep, ...]] = {
+        step: () for step in creation_steps(database_name, schemas, [])
+    }
+    created: Dict[str, DDLStep] = {}
+    for name in extension_order(extensions, requires):
+        (step,) = compile_items(
+            [construct_items_map([name], "EXTENSION", "extensions")],
+            add_creation,
+            LOG_SUCCESSFUL,
+            database_name,
+        )
+        graph[step] = tuple(
+            created[d] for d in requires.get(name, ()) if d in created
+        )
+        created[name] = step
+    return graph
+
+
+async def execute(conn, query, *args, kind=None):
+    """
+    Execute a statement, recording its duration by statement kind
+    """
+    kind = kind or statement_kind(query)
+    with span("sql", kind=kind), timed_statement(kind):
+        return await conn.execute(query, *args)
+
+
+async def execute_steps(conn, steps, logger, atomic_steps=False):
+    """
+    Run every statement of every step as one multi-statement query, which
+    Postgres executes as a single transaction in one round trip. If the
+    batch fails nothing has been applied, so fall back to running the
+    statements one at a time (or each step as its own transaction, with
+    ``atomic_steps``) to apply what we can and report what failed.
+    Returns whether each step was fully applied.
+    """
+    statements = [stmt for step in steps for stmt in step.statements]
+    if not statements:
+        return [True] * len(steps)
+    try:
+        await execute(conn, ";\n".join(statements), kind="BATCH")
+    except asyncpg.PostgresError as e:
+        unit = "step" if atomic_steps else "statement"
+        logger.warning(f"Batched DDL failed, retrying per {unit}: {e}")
+    else:
+        for step in steps:
+            logger.info(step.message)
+        return [True] * len(steps)
+    results = []
+    for step in steps:
+        failed = False
+        batches = (
+            [";\n".join(step.statements)] if atomic_steps else step.statements
+        )
+        for stmt in batches:
+            try:
+                await execute(conn, stmt)
+            except asyncpg.PostgresError as e:
+                failed = True
+                logger.error(f"Error info: {e}")
+        if not failed:
+            logger.info(step.message)
+        results.append(not failed)
+    return results
+
+
+async def execute_ddl(conn, steps, logger):
+    """
+    Run DDL steps with execute_steps. Returns whether every statement was
+    applied.
+    """
+    return all(await execute_steps(conn, steps, logger))
+
+
+async def execute_graph(connect, graph, width, logger):
+    """
+    Run each step of a dependency graph once the steps it depends on have
+    been applied, up to ``width`` at a time, each on a connection from
+    ``connect``. Steps after a failed one are skipped. Returns whether
+    every step was applied.
+    """
+    limit = asyncio.Semaphore(width)
+    runs: Dict[DDLStep, asyncio.Future] = {}
+
+    async def run(step):
+        if not all(await asyncio.gather(*(runs[d] for d in graph[step]))):
+            logger.error(f"Skipped {step.statements}, a dependency failed")
+            return False
+        async with limit, connect() as conn:
+            return all(await execute_steps(conn, [step], logger))
+
+    for step in graph:
+        runs[step] = asyncio.ensure_future(run(step))
+    try:
+        return all(await asyncio.gather(*runs.values()))
+    finally:
+        for task in runs.values():
+            task.cancel()
+
+
+async def drop_databases(conn_obj, names):
+    """
+    Drop databases in one master session. Servers that support it drop
+    with FORCE; on older ones the connections of every database are
+    terminated by one query first. Returns None for each database that was
+    dropped and the error for each that was not.
+    """
+    unique = list(dict.fromkeys(names))
+    for name in unique:
+        await conn_obj.release_database(name)
+    capabilities = await conn_obj.capabilities.get()
+    suffix = " WITH (FORCE)" if capabilities.force_drop else ""
+    results = {}
+    async with conn_obj.master_connection() as conn:
+        if not capabilities.force_drop:
+            await execute(conn, TERMINATE_QUERY, unique, kind="TERMINATE")
+        for name in unique:
+            try:
+                await execute(
+                    conn,
+                    f"DROP DATABASE IF EXISTS {quote_ident(name)}{suffix}",
+                )
+            except asyncpg.PostgresError as e:
+                results[name] = e
+            else:
+                results[name] = None
+    conn_obj.catalog.invalidate()
+    return [results[name] for name in names]
+
+
+@attr.s(auto_attribs=True)
+class CreateQueue:
+    """
+    Runs the CREATE DATABASE statements of a server one at a time, each
+    on a master connection taken once it is its turn, so they do not hold
+    each other's templates. Postgres refuses to copy a template that
+    another session is connected to, so that error is retried up to
+    ``retries`` times with a short backoff, outside the queue.
+    """
+
+    conn_obj: Any
+    retries: int = 5
+    delay: float = 0.1
+    _lock: Optional[asyncio.Lock] = attr.ib(default=None, init=False)
+
+    async def run(self, statement):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._lock:
+                    async with self.conn_obj.master_connection() as conn:
+                        return await execute(conn, statement)
+            except asyncpg.ObjectInUseError:
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(backoff_delay(attempt, self.delay, cap=2.0))
+
+
+class TemplateBuildError(Exception):
+    pass
+
+
+def template_name(fingerprint):
+    return TEMPLATE_PREFIX + fingerprint[:32]
+
+
+@attr.s(auto_attribs=True)
+class TemplateCache:
+    """
+    Template databases for sets of schemas and extensions that more than
+    one Postgres spec asks for. A template is built the ``min_uses``-th
+    time a set is created, after which databases with that set are
+    created as file-level copies of it. At most ``max_templates`` are
+    kept, dropping the least recently used; 0 disables templates.
+    """
+
+    conn_obj: Any
+    max_templates: int = 0
+    min_uses: int = 2
+    _uses: Dict[str, int] = attr.ib(factory=dict, init=False)
+    _templates: "OrderedDict[str, None]" = attr.ib(
+        factory=OrderedDict, init=False
+    )
+    _building: Dict[str, asyncio.Future] = attr.ib(factory=dict, init=False)
+    _in_use: Dict[str, int] = attr.ib(factory=dict, init=False)
+
+    @property
+    def templates(self):
+        return list(self._templates)
+
+    async def load(self):
+        """
+        Adopt the templates left on the server by a previous run
+        """
+        if not self.max_templates:
+            return
+        async with self.conn_obj.master_connection() as conn:
+            rows = await conn.fetch(TEMPLATES_QUERY, TEMPLATE_PREFIX + "%")
+        for row in rows:
+            self._templates[row["datname"]] = None
+
+    @asynccontextmanager
+    async def use(self, schemas, extensions, logger):
+        """
+        Yield the name of a template holding exactly these schemas and
+        extensions, or None if there is none yet. A template is not
+        evicted while it is in use.
+        """
+        # Keyed by database name, which is all load() can see
+        name = template_name(objects_fingerprint(schemas, extensions))
+        ready = False
+        if self.max_templates and (schemas or extensions):
+            try:
+                ready = await self._ready(name, schemas, extensions)
+            except Exception as e:
+                logger.warning(f"Template database not available: {e}")
+        if not ready:
+            yield None
+            return
+        self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            yield name
+        finally:
+            self._in_use[name] -= 1
+
+    async def _ready(self, name, schemas, extensions):
+        if name in self._templates:
+            self._templates.move_to_end(name)
+            return True
+        self._uses[name] = self._uses.get(name, 0) + 1
+        if self._uses[name] < self.min_uses:
+            return False
+        build = self._building.get(name)
+        if build is None:
+            build = asyncio.ensure_future(
+                self._build(name, schemas, extensions)
+            )
+            self._building[name] = build
+            build.add_done_callback(lambda _: self._building.pop(name, None))
+        await asyncio.shield(build)
+        return True
+
+    async def _build(self, name, schemas, extensions):
+        logger = logging.getLogger(__name__)
+        try:
+            async with self.conn_obj.master_connection() as conn:
+                # A build interrupted by a restart leaves a non-template
+                await execute(
+                    conn, f"DROP DATABASE IF EXISTS {quote_ident(name)}"
+                )
+            await self.conn_obj.creates.run(
+                f"CREATE DATABASE {quote_ident(name)}"
+            )
+            capabilities = await self.conn_obj.capabilities.get()
+            async with self.conn_obj.database_connection(name) as conn:
+                steps = creation_steps(
+                    name, schemas, extensions, capabilities.requires
+                )
+                built = await execute_ddl(conn, steps, logger)
+            await self.conn_obj.release_database(name)
+            async with self.conn_obj.master_connection() as conn:
+                if not built:
+                    await execute(
+                        conn, f"DROP DATABASE IF EXISTS {quote_ident(name)}"
+                    )
+                    raise TemplateBuildError(f"Could not build {name}")
+                # No connections, so copies never find it in use
+                await execute(
+                    conn,
+                    f"ALTER DATABASE {quote_ident(name)} "
+                    "WITH IS_TEMPLATE true ALLOW_CONNECTIONS false",
+                )
+        except Exception:
+            # Wait for another min_uses creates before retrying
+            self._uses[name] = 0
+            raise
+        self._templates[name] = None
+        logger.info(f"Built template database {name}")
+        await self._evict(logger)
+
+    async def _evict(self, logger):
+        while len(self._templates) > self.max_templates:
+            name = next(
+                (n for n in self._templates if not self._in_use.get(n)),
+                None,
+            )
+            if name is None:
+                return
+            del self._templates[name]
+            try:
+                async with self.conn_obj.master_connection() as conn:
+                    await execute(
+                        conn,
+                        f"ALTER DATABASE {quote_ident(name)} IS_TEMPLATE false",
+                    )
+                    await execute(
+                        conn, f"DROP DATABASE IF EXISTS {quote_ident(name)}"
+                    )
+                logger.info(f"Dropped template database {name}")
+            except Exception as e:
+                logger.warning(f"Could not drop template {name}: {e}")
+
+
 @attr.s(auto_attribs=True, frozen=True)
 class PostgresConnection:
     master_user: str
@@ -30,6 +487,84 @@ class PostgresConnection:
     postgres_host: str
     postgres_port: int
     postgres_default_database: str
+    max_connections: int = 20
+    pool_idle_ttl: float = 300.0
+    max_in_flight: int = 10
+    max_templates: int = 0
+    name: str = "default"
+    drop_batch_window: float = 0.1
+    ddl_width: int = 1
+    pools: PoolManager = attr.ib(
+        default=attr.Factory(
+            lambda self: PoolManager(
+                self.connstr,
+                self.postgres_default_database,
+                max_connections=self.max_connections,
+                idle_ttl=self.pool_idle_ttl,
+                ddl_width=self.ddl_width,
+            ),
+            takes_self=True,
+        ),
+        init=False,
+        eq=False,
+        repr=False,
+    )
+    catalog: CatalogCache = attr.ib(
+        default=attr.Factory(CatalogCache, takes_self=True),
+        init=False,
+        eq=False,
+        repr=False,
+    )
+    capabilities: CapabilityCache = attr.ib(
+        default=attr.Factory(CapabilityCache, takes_self=True),
+        init=False,
+        eq=False,
+        repr=False,
+    )
+    templates: TemplateCache = attr.ib(
+        default=attr.Factory(
+            lambda self: TemplateCache(self, self.max_templates),
+            takes_self=True,
+        ),
+        init=False,
+        eq=False,
+        repr=False,
+    )
+    breaker: CircuitBreaker = attr.ib(
+        default=attr.Factory(
+            lambda self: CircuitBreaker(self.name), takes_self=True
+        ),
+        init=False,
+        eq=False,
+        repr=False,
+    )
+    scheduler: Scheduler = attr.ib(
+        default=attr.Factory(
+            lambda self: Scheduler(self.max_in_flight, self.name),
+            takes_self=True,
+        ),
+        init=False,
+        eq=False,
+        repr=False,
+    )
+
+    creates: CreateQueue = attr.ib(
+        default=attr.Factory(CreateQueue, takes_self=True),
+        init=False,
+        eq=False,
+        repr=False,
+    )
+    drops: Batcher = attr.ib(
+        default=attr.Factory(
+            lambda self: Batcher(
+                self._drop_batch, window=self.drop_batch_window
+            ),
+            takes_self=True,
+        ),
+        init=False,
+        eq=False,
+        repr=False,
+    )
 
     def connstr(self, dbname):
         return "postgres://{}:{}@{}:{}/{}".format(
@@ -40,22 +575,85 @@ class PostgresConnection:
             dbname,
         )
 
+    async def open(self):
+        await self.pools.open()
+        await self.templates.load()
+
+    async def close(self):
+        await self.catalog.close()
+        await self.capabilities.close()
+        await self.pools.close()
+
+    async def _drop_batch(self, _, names):
+        """
+        Drop the databases whose deletes arrived within one window, holding
+        a single slot of the scheduler
+        """
+        async with self.scheduler.slot(PRIORITY_DELETE, self.name):
+            return await drop_databases(self, names)
+
+    async def release_database(self, database_name):
+        """
+        Close any pooled connections to a database so it can be dropped
+        """
+        await self.pools.discard(database_name)
+
     @asynccontextmanager
-    async def master_connection(self):
-        db_name = self.postgres_default_database
-        conn = await asyncpg.connect(self.connstr(db_name))
+    async def _direct_connection(self, database_name):
+        conn = await asyncpg.connect(self.connstr(database_name))
         try:
             yield conn
         finally:
             await conn.close()
 
     @asynccontextmanager
-    async def database_connection(self, database_name):
-        conn = await asyncpg.connect(self.connstr(database_name))
-        try:
+    async def _connection(self, database_name, target):
+        """
+        Acquire a connection through the circuit breaker, which refuses
+        attempts while the server is known to be down
+        """
+        self.breaker.check()
+        start = time.monotonic()
+        if not self.pools.is_open or target == "ddl":
+            acquire = self._direct_connection(database_name)
+        elif target == "master":
+            acquire = self.pools.master_connection()
+        else:
+            acquire = self.pools.database_connection(database_name)
+        async with AsyncExitStack() as stack:
+            try:
+                with span("connect", server=self.name, target=target):
+                    conn = await stack.enter_async_context(acquire)
+            except Exception as e:
+                self.breaker.record(e)
+                raise
+            except BaseException:
+                self.breaker.abandon_probe()
+                raise
+            self.breaker.record()
+            CONNECTION_ACQUIRE.labels(self.name, target).observe(
+                time.monotonic() - start
+            )
             yield conn
-        finally:
-            await conn.close()
+
+    def master_connection(self):
+        return self._connection(self.postgres_default_database, "master")
+
+    def database_connection(self, database_name):
+        return self._connection(database_name, "database")
+
+    @asynccontextmanager
+    async def ddl_connections(self, database_name):
+        """
+        Reserve ``ddl_width`` connections to a database and yield a
+        function opening them, outside its pool, for execute_graph
+        """
+        async with AsyncExitStack() as stack:
+            if self.pools.is_open:
+                await stack.enter_async_context(
+                    self.pools.reserve(self.ddl_width)
+                )
+            yield lambda: self._connection(database_name, "ddl")
 
 
 @attr.s(auto_attribs=True, frozen=True)
@@ -65,6 +663,9 @@ class Database:
     schemas: List[str] = attr.ib()
     extensions: List[str] = attr.ib()
     conn_obj: object
+    # Set on the database when this creates it, telling it from one that
+    # already existed
+    comment: Optional[str] = None
 
     @classmethod
     async def from_spec(cls, spec, conn_obj):
@@ -77,70 +678,154 @@ class Database:
 
     async def create_database(self, logger):
         """
-        This function will create a database, extensions and schemas
+        This function will create a database, extensions and schemas.
+        Returns whether everything was created, and raises errors reaching
+        the server so they can be retried. Databases whose schemas and
+        extensions match a template database are copied from it. Only the
+        CREATE DATABASE itself waits for the server's create queue; with a
+        ``ddl_width`` above 1, extensions that do not require one another
+        are then created in parallel on that many connections.
         """
-        NEW_EXTENSION_MAP = construct_items_map(
-            self.extensions, "EXTENSION", "extensions"
-        )
-        NEW_SCHEMA_MAP = construct_items_map(self.schemas, "SCHEMA", "schemas")
         try:
-            async with self.conn_obj.master_connection() as conn:
-                logger.info(LOG_ESTABLISH.format("postgres"))
-                await conn.execute(f'CREATE DATABASE "{self.database_name}"')
+            requires = await self._requires(self.extensions)
+            steps = creation_steps(
+                self.database_name, self.schemas, self.extensions, requires
+            )
+            async with self.conn_obj.templates.use(
+                self.schemas, self.extensions, logger
+            ) as template:
+                template = await self._create(template, logger)
                 logger.info(f"Database {self.database_name} created")
+            self.conn_obj.catalog.invalidate()
+            if template is not None:
+                for step in steps:
+                    logger.info(step.message)
+                return True
+            width = self.conn_obj.ddl_width
+            if width > 1 and len(self.extensions) > 1:
+                graph = creation_graph(
+                    self.database_name, self.schemas, self.extensions, requires
+                )
+                async with self.conn_obj.ddl_connections(
+                    self.database_name
+                ) as connect:
+                    return await execute_graph(connect, graph, width, logger)
             async with self.conn_obj.database_connection(
                 self.database_name
             ) as conn:
                 logger.info(LOG_ESTABLISH.format(self.database_name))
-                await conn.execute(
-                    "REVOKE CREATE ON SCHEMA public FROM PUBLIC"
+                return await execute_ddl(conn, steps, logger)
+        except Exception as e:
+            OPERATION_ERRORS.labels("create_database").inc()
+            logger.info(f"Error info: {e}")
+            if is_transient(e):
+                raise
+            return False
+
+    async def _create(self, template, logger):
+        """
+        Run CREATE DATABASE, copying ``template`` if given. Returns the
+        template used, which is None if copying it failed or if the
+        database already exists, e.g. from an attempt whose DDL failed, so
+        that its schemas and extensions are created again.
+        """
+        if template is not None:
+            try:
+                await self.conn_obj.creates.run(
+                    f"CREATE DATABASE {quote_ident(self.database_name)} "
+                    f"TEMPLATE {quote_ident(template)}"
+                )
+            except asyncpg.DuplicateDatabaseError:
+                logger.info(f"Database {self.database_name} already exists")
+                return None
+            except asyncpg.PostgresError as e:
+                logger.warning(f"Copying template {template} failed: {e}")
+            else:
+                name = quote_ident(self.database_name)
+                await self._created(
+                    f"REVOKE ALL ON DATABASE {name} FROM PUBLIC"
                 )
-                await conn.execute(
-                    "REVOKE ALL ON DATABASE "
-                    f'"{self.database_name}" FROM PUBLIC'
+                return template
+        try:
+            await self.conn_obj.creates.run(
+                f"CREATE DATABASE {quote_ident(self.database_name)}"
+            )
+        except asyncpg.DuplicateDatabaseError:
+            logger.info(f"Database {self.database_name} already exists")
+            return None
+        await self._created()
+        return None
+
+    async def _created(self, *statements):
+        """
+        Run ``statements`` on the database just created, after setting its
+        comment if it has one
+        """
+        if self.comment is not None:
+            statements = (
+                f"COMMENT ON DATABASE {quote_ident(self.database_name)} IS "
+                f"{quote_literal(self.comment)}",
+                *statements,
+            )
+        if statements:
+            async with self.conn_obj.master_connection() as conn:
+                await execute(conn, ";\n".join(statements))
+
+    async def _requires(self, *extension_lists):
+        """
+        What the server's extensions require, probed only when there are
+        extensions to order
+        """
+        if not any(extension_lists):
+            return {}
+        return (await self.conn_obj.capabilities.get()).requires
+
+    async def sync_database(self, logger):
+        """
+        Lock down an existing database and create the schemas and
+        extensions missing from its catalog, finishing a creation that was
+        interrupted. Returns whether everything now exists.
+        """
+        try:
+            async with self.conn_obj.database_connection(
+                self.database_name
+            ) as conn:
+                existing = await DatabaseObjects.fetch(conn)
+                schemas, extensions = existing.missing(
+                    self.schemas, self.extensions
                 )
-                logger.info(
-                    f"Revoked PUBLIC role access on {self.database_name}"
+                steps = creation_steps(
+                    self.database_name,
+                    schemas,
+                    extensions,
+                    await self._requires(extensions),
                 )
-                for x, y in {
-                    **NEW_SCHEMA_MAP,
-                    **NEW_EXTENSION_MAP,
-                }.items():
-                    if x:
-                        [
-                            await conn.execute(add_creation(item, y[0]))
-                            for item in x
-                        ]
-                        logger.info(
-                            LOG_SUCCESSFUL.format(y[1], x, self.database_name)
-                        )
+                return await execute_ddl(conn, steps, logger)
         except Exception as e:
-            logger.info(f"Error info: {e}")
+            OPERATION_ERRORS.labels("sync_database").inc()
+            logger.error(f"Error info: {e}")
+            if is_transient(e):
+                raise
+            return False
 
-    @asyncio.coroutine
     async def delete_database(
         self,
         logger,
     ):
         """
-        This function will drop a database if dropOnDelete is true
+        This function will drop a database if dropOnDelete is true.
+        Drops on the same server are gathered for ``drop_batch_window``
+        seconds and run together in one session, so callers must not hold
+        a scheduler slot while waiting.
         """
         try:
-            async with self.conn_obj.master_connection() as conn:
-                logger.info(LOG_ESTABLISH.format("postgres"))
-                await conn.execute(
-                    "SELECT *, pg_terminate_backend(pid) "
-                    "FROM pg_stat_activity WHERE pid <> pg_backend_pid() "
-                    f"AND datname = '{self.database_name}'"
-                )
-                await conn.execute(
-                    f'DROP DATABASE IF EXISTS "{self.database_name}"'
-                )
-                logger.info(
-                    f"Successfully dropped database {self.database_name}"
-                )
+            await self.conn_obj.drops.submit(None, self.database_name)
+            logger.info(f"Successfully dropped database {self.database_name}")
         except Exception as e:
+            OPERATION_ERRORS.labels("delete_database").inc()
             logger.error(f"Error info: {e}")
+            if is_transient(e):
+                raise
 
     async def update_database(
         self,
@@ -152,47 +837,28 @@ class Database:
     ):
         """
         This function will update a database.
+        Returns whether every change was applied. No connection is made
+        when there is nothing to change.
         """
         try:
+            steps = update_steps(
+                self.database_name,
+                new_ext,
+                dropped_ext,
+                new_schemas,
+                dropped_schemas,
+                await self._requires(new_ext, dropped_ext),
+            )
+            if not steps:
+                return True
             async with self.conn_obj.database_connection(
                 self.database_name
             ) as conn:
-                logger.info(
-                    logger.info(LOG_ESTABLISH.format(self.database_name))
-                )
-                NEW_EXTENSION_MAP = construct_items_map(
-                    new_ext, "EXTENSION", "extensions"
-                )
-                NEW_SCHEMA_MAP = construct_items_map(
-                    new_schemas, "SCHEMA", "schemas"
-                )
-                OLD_SCHEMA_MAP = construct_items_map(
-                    dropped_schemas, "SCHEMA", "schemas"
-                )
-                OLD_EXTENSION_MAP = construct_items_map(
-                    dropped_ext, "EXTENSION", "extensions"
-                )
-
-                for x, y in {**NEW_SCHEMA_MAP, **NEW_EXTENSION_MAP}.items():
-                    if x:
-                        [
-                            await conn.execute(add_creation(item, y[0]))
-                            for item in x
-                        ]
-                        logger.info(
-                            LOG_SUCCESSFUL.format(y[1], x, self.database_name)
-                        )
-
-                for x, y in {**OLD_SCHEMA_MAP, **OLD_EXTENSION_MAP}.items():
-                    if x:
-                        [
-                            await conn.execute(drop_items(item, y[0]))
-                            for item in x
-                        ]
-                        logger.info(
-                            SUCCESSFUL_REMOVE.format(
-                                y[1], x, self.database_name
-                            )
-                        )
+                logger.info(LOG_ESTABLISH.format(self.database_name))
+                return await execute_ddl(conn, steps, logger)
         except Exception as e:
+            OPERATION_ERRORS.labels("update_database").inc()
             logger.error(f"Error info {e}")
+            if is_transient(e):
+                raise
+            return False
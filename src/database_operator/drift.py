@@ -0,0 +1,186 @@
+"""
+Periodic server-wide detection and repair of drift between Postgres specs
+and the databases, schemas and extensions that actually exist
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import attr  # type: ignore
+
+from .catalog import DatabaseObjects, fetch_databases
+from .databases import Database
+from .metrics import DRIFT_SCAN_DURATION, DRIFTED
+from .scheduler import PRIORITY_UPDATE
+
+logger = logging.getLogger(__name__)
+
+LOG_SCAN = (
+    "Drift scan of {databases} databases took {duration:.2f}s "
+    "with {queries} queries, {drifted} drifted"
+)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Drift:
+    key: Tuple[str, str]
+    database: str
+    database_missing: bool
+    schemas: Tuple[str, ...] = ()
+    extensions: Tuple[str, ...] = ()
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class ScanReport:
+    duration: float
+    queries: int
+    databases: int
+    drifts: Tuple[Drift, ...]
+
+
+def diff_catalog(specs, databases, objects):
+    """
+    Compare specs, keyed by namespace/name, with the databases on the
+    server and the objects read from those databases
+    """
+    drifts = []
+    for key, spec in specs.items():
+        name = spec["database"]
+        if name not in databases:
+            drifts.append(Drift(key, name, True))
+            continue
+        schemas, extensions = objects[name].missing(
+            spec.get("schemas", []), spec.get("extensions", [])
+        )
+        if schemas or extensions:
+            drifts.append(
+                Drift(key, name, False, tuple(schemas), tuple(extensions))
+            )
+    return drifts
+
+
+@attr.s(auto_attribs=True)
+class DriftScanner:
+    """
+    Keeps the specs of all known Postgres CRs and, every ``interval``
+    seconds, reads the catalog with one pg_database query plus one query
+    per referenced database. Divergent CRs are queued for repair. When
+    replicas are sharded, ``owns(namespace, spec)`` limits the scan to the
+    CRs this replica owns.
+    """
+
+    conn_obj: object
+    interval: float = 300.0
+    concurrency: int = 4
+    owns: Optional[Callable[[str, dict], bool]] = None
+    specs: Dict[Tuple[str, str], dict] = attr.ib(factory=dict, init=False)
+    last_report: Optional[ScanReport] = attr.ib(default=None, init=False)
+    _queue: Optional[asyncio.Queue] = attr.ib(default=None, init=False)
+    _queued: Set[Tuple[str, str]] = attr.ib(factory=set, init=False)
+    _tasks: List[asyncio.Task] = attr.ib(factory=list, init=False)
+
+    def register(self, namespace, name, spec):
+        self.specs[(namespace, name)] = dict(spec)
+
+    def forget(self, namespace, name):
+        self.specs.pop((namespace, name), None)
+
+    async def _fetch_objects(self, database, semaphore):
+        async with semaphore:
+            async with self.conn_obj.database_connection(  # type: ignore
+                database
+            ) as conn:
+                return await DatabaseObjects.fetch(conn)
+
+    async def scan(self):
+        start = time.monotonic()
+        specs = {
+            key: spec
+            for key, spec in self.specs.items()
+            if self.owns is None or self.owns(key[0], spec)
+        }
+        async with self.conn_obj.master_connection() as conn:  # type: ignore
+            databases = await fetch_databases(conn)
+        wanted = sorted(
+            {s["database"] for s in specs.values()} & set(databases)
+        )
+        semaphore = asyncio.Semaphore(self.concurrency)
+        fetched = await asyncio.gather(
+            *(self._fetch_objects(db, semaphore) for db in wanted)
+        )
+        drifts = diff_catalog(specs, databases, dict(zip(wanted, fetched)))
+        report = ScanReport(
+            time.monotonic() - start,
+            1 + len(wanted),
+            len(wanted),
+            tuple(drifts),
+        )
+        self.last_report = report
+        server = self.conn_obj.name  # type: ignore
+        DRIFT_SCAN_DURATION.labels(server).observe(report.duration)
+        DRIFTED.labels(server).set(len(report.drifts))
+        logger.info(
+            LOG_SCAN.format(
+                databases=report.databases,
+                duration=report.duration,
+                queries=report.queries,
+                drifted=len(report.drifts),
+            )
+        )
+        for drift in drifts:
+            self.enqueue(drift)
+        return report
+
+    def enqueue(self, drift):
+        if self._queue is not None and drift.key not in self._queued:
+            self._queued.add(drift.key)
+            self._queue.put_nowait(drift)
+
+    async def repair(self, drift):
+        spec = self.specs.get(drift.key)
+        if spec is None or spec["database"] != drift.database:
+            # The CR was deleted or retargeted since the scan
+            return
+        cpd = await Database.from_spec(spec, self.conn_obj)
+        scheduler = self.conn_obj.scheduler  # type: ignore
+        async with scheduler.slot(PRIORITY_UPDATE, drift.key[0]):
+            logger.warning(f"Repairing drift of {'/'.join(drift.key)}")
+            if drift.database_missing:
+                await cpd.create_database(logger)
+            else:
+                await cpd.sync_database(logger)
+
+    async def _scan_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.scan()
+            except Exception as e:
+                logger.error(f"Drift scan failed: {e}")
+
+    async def _repair_forever(self):
+        while True:
+            drift = await self._queue.get()  # type: ignore
+            self._queued.discard(drift.key)
+            try:
+                await self.repair(drift)
+            except Exception as e:
+                key = "/".join(drift.key)
+                logger.error(f"Drift repair of {key} failed: {e}")
+
+    def start(self):
+        if self.interval <= 0 or self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.ensure_future(self._scan_forever()),
+            asyncio.ensure_future(self._repair_forever()),
+        ]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,200 @@
+"""
+One summary Kubernetes Event per reconcile instead of one per log line.
+Handler log lines are counted while a handler runs and stay in the local
+logs; at its end an Event with the outcome, duration and counts is posted,
+at most once per ``interval`` seconds per object. Reconciles finishing
+within an interval are merged into one Event posted at its end.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import attr  # type: ignore
+import kopf  # type: ignore
+
+# Longest problem message quoted in an Event
+MAX_QUOTED = 200
+_NOOP = contextlib.nullcontext()
+_current: contextvars.ContextVar[Optional["Summary"]] = contextvars.ContextVar(
+    "summary", default=None
+)
+_aggregator = None
+
+
+@attr.s(auto_attribs=True)
+class Summary:
+    handler: str
+    levels: Counter = attr.ib(factory=Counter, converter=Counter)
+    seconds: float = 0.0
+    error: Optional[str] = None
+    retrying: bool = False
+    problem: Optional[str] = None
+    reconciles: int = 1
+
+    def merge(self, later):
+        """
+        Fold a later reconcile of the same object into this one, keeping
+        the later outcome
+        """
+        return attr.evolve(
+            later,
+            levels=self.levels + later.levels,
+            problem=later.problem or self.problem,
+            reconciles=self.reconciles + later.reconciles,
+        )
+
+    @property
+    def failed(self):
+        return self.error is not None and not self.retrying
+
+    @property
+    def outcome(self):
+        if self.error is None:
+            return "succeeded"
+        return f"{'will retry' if self.retrying else 'failed'}: {self.error}"
+
+    def message(self):
+        logged = ", ".join(
+            f"{n} {logging.getLevelName(level).lower()}"
+            for level, n in sorted(self.levels.items())
+        )
+        message = f"{self.handler} {self.outcome} in {self.seconds:.2f}s"
+        if logged:
+            message += f" ({logged} log lines)"
+        if self.reconciles > 1:
+            message += f", {self.reconciles} reconciles since the last event"
+        if self.problem is not None and self.problem != self.error:
+            message += f"; last problem: {self.problem}"
+        return message
+
+
+def post_event(body, summary):
+    kopf.event(
+        body,
+        type="Warning" if summary.failed else "Normal",
+        reason="ReconcileFailed" if summary.failed else "Reconciled",
+        message=summary.message(),
+    )
+
+
+@attr.s(auto_attribs=True)
+class EventAggregator:
+    """
+    Posts the summary of an object's reconcile right away if no Event was
+    posted for it in the last ``interval`` seconds, and otherwise merges
+    it into the Event posted when the interval ends
+    """
+
+    interval: float = 30.0
+    post: Callable[[Any, Summary], None] = post_event
+    _pending: Dict[Tuple, Tuple[Any, Summary]] = attr.ib(
+        factory=dict, init=False
+    )
+    _quiet: Dict[Tuple, Any] = attr.ib(factory=dict, init=False)
+
+    def report(self, body, summary):
+        meta = body.get("metadata", {})
+        key = (body.get("kind"), meta.get("namespace"), meta.get("name"))
+        if key not in self._quiet:
+            self._post(key, body, summary)
+            return
+        pending = self._pending.get(key)
+        if pending is not None:
+            summary = pending[1].merge(summary)
+        self._pending[key] = (body, summary)
+
+    def _send(self, body, summary):
+        try:
+            self.post(body, summary)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Posting an event: {e}")
+
+    def _post(self, key, body, summary):
+        self._send(body, summary)
+        self._quiet[key] = asyncio.get_event_loop().call_later(
+            self.interval, self._end, key
+        )
+
+    def _end(self, key):
+        del self._quiet[key]
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            self._post(key, *pending)
+
+    def close(self):
+        """
+        Post the merged summaries still waiting for their interval to end
+        """
+        for timer in self._quiet.values():
+            timer.cancel()
+        self._quiet.clear()
+        pending, self._pending = self._pending, {}
+        for body, summary in pending.values():
+            self._send(body, summary)
+
+
+class LogCounter(logging.Handler):
+    """
+    Counts the log lines of the reconcile running in the current context
+    """
+
+    def emit(self, record):
+        summary = _current.get()
+        if summary is None:
+            return
+        summary.levels[record.levelno] += 1
+        if record.levelno >= logging.WARNING:
+            summary.problem = record.getMessage()[:MAX_QUOTED]
+
+
+@contextlib.contextmanager
+def _summarizing(aggregator, handler, body):
+    summary = Summary(handler)
+    token = _current.set(summary)
+    start = time.monotonic()
+    try:
+        yield summary
+    except Exception as e:
+        summary.error = str(e)[:MAX_QUOTED] or type(e).__name__
+        summary.retrying = isinstance(e, kopf.TemporaryError)
+        raise
+    finally:
+        _current.reset(token)
+        summary.seconds = time.monotonic() - start
+        aggregator.report(body, summary)
+
+
+def summarizing(handler, body):
+    """
+    Count the log lines of a handler call and report its summary when it
+    ends. Does nothing unless ``start`` was called.
+    """
+    aggregator = _aggregator
+    if aggregator is None or body is None:
+        return _NOOP
+    return _summarizing(aggregator, handler, body)
+
+
+def start(settings, aggregator):
+    """
+    Stop posting an Event per log line of the object loggers and post
+    summaries through ``aggregator`` instead
+    """
+    global _aggregator
+    _aggregator = aggregator
+    settings.posting.level = logging.CRITICAL
+    logger = logging.getLogger("kopf.objects")
+    if not any(isinstance(h, LogCounter) for h in logger.handlers):
+        logger.addHandler(LogCounter())
+
+
+def stop():
+    global _aggregator
+    aggregator, _aggregator = _aggregator, None
+    if aggregator is not None:
+        aggregator.close()
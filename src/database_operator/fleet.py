@@ -0,0 +1,216 @@
+"""
+Reconciling a PostgresFleet: many databases sharing one template spec
+"""
+
+import asyncio
+import logging
+from typing import List, Tuple
+
+import attr  # type: ignore
+
+from .catalog import fetch_databases, spec_fingerprint
+from .databases import Database
+from .plan import ReconcilePlan
+from .scheduler import PRIORITY_CREATE, PRIORITY_UPDATE
+
+# Failed member names kept in the status; the rest are only counted
+MAX_FAILED_IN_STATUS = 20
+MAX_MEMBERS = 10000
+CREATED_MEMBERS_QUERY = (
+    "SELECT datname FROM pg_database "
+    "WHERE shobj_description(oid, 'pg_database') = $1"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidFleetError(Exception):
+    pass
+
+
+def fleet_members(spec):
+    """
+    The database names of a fleet: its ``databases`` list followed by its
+    ``range`` of ``prefix`` + number from ``start`` to ``end`` inclusive
+    """
+    names = list(spec.get("databases", []))
+    span = spec.get("range")
+    if span is not None:
+        start, end = span.get("start", 1), span["end"]
+        if end - start + 1 > MAX_MEMBERS:
+            raise InvalidFleetError(
+                f"A fleet may have at most {MAX_MEMBERS} databases"
+            )
+        names += [f"{span['prefix']}{i}" for i in range(start, end + 1)]
+    if len(names) > MAX_MEMBERS:
+        raise InvalidFleetError(
+            f"A fleet may have at most {MAX_MEMBERS} databases"
+        )
+    return list(dict.fromkeys(names))
+
+
+def member_spec(spec, database):
+    template = spec.get("template", {})
+    return {
+        "database": database,
+        "schemas": template.get("schemas", []),
+        "extensions": template.get("extensions", []),
+        "dropOnDelete": template.get("dropOnDelete", False),
+    }
+
+
+def template_fingerprint(spec):
+    return spec_fingerprint(member_spec(spec, ""))
+
+
+def member_comment(namespace, name):
+    """
+    The comment on the databases a fleet created, the only ones it drops
+    """
+    return f"Created by PostgresFleet {namespace}/{name}"
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class FleetPlan:
+    """
+    The set difference between a fleet and the databases on its server
+    """
+
+    create: Tuple[str, ...] = ()
+    update: Tuple[str, ...] = ()
+    drop: Tuple[str, ...] = ()
+    template: ReconcilePlan = ReconcilePlan("")
+
+    @classmethod
+    def compile(cls, old, new, existing, sync=False, created=frozenset()):
+        """
+        Plan the change of a fleet from ``old`` (None when new) to ``new``
+        (None when deleted) given the databases that exist. Members of the
+        new fleet get the template's changes, or are synced with their
+        catalog if ``sync``; removed members are dropped if the template
+        says so and they are among the databases the fleet ``created``.
+        """
+        new_members = fleet_members(new) if new is not None else []
+        old_members = fleet_members(old) if old is not None else []
+        wanted = dict.fromkeys(new_members)
+        template = ReconcilePlan("")
+        if old is not None and new is not None:
+            template = ReconcilePlan.compile(
+                member_spec(old, ""), member_spec(new, "")
+            )
+        dropping = (
+            old is not None
+            and member_spec(old, "")["dropOnDelete"]
+            and (new is None or member_spec(new, "")["dropOnDelete"])
+        )
+        return cls(
+            tuple(m for m in new_members if m not in existing),
+            tuple(
+                m
+                for m in new_members
+                if m in existing and (sync or not template.is_empty)
+            ),
+            tuple(
+                m
+                for m in old_members
+                if dropping and m not in wanted and m in created
+            ),
+            template,
+        )
+
+    @property
+    def is_empty(self):
+        return not (self.create or self.update or self.drop)
+
+
+@attr.s(auto_attribs=True)
+class FleetResult:
+    applied: int = 0
+    dropped: int = 0
+    failed: List[str] = attr.ib(factory=list)
+    not_dropped: List[str] = attr.ib(factory=list)
+
+    def status(self, members):
+        """
+        A compact status: counts, plus the first few failed members
+        """
+        return {
+            "members": members,
+            "ready": members - len(self.failed),
+            "failedCount": len(self.failed),
+            "failed": sorted(self.failed)[:MAX_FAILED_IN_STATUS],
+            "failedDrops": len(self.not_dropped),
+        }
+
+
+async def existing_databases(conn_obj):
+    async with conn_obj.master_connection() as conn:
+        return await fetch_databases(conn)
+
+
+async def created_members(conn_obj, comment):
+    async with conn_obj.master_connection() as conn:
+        rows = await conn.fetch(CREATED_MEMBERS_QUERY, comment)
+    return {row["datname"] for row in rows}
+
+
+async def apply_fleet_plan(
+    conn_obj, spec, plan, namespace, sync=False, comment=None
+):
+    """
+    Run a fleet plan. Every member creation or update takes a slot of the
+    server's scheduler, so members are processed concurrently up to its
+    in-flight limit over pooled connections. Created members get
+    ``comment``. Drops are batched by the server instead, and as they do
+    not report failure, are checked against the catalog once all have run.
+    """
+    template = plan.template
+    failed = []
+
+    async def create(cpd):
+        cpd = attr.evolve(cpd, comment=comment)
+        if not await cpd.create_database(logger):
+            failed.append(cpd.database_name)
+
+    async def update(cpd):
+        if sync:
+            applied = await cpd.sync_database(logger)
+        else:
+            applied = await cpd.update_database(
+                template.new_extensions,
+                template.dropped_extensions,
+                template.new_schemas,
+                template.dropped_schemas,
+                logger,
+            )
+        if not applied:
+            failed.append(cpd.database_name)
+
+    async def drop(database):
+        cpd = await Database.from_spec(member_spec(spec, database), conn_obj)
+        await cpd.delete_database(logger)
+
+    async def run(priority, database, operation):
+        cpd = await Database.from_spec(member_spec(spec, database), conn_obj)
+        async with conn_obj.scheduler.slot(priority, namespace):
+            await operation(cpd)
+
+    outcomes = await asyncio.gather(
+        *(drop(db) for db in plan.drop),
+        *(run(PRIORITY_UPDATE, db, update) for db in plan.update),
+        *(run(PRIORITY_CREATE, db, create) for db in plan.create),
+        return_exceptions=True,
+    )
+    errors = [o for o in outcomes if isinstance(o, Exception)]
+    if errors:
+        raise errors[0]
+    not_dropped = []
+    if plan.drop:
+        existing = await existing_databases(conn_obj)
+        not_dropped = [db for db in plan.drop if db in existing]
+    return FleetResult(
+        len(plan.create) + len(plan.update) - len(failed),
+        len(plan.drop) - len(not_dropped),
+        failed,
+        not_dropped,
+    )
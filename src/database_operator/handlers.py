@@ -1,15 +1,52 @@
 """
 A k8s operator for creating databases and their associated roles, extensions
 """
+
 from __future__ import annotations
 
 import asyncio  # type: ignore
+import json
+import logging
 import os
+import socket
+from contextlib import contextmanager
 
 import kopf  # type: ignore
 import pykube  # type: ignore
 
+from . import events, persistence, tracing
+from .breaker import CircuitOpenError, backoff_delay, is_transient
+from .catalog import spec_fingerprint
+from .coalesce import Batcher, Debouncer
 from .databases import Database, PostgresConnection
+from .drift import DriftScanner
+from .fleet import (
+    FleetPlan,
+    InvalidFleetError,
+    apply_fleet_plan,
+    created_members,
+    existing_databases,
+    fleet_members,
+    member_comment,
+    template_fingerprint,
+)
+from .k8s import MissingPasswordError, PostgresInformer, SecretCache
+from .metrics import Deferred, instrumented, serve, watch_server
+from .plan import ImmutableFieldError, ReconcilePlan, diff_items
+from .scheduler import PRIORITY_CREATE, PRIORITY_DELETE, PRIORITY_UPDATE
+from .servers import NoHealthyServerError, ServerRegistry, UnknownServerError
+from .sharding import ShardMembership, claim_finalizers, finalizer_for
+from .tracing import Tracer, exporter_for
+from .users import (
+    LOG_ROLE,
+    ForbiddenRoleError,
+    InvalidPrivilegesError,
+    PostgresUser,
+    apply_grants,
+    check_role,
+    drop_role,
+)
+from .validation import fleet_errors, postgres_errors
 
 API_GROUP = "dboperator.p16n.org"
 API_VERSION = "v1"
@@ -17,18 +54,39 @@ API_VERSION = "v1"
 LOG_NOT_ALLOWED = (
     "Changing name of database in {} spec is not allowed. Create a new CR"
 )
+LOG_SERVER_NOT_ALLOWED = (
+    "Changing server of database in {} spec is not allowed. Create a new CR"
+)
+LOG_ROLE_NOT_ALLOWED = (
+    "Changing role in {} spec is not allowed. Create a new CR"
+)
+DEFAULT_SERVER = "default"
 # Global pykube client for managing resources in event handlers.
 _kapi = None
+# Cached Secret access, created with the pykube client.
+secret_cache = None
+# Watch-fed cache of all Postgres CRs.
+informer = PostgresInformer()
+batch_logger = logging.getLogger(__name__)
+# Membership of the replica group when sharding is enabled.
+sharding = None
+shard_by = "database"
+# Whether the validating webhooks have been registered with kopf.
+admission_registered = False
 
 
 async def _create_pykube_postgres():
     """
-    This will be used to establish the relationship between
-    Postgres and PostgresUsers
-    in the future
+    Used to establish the relationship between Postgres and PostgresUsers.
+    Building the class asks the API server for its resources, so it runs
+    off the event loop.
     """
-    Postgres = pykube.object_factory(
-        _kapi, f"{API_GROUP}/{API_VERSION}", "Postgres"
+    Postgres = await asyncio.get_event_loop().run_in_executor(
+        None,
+        pykube.object_factory,
+        _kapi,
+        f"{API_GROUP}/{API_VERSION}",
+        "Postgres",
     )
     return Postgres
 
@@ -39,13 +97,11 @@ async def filter_on_postgres_update(old, new):
     schemas which were dropped and added
     on update of postgres CR fields
     """
-    added = list(filter(lambda a: a not in old, new))
-    dropped = list(filter(lambda a: a not in new, old))
-    return added, dropped
+    return diff_items(old, new)
 
 
 @kopf.on.startup(errors=kopf.ErrorsMode.PERMANENT)
-async def startup(**kwargs):
+async def startup(settings, **kwargs):
     """
     Initialise database connections
     """
@@ -56,14 +112,255 @@ async def startup(**kwargs):
     POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
     MASTER_POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
     POSTGRES_PORT = os.getenv("POSTGRES_PORT", 5432)
-    global master_conn
-    master_conn = PostgresConnection(
-        MASTER_POSTGRES_USER,
-        MASTER_POSTGRES_PASS,
-        POSTGRES_HOST,
-        POSTGRES_PORT,
-        POSTGRES_DEFAULT_DATABASE,
+    POSTGRES_MAX_CONNECTIONS = int(os.getenv("POSTGRES_MAX_CONNECTIONS", 20))
+    POSTGRES_POOL_IDLE_TTL = float(os.getenv("POSTGRES_POOL_IDLE_TTL", 300))
+    POSTGRES_MAX_IN_FLIGHT = int(os.getenv("POSTGRES_MAX_IN_FLIGHT", 10))
+    DRIFT_SCAN_INTERVAL = float(os.getenv("DRIFT_SCAN_INTERVAL", 300))
+    # A JSON list of servers, each with a name, host, port, user and
+    # password or passwordEnv. Without it the single server above is used.
+    POSTGRES_SERVERS = os.getenv("POSTGRES_SERVERS")
+    POSTGRES_PLACEMENT = os.getenv("POSTGRES_PLACEMENT", "count")
+    POSTGRESUSER_BATCH_WINDOW = float(
+        os.getenv("POSTGRESUSER_BATCH_WINDOW", 0.2)
+    )
+    INFORMER_RESYNC_INTERVAL = float(
+        os.getenv("INFORMER_RESYNC_INTERVAL", 600)
     )
+    POSTGRES_TEMPLATE_CACHE_SIZE = int(
+        os.getenv("POSTGRES_TEMPLATE_CACHE_SIZE", 0)
+    )
+    # Seconds to gather database drops on a server into one batch
+    POSTGRES_DROP_BATCH_WINDOW = float(
+        os.getenv("POSTGRES_DROP_BATCH_WINDOW", 0.1)
+    )
+    # Connections per database to create independent extensions on
+    POSTGRES_DDL_WIDTH = int(os.getenv("POSTGRES_DDL_WIDTH", 1))
+    # Seconds a Postgres spec must stay unchanged before it is applied
+    SPEC_QUIET_WINDOW = float(os.getenv("SPEC_QUIET_WINDOW", 2))
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 9090))
+    # Split objects between replicas by namespace/database, or by the
+    # server holding the database when SHARD_BY is "server"
+    OPERATOR_SHARDING = os.getenv("OPERATOR_SHARDING", "false") == "true"
+    global sharding, shard_by
+    global servers, drift_scanners, dry_run, grant_batcher, informer_task
+    global spec_debouncer
+    # Serve the validating admission webhook on this port; clients reach
+    # it at WEBHOOK_HOST, which must match the certificate in
+    # WEBHOOK_CERTFILE with its key in WEBHOOK_PKEYFILE
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 0))
+    WEBHOOK_CERTFILE = os.getenv("WEBHOOK_CERTFILE")
+    WEBHOOK_PKEYFILE = os.getenv("WEBHOOK_PKEYFILE")
+    if WEBHOOK_PORT and not (WEBHOOK_CERTFILE and WEBHOOK_PKEYFILE):
+        raise kopf.PermanentError(
+            "WEBHOOK_PORT needs WEBHOOK_CERTFILE and WEBHOOK_PKEYFILE"
+        )
+    # Trace a share of reconciles, exported as "jsonl" lines to TRACE_FILE
+    # or as "otlp" to the collector at OTEL_EXPORTER_OTLP_ENDPOINT
+    TRACE_EXPORTER = os.getenv("TRACE_EXPORTER")
+    TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", 1))
+    # Post one summary Event per reconcile, at most every EVENT_INTERVAL
+    # seconds per object, or with "all" an Event per handler log line
+    KUBERNETES_EVENTS = os.getenv("KUBERNETES_EVENTS", "summary")
+    EVENT_INTERVAL = float(os.getenv("EVENT_INTERVAL", 30))
+    # Log the plan for spec changes instead of applying it
+    dry_run = os.getenv("DRY_RUN", "false").lower() == "true"
+    # Keep kopf's progress in the status and a compressed diff base
+    persistence.configure(settings)
+    if KUBERNETES_EVENTS == "summary":
+        events.start(settings, events.EventAggregator(EVENT_INTERVAL))
+    if POSTGRES_SERVERS:
+        servers = ServerRegistry.from_json(
+            POSTGRES_SERVERS, POSTGRES_PLACEMENT
+        )
+    else:
+        master_conn = PostgresConnection(
+            MASTER_POSTGRES_USER,
+            MASTER_POSTGRES_PASS,
+            POSTGRES_HOST,
+            POSTGRES_PORT,
+            POSTGRES_DEFAULT_DATABASE,
+            max_connections=POSTGRES_MAX_CONNECTIONS,
+            pool_idle_ttl=POSTGRES_POOL_IDLE_TTL,
+            max_in_flight=POSTGRES_MAX_IN_FLIGHT,
+            max_templates=POSTGRES_TEMPLATE_CACHE_SIZE,
+            drop_batch_window=POSTGRES_DROP_BATCH_WINDOW,
+            ddl_width=POSTGRES_DDL_WIDTH,
+            name=DEFAULT_SERVER,
+        )
+        servers = ServerRegistry({DEFAULT_SERVER: master_conn})
+    await servers.open()
+    for name, conn in servers:
+        watch_server(name, conn.scheduler)
+    if WEBHOOK_PORT:
+        settings.admission.server = kopf.WebhookServer(
+            port=WEBHOOK_PORT,
+            host=os.getenv("WEBHOOK_HOST"),
+            certfile=WEBHOOK_CERTFILE,
+            pkeyfile=WEBHOOK_PKEYFILE,
+        )
+        settings.admission.managed = f"database-operator.{API_GROUP}"
+        register_admission()
+        # Admission reviews only read the extension cache, so fill it now
+        await asyncio.gather(
+            *(conn.capabilities.get() for _, conn in servers),
+            return_exceptions=True,
+        )
+    serve(METRICS_PORT)
+    if TRACE_EXPORTER and TRACE_SAMPLE_RATIO > 0:
+        exporter = exporter_for(
+            TRACE_EXPORTER,
+            os.getenv("TRACE_FILE", "traces.jsonl"),
+            os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"),
+        )
+        tracing.start(Tracer(exporter, ratio=TRACE_SAMPLE_RATIO))
+    drift_scanners = {
+        name: DriftScanner(
+            conn,
+            interval=DRIFT_SCAN_INTERVAL,
+            owns=lambda namespace, spec, server=name: owns_database(
+                namespace, spec["database"], server
+            ),
+        )
+        for name, conn in servers
+    }
+    for scanner in drift_scanners.values():
+        scanner.start()
+    grant_batcher = Batcher(flush_grants, window=POSTGRESUSER_BATCH_WINDOW)
+    spec_debouncer = Debouncer(SPEC_QUIET_WINDOW)
+    informer_task = asyncio.ensure_future(
+        resync_informer(INFORMER_RESYNC_INTERVAL)
+    )
+    if OPERATOR_SHARDING:
+        shard_by = os.getenv("SHARD_BY", "database")
+        identity = os.getenv("POD_NAME") or socket.gethostname()
+        # Replicas run side by side instead of electing one via peering
+        settings.peering.standalone = True
+        settings.persistence.finalizer = finalizer_for(identity)
+        sharding = ShardMembership(
+            pykube.HTTPClient(pykube.KubeConfig.from_env()),
+            os.getenv("POD_NAMESPACE", "default"),
+            identity,
+            group=os.getenv("SHARD_GROUP", "database-operator"),
+            on_change=lambda: asyncio.ensure_future(claim_shard()),
+        )
+        await sharding.start()
+
+
+async def resync_informer(interval, retry_interval=1):
+    """
+    Fill the informer's cache with a full list once the API client has
+    logged in, retrying until it succeeds, and replace it periodically
+    after that
+    """
+    while True:
+        if _kapi is not None:
+            try:
+                await informer.resync(_kapi, await _create_pykube_postgres())
+            except Exception as e:
+                batch_logger.error(f"Postgres informer resync failed: {e}")
+        await asyncio.sleep(interval if informer.synced else retry_interval)
+
+
+def require_informer():
+    """
+    Retry a handler that looks up Postgres CRs until they have all been
+    listed, so none is mistaken for missing
+    """
+    if not informer.synced:
+        raise kopf.TemporaryError("Postgres CRs are not listed yet", delay=1)
+
+
+def owns_database(namespace, database, server=None):
+    """
+    Whether this replica handles the objects of a database
+    """
+    if sharding is None:
+        return True
+    if shard_by == "server" and server is not None:
+        return sharding.owns(server)
+    return sharding.owns(f"{namespace}/{database}")
+
+
+def owns_postgres(spec, status, namespace, **kwargs):
+    return owns_database(
+        namespace, spec.get("database"), placed_server(spec, status)
+    )
+
+
+def owns_postgresuser(spec, namespace, **kwargs):
+    """
+    With SHARD_BY=server, the replica owning a PostgresUser is only known
+    from its Postgres CR. Until they are listed every replica takes it,
+    and its handlers retry until the owner is known.
+    """
+    server = None
+    if shard_by == "server":
+        if not informer.synced:
+            return True
+        body = informer.find(namespace, spec.get("database"))
+        if body is not None:
+            server = placed_server(body["spec"], body.get("status", {}))
+    return owns_database(namespace, spec.get("database"), server)
+
+
+def owns_fleet(spec, status, namespace, name, **kwargs):
+    return owns_database(
+        namespace, f"fleet:{name}", placed_server(spec, status)
+    )
+
+
+async def claim_shard():
+    """
+    Put this replica's finalizer on the objects it owns after the shard
+    membership changed, dropping those of replicas that left. The update
+    also wakes kopf up on the new owner, which resumes the objects.
+    """
+    api = sharding.api
+    members = sharding.ring.members
+    identity = sharding.identity
+
+    def claim():
+        for kind, owns in (
+            ("Postgres", owns_postgres),
+            ("PostgresUser", owns_postgresuser),
+            ("PostgresFleet", owns_fleet),
+        ):
+            resource = pykube.object_factory(
+                api, f"{API_GROUP}/{API_VERSION}", kind
+            )
+            for obj in resource.objects(api).filter(namespace=pykube.all):
+                meta = obj.obj["metadata"]
+                if meta.get("deletionTimestamp") or not owns(
+                    obj.obj.get("spec", {}),
+                    obj.obj.get("status", {}),
+                    namespace=meta["namespace"],
+                    name=meta["name"],
+                ):
+                    continue
+                finalizers = meta.get("finalizers", [])
+                claimed = claim_finalizers(finalizers, identity, members)
+                if claimed != finalizers:
+                    meta["finalizers"] = claimed
+                    obj.update()
+
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, claim)
+    except Exception as e:
+        batch_logger.error(f"Claiming shard objects failed: {e}")
+
+
+@kopf.on.cleanup()
+async def cleanup(**kwargs):
+    """
+    Stop background tasks and close pooled database connections
+    """
+    informer_task.cancel()
+    await asyncio.gather(*(s.stop() for s in drift_scanners.values()))
+    await servers.close()
+    if sharding is not None:
+        await sharding.stop()
+    await tracing.stop()
+    events.stop()
 
 
 @kopf.on.login(errors=kopf.ErrorsMode.PERMANENT)
@@ -72,63 +369,545 @@ async def login_with_pykube(**kwargs):
     Create an authenticated pykube API client and tell kopf to piggyback on
     pykube for its own authentication.
     """
-    global _kapi
+    global _kapi, secret_cache
     kcfg = pykube.KubeConfig.from_env()
     _kapi = pykube.HTTPClient(kcfg)
+    secret_cache = SecretCache(_kapi)
     return kopf.login_via_pykube(**kwargs)
 
 
-@kopf.on.resume(API_GROUP, API_VERSION, "postgres")
-@kopf.on.create(API_GROUP, API_VERSION, "postgres")
-async def create_fn(spec, logger=None, **kwargs):
-    cpd = await Database.from_spec(spec, master_conn)
-    await cpd.create_database(
-        logger,
-    )
+def placed_server(spec, status):
+    """
+    Return the name of the server a CR's database lives on, if known
+    """
+    name = spec.get("server") or status.get("server")
+    if name is None and len(servers.servers) == 1:
+        name = next(iter(servers.servers))
+    return name
+
+
+async def place_server(spec, status, patch):
+    """
+    Return the name and connection of the server for a CR, placing new
+    databases on the least loaded server and recording it in the status.
+    A database that already exists, e.g. from before the status was
+    recorded, stays on its server.
+    """
+    name = placed_server(spec, status)
+    try:
+        if name is None:
+            name = await servers.locate(spec["database"])
+        if name is None:
+            name = await servers.place()
+        conn = servers.get(name)
+    except UnknownServerError as e:
+        raise kopf.PermanentError(str(e))
+    except NoHealthyServerError as e:
+        raise kopf.TemporaryError(str(e), delay=30)
+    if status.get("server") != name:
+        patch.status["server"] = name
+    return name, conn
+
+
+@contextmanager
+def backing_off(retry):
+    """
+    Turn failures to reach Postgres into kopf retries with jittered
+    exponential backoff, waiting at least until an open circuit breaker
+    lets connections through again
+    """
+    try:
+        yield
+    except Exception as e:
+        if not is_transient(e):
+            raise
+        minimum = e.retry_after if isinstance(e, CircuitOpenError) else 0
+        raise kopf.TemporaryError(
+            f"Postgres unavailable: {e}",
+            delay=backoff_delay(retry, minimum=minimum),
+        )
+
+
+def record_fingerprint(patch, spec, applied):
+    """
+    Store the fingerprint of the applied spec in the CR status, or clear it
+    if the spec was only partially applied so the next resume re-checks it
+    """
+    patch.status["fingerprint"] = spec_fingerprint(spec) if applied else None
+
+
+@kopf.on.create(API_GROUP, API_VERSION, "postgres", when=owns_postgres)
+@instrumented
+async def create_fn(
+    spec, status, patch, namespace, name, logger=None, retry=0, **kwargs
+):
+    server, conn = await place_server(spec, status, patch)
+    drift_scanners[server].register(namespace, name, spec)
+    cpd = await Database.from_spec(spec, conn)
+    with backing_off(retry):
+        async with conn.scheduler.slot(PRIORITY_CREATE, namespace):
+            applied = await cpd.create_database(
+                logger,
+            )
+    record_fingerprint(patch, spec, applied)
+
+
+@kopf.on.resume(API_GROUP, API_VERSION, "postgres", when=owns_postgres)
+@instrumented
+async def resume_fn(
+    spec, status, patch, namespace, name, logger=None, retry=0, **kwargs
+):
+    """
+    Only touch databases that drifted while the operator was down. The
+    database list is read once per server and shared by all resumes; a
+    database that exists with an unchanged spec fingerprint is skipped.
+    """
+    server, conn = await place_server(spec, status, patch)
+    drift_scanners[server].register(namespace, name, spec)
+    cpd = await Database.from_spec(spec, conn)
+    with backing_off(retry):
+        databases = await conn.catalog.databases()
+        if cpd.database_name in databases and status.get(
+            "fingerprint"
+        ) == spec_fingerprint(spec):
+            logger.debug(f"Database {cpd.database_name} is up to date")
+            return
+        async with conn.scheduler.slot(PRIORITY_CREATE, namespace):
+            if cpd.database_name not in databases:
+                applied = await cpd.create_database(logger)
+            else:
+                applied = await cpd.sync_database(logger)
+    record_fingerprint(patch, spec, applied)
 
 
-@kopf.on.delete(API_GROUP, API_VERSION, "postgres")
-async def deleted(spec, logger, **kwargs):
+@kopf.on.delete(API_GROUP, API_VERSION, "postgres", when=owns_postgres)
+@instrumented
+async def deleted(spec, status, namespace, name, logger, retry=0, **kwargs):
     """
     Handle the deletion of a postgres CR.
     If dropOnDelete is set to false prevent the deletion of a CR
     """
-    cpd = await Database.from_spec(spec, master_conn)
+    server = placed_server(spec, status)
+    if server is None:
+        logger.warning(f"No server recorded for {name}, nothing to drop")
+        return
+    for scanner in drift_scanners.values():
+        scanner.forget(namespace, name)
+    spec_debouncer.forget((namespace, name))
+    conn = servers.get(server)
+    cpd = await Database.from_spec(spec, conn)
     if cpd.drop_database:
-        await cpd.delete_database(
-            logger,
-        )
+        with backing_off(retry):
+            await cpd.delete_database(logger)
     if not cpd.drop_database:
         logger.warning(f"Database {cpd.database_name} will not be dropped")
 
 
-@kopf.on.field(API_GROUP, API_VERSION, "postgres", field="spec")
-async def on_spec_data(old, new, name, logger=None, **kwargs):
+@kopf.on.field(
+    API_GROUP, API_VERSION, "postgres", field="spec", when=owns_postgres
+)
+@instrumented
+async def on_spec_data(
+    old, new, status, namespace, name, patch, logger=None, retry=0, **kwargs
+):
     """
     This will update permissions of PostgresUsers on update.
     This will also update extensions. schemas
-    on update of postgres CR fields
+    on update of postgres CR fields.
+    Changes are applied once the spec has been quiet for SPEC_QUIET_WINDOW
+    seconds; kopf then passes the last handled spec as old, so a burst of
+    edits becomes one diff. Waiting is not counted as a retry.
+    """
+    logger.info(f"Data changed: {old} -> {new}")
+    if old is None:
+        return
+    key = (namespace, name)
+    if retry == 0:
+        spec_debouncer.settle(key)
+    wait = spec_debouncer.remaining(key, json.dumps(new, sort_keys=True))
+    if wait > 0:
+        raise Deferred(
+            f"Waiting {wait:.1f}s for further changes to {name}", delay=wait
+        )
+    retry = max(0, retry - spec_debouncer.waits(key))
+    retrying = False
+    try:
+        await apply_spec_change(
+            old, new, status, namespace, name, patch, logger, retry
+        )
+    except kopf.TemporaryError:
+        # A retry keeps the quiet window it already waited out
+        retrying = True
+        raise
+    finally:
+        if not retrying:
+            spec_debouncer.forget(key)
+
+
+async def apply_spec_change(
+    old, new, status, namespace, name, patch, logger, retry
+):
+    """
+    Apply the difference between two specs of a Postgres CR
     """
-    logger.warning(f"Data changed: {old} -> {new}")
-    if old is not None:
-        specs_obj = Database.from_spec(new, master_conn), Database.from_spec(
-            old, master_conn
+    server = placed_server(old, status)
+    if placed_server(new, status) != server:
+        logger.error(LOG_SERVER_NOT_ALLOWED.format(name))
+        return
+    if server is None:
+        logger.error(f"No server recorded for {name}, not updating")
+        return
+    try:
+        plan = ReconcilePlan.compile(old, new)
+    except ImmutableFieldError:
+        logger.error(LOG_NOT_ALLOWED.format(name))
+        return
+    if plan.drop_on_delete is not None:
+        logger.info(
+            f"dropOnDelete of {plan.database} is now {plan.drop_on_delete}"
         )
-        [obj_new, obj_old] = await asyncio.gather(*specs_obj)
-        if obj_new.database_name != obj_old.database_name:
-            logger.error(LOG_NOT_ALLOWED.format(name))
+    conn = servers.get(server)
+    if dry_run:
+        with backing_off(retry):
+            capabilities = await conn.capabilities.get()
+        logger.info(
+            "Dry run, not applying:\n"
+            f"{plan.describe(capabilities.requires)}"
+        )
+        return
+    applied = True
+    if not plan.is_empty:
+        cpd = await Database.from_spec(new, conn)
+        with backing_off(retry):
+            async with conn.scheduler.slot(PRIORITY_UPDATE, namespace):
+                applied = await cpd.update_database(
+                    plan.new_extensions,
+                    plan.dropped_extensions,
+                    plan.new_schemas,
+                    plan.dropped_schemas,
+                    logger,
+                )
+    drift_scanners[server].register(namespace, name, new)
+    record_fingerprint(patch, new, applied)
+
+
+async def apply_fleet(conn, old, new, namespace, name, patch, logger, sync):
+    """
+    Diff a fleet against its server's catalog and apply the result,
+    recording compact member counts in the status
+    """
+    comment = member_comment(namespace, name)
+    try:
+        members = len(fleet_members(new)) if new is not None else 0
+        existing = await existing_databases(conn)
+        created = await created_members(conn, comment) if old else set()
+        plan = FleetPlan.compile(old, new, existing, sync, created)
+    except InvalidFleetError as e:
+        raise kopf.PermanentError(str(e))
+    if dry_run:
+        logger.info(
+            f"Dry run, not applying to fleet {name}: "
+            f"{len(plan.create)} to create, {len(plan.update)} to update, "
+            f"{len(plan.drop)} to drop"
+        )
+        return
+    result = await apply_fleet_plan(
+        conn, new or old, plan, namespace, sync, comment
+    )
+    conn.catalog.invalidate()
+    logger.info(
+        f"Fleet {name}: {len(plan.create)} to create, "
+        f"{len(plan.update)} to update, {result.applied} applied, "
+        f"{result.dropped} dropped, {len(result.failed)} failed"
+    )
+    if new is not None:
+        patch.status["members"] = result.status(members)
+        patch.status["fingerprint"] = (
+            template_fingerprint(new) if not result.failed else None
+        )
+
+
+@kopf.on.resume(API_GROUP, API_VERSION, "postgresfleets", when=owns_fleet)
+@kopf.on.create(API_GROUP, API_VERSION, "postgresfleets", when=owns_fleet)
+@instrumented
+async def reconcile_fleet_fn(
+    spec, status, patch, namespace, name, logger, retry=0, **kwargs
+):
+    """
+    Create the missing members of a fleet. Existing members are only
+    checked against their catalogs when the template changed since it was
+    last fully applied.
+    """
+    server, conn = await place_server(spec, status, patch)
+    sync = status.get("fingerprint") != template_fingerprint(spec)
+    with backing_off(retry):
+        await apply_fleet(
+            conn, None, spec, namespace, name, patch, logger, sync
+        )
+
+
+@kopf.on.field(
+    API_GROUP, API_VERSION, "postgresfleets", field="spec", when=owns_fleet
+)
+@instrumented
+async def update_fleet_fn(
+    old, new, status, namespace, name, patch, logger, retry=0, **kwargs
+):
+    """
+    Create added members, drop removed ones if the template's dropOnDelete
+    is set, and apply template changes to all remaining members
+    """
+    if old is None:
+        return
+    server = placed_server(old, status)
+    if placed_server(new, status) != server:
+        logger.error(LOG_SERVER_NOT_ALLOWED.format(name))
+        return
+    if server is None:
+        logger.error(f"No server recorded for {name}, not updating")
+        return
+    with backing_off(retry):
+        await apply_fleet(
+            servers.get(server),
+            old,
+            new,
+            namespace,
+            name,
+            patch,
+            logger,
+            False,
+        )
+
+
+@kopf.on.delete(API_GROUP, API_VERSION, "postgresfleets", when=owns_fleet)
+@instrumented
+async def delete_fleet_fn(
+    spec, status, patch, namespace, name, logger, retry=0, **kwargs
+):
+    server = placed_server(spec, status)
+    if server is None:
+        logger.warning(f"No server recorded for {name}, nothing to drop")
+        return
+    if not spec.get("template", {}).get("dropOnDelete", False):
+        logger.warning(f"Databases of fleet {name} will not be dropped")
+        return
+    with backing_off(retry):
+        await apply_fleet(
+            servers.get(server),
+            spec,
+            None,
+            namespace,
+            name,
+            patch,
+            logger,
+            False,
+        )
+
+
+def available_extensions(spec, status):
+    """
+    Return the extensions a CR may use from the cached server probes: those
+    of its server, or those on every server when it is not placed yet.
+    None if no probe has finished yet.
+    """
+    name = placed_server(spec, status)
+    conns = [conn for n, conn in servers if name is None or n == name]
+    known = [conn.capabilities.peek() for conn in conns]
+    known = [
+        capabilities for capabilities in known if capabilities is not None
+    ]
+    if not known:
+        return None
+    return frozenset.intersection(*(c.extensions for c in known))
+
+
+def register_admission():
+    """
+    Register the validating webhooks. kopf refuses to start with admission
+    handlers but no webhook server, so this is only done when one is
+    configured, and once per process.
+    """
+    global admission_registered
+    if admission_registered:
+        return
+    kopf.on.validate(API_GROUP, API_VERSION, "postgres")(validate_postgres)
+    kopf.on.validate(API_GROUP, API_VERSION, "postgresfleets")(validate_fleet)
+    admission_registered = True
+
+
+def check_admission(spec, errors):
+    server = spec.get("server")
+    if server and server not in servers.servers:
+        errors = [f"Unknown server {server}"] + errors
+    if errors:
+        raise kopf.AdmissionError("; ".join(errors), code=422)
+
+
+async def validate_postgres(spec, status, old=None, operation=None, **kwargs):
+    """
+    Reject Postgres specs with invalid names or unavailable extensions
+    """
+    if operation not in ("CREATE", "UPDATE"):
+        return
+    old_spec = old.get("spec") if old else None
+    check_admission(
+        spec,
+        postgres_errors(spec, available_extensions(spec, status), old_spec),
+    )
+
+
+async def validate_fleet(spec, status, old=None, operation=None, **kwargs):
+    """
+    Reject PostgresFleets with invalid database names or templates
+    """
+    if operation not in ("CREATE", "UPDATE"):
+        return
+    old_spec = old.get("spec") if old else None
+    check_admission(
+        spec,
+        fleet_errors(spec, available_extensions(spec, status), old_spec),
+    )
+
+
+@kopf.on.event(API_GROUP, API_VERSION, "postgres")
+def postgres_event(event, **kwargs):
+    """
+    Feed the watch stream of Postgres CRs into the informer
+    """
+    informer.observe(event["type"], event["object"])
+
+
+async def user_server(spec, namespace):
+    """
+    Return the name and connection of the server holding the database of
+    a PostgresUser, as recorded on the Postgres CR for that database.
+    Users only get access to databases declared in their own namespace.
+    """
+    body = informer.find(namespace, spec["database"])
+    if body is None:
+        raise kopf.TemporaryError(
+            f"No Postgres in {namespace} for database {spec['database']}",
+            delay=30,
+        )
+    name = placed_server(body["spec"], body.get("status", {}))
+    if name is None:
+        raise kopf.TemporaryError(
+            f"Database {spec['database']} is not placed yet", delay=30
+        )
+    return name, servers.get(name)
+
+
+async def flush_grants(key, steps):
+    """
+    Apply the grants of every role queued for one database in one session
+    """
+    server, database = key
+    conn = servers.get(server)
+    async with conn.scheduler.slot(PRIORITY_UPDATE, database):
+        return await apply_grants(conn, steps, batch_logger)
+
+
+async def grant_user(spec, namespace, body, patch, logger, revoke_from=()):
+    server, conn = await user_server(spec, namespace)
+    secret_data = {
+        "username": spec["role"],
+        "database": spec["database"],
+        "host": conn.postgres_host,
+        "port": str(conn.postgres_port),
+    }
+    try:
+        check_role(spec["role"], conn.master_user)
+        password = await secret_cache.ensure_password(
+            namespace, spec["secretName"], secret_data, owner=body
+        )
+        user = PostgresUser.from_spec(spec, password)
+    except (
+        ForbiddenRoleError,
+        InvalidPrivilegesError,
+        MissingPasswordError,
+    ) as e:
+        raise kopf.PermanentError(str(e))
+    step = user.grant_step(revoke_from)
+    applied = await grant_batcher.submit((server, user.database), step)
+    if not applied:
+        raise kopf.TemporaryError(
+            f"Could not grant {user.role} access to {user.database}",
+            delay=60,
+        )
+    # Where to drop the role, even once the Postgres CR is gone
+    patch.status["server"] = server
+    logger.info(
+        LOG_ROLE.format(user.role, ", ".join(user.privileges), user.database)
+    )
+
+
+@kopf.on.resume(
+    API_GROUP, API_VERSION, "postgresusers", when=owns_postgresuser
+)
+@kopf.on.create(
+    API_GROUP, API_VERSION, "postgresusers", when=owns_postgresuser
+)
+@instrumented
+async def create_user_fn(
+    spec, namespace, body, patch, logger, retry=0, **kwargs
+):
+    require_informer()
+    with backing_off(retry):
+        await grant_user(spec, namespace, body, patch, logger)
+
+
+@kopf.on.update(
+    API_GROUP, API_VERSION, "postgresusers", when=owns_postgresuser
+)
+@instrumented
+async def update_user_fn(
+    old, new, status, namespace, name, body, patch, logger, retry=0, **kwargs
+):
+    require_informer()
+    old_spec, new_spec = old["spec"], new["spec"]
+    if old_spec["role"] != new_spec["role"]:
+        logger.error(LOG_ROLE_NOT_ALLOWED.format(name))
+        return
+    if old_spec["secretName"] != new_spec["secretName"]:
+        secret_cache.forget(namespace, old_spec["secretName"])
+    revoke_from = ()
+    if old_spec["database"] != new_spec["database"]:
+        old_server = status.get("server")
+        if old_server is None:
+            old_server, _ = await user_server(old_spec, namespace)
+        new_server, _ = await user_server(new_spec, namespace)
+        if old_server == new_server:
+            revoke_from = (old_spec["database"],)
         else:
-            tasks = filter_on_postgres_update(
-                obj_old.extensions, obj_new.extensions
-            ), filter_on_postgres_update(obj_old.schemas, obj_new.schemas)
-            [
-                (new_ext, dropped_ext),
-                (new_schemas, dropped_schemas),
-            ] = await asyncio.gather(*tasks)
-            await obj_new.update_database(
-                new_ext,
-                dropped_ext,
-                new_schemas,
-                dropped_schemas,
-                logger,
-            )
+            # Roles are per server, so the old one is left behind otherwise
+            old_conn = servers.get(old_server)
+            with backing_off(retry):
+                async with old_conn.scheduler.slot(PRIORITY_DELETE, namespace):
+                    await drop_role(
+                        old_conn,
+                        old_spec["role"],
+                        old_spec["database"],
+                        logger,
+                    )
+    with backing_off(retry):
+        await grant_user(new_spec, namespace, body, patch, logger, revoke_from)
+
+
+@kopf.on.delete(
+    API_GROUP, API_VERSION, "postgresusers", when=owns_postgresuser
+)
+@instrumented
+async def delete_user_fn(spec, status, namespace, logger, retry=0, **kwargs):
+    """
+    Drop the role of a PostgresUser on the server it was granted on. Its
+    Secret is owned by the CR and is garbage collected with it.
+    """
+    require_informer()
+    secret_cache.forget(namespace, spec["secretName"])
+    if status.get("server") is None:
+        _, conn = await user_server(spec, namespace)
+    else:
+        conn = servers.get(status["server"])
+    with backing_off(retry):
+        async with conn.scheduler.slot(PRIORITY_DELETE, namespace):
+            await drop_role(conn, spec["role"], spec["database"], logger)
@@ -0,0 +1,197 @@
+"""
+Cached access to Kubernetes objects the handlers read on every reconcile
+"""
+
+import asyncio
+import base64
+import secrets
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import attr  # type: ignore
+import kopf  # type: ignore
+import pykube  # type: ignore
+
+PASSWORD_KEY = "password"
+
+
+class MissingPasswordError(Exception):
+    pass
+
+
+def _decode(data):
+    return {k: base64.b64decode(v).decode() for k, v in data.items()}
+
+
+def _encode(data):
+    return {k: base64.b64encode(v.encode()).decode() for k, v in data.items()}
+
+
+@attr.s(auto_attribs=True)
+class SecretCache:
+    """
+    Reads Secrets through a local cache that is refreshed after ``ttl``
+    seconds and updated on every write, so reconciles of the same
+    PostgresUser do not GET its Secret from the API server each time.
+    """
+
+    api: object
+    ttl: float = 600.0
+    _cache: Dict[Tuple[str, str], Tuple[float, dict]] = attr.ib(
+        factory=dict, init=False
+    )
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, fn, *args)
+
+    def _get(self, namespace, name):
+        obj = pykube.Secret.objects(self.api, namespace=namespace).get_or_none(
+            name=name
+        )
+        return None if obj is None else _decode(obj.obj.get("data", {}))
+
+    async def get(self, namespace, name):
+        """
+        Return the decoded data of a Secret, or None if it does not exist.
+        Missing Secrets are not cached, as they are about to be created.
+        """
+        key = (namespace, name)
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        data = await self._run(self._get, namespace, name)
+        if data is not None:
+            self._cache[key] = (time.monotonic(), data)
+        return data
+
+    def _create(self, body):
+        pykube.Secret(self.api, body).create()
+
+    async def create(self, namespace, name, data, owner=None):
+        body = {
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "metadata": {"name": name, "namespace": namespace},
+            "type": "Opaque",
+            "data": _encode(data),
+        }
+        if owner is not None:
+            kopf.adopt(body, owner=owner)
+        await self._run(self._create, body)
+        self._cache[(namespace, name)] = (time.monotonic(), dict(data))
+
+    def forget(self, namespace, name):
+        self._cache.pop((namespace, name), None)
+
+    async def ensure_password(self, namespace, name, data, owner=None):
+        """
+        Return the password stored in a Secret, creating the Secret with a
+        generated password and the given extra data if it does not exist
+        """
+        existing = await self.get(namespace, name)
+        if existing is not None:
+            if PASSWORD_KEY not in existing:
+                raise MissingPasswordError(
+                    f"Secret {name} has no {PASSWORD_KEY} key"
+                )
+            return existing[PASSWORD_KEY]
+        password = secrets.token_urlsafe(24)
+        await self.create(
+            namespace, name, {**data, PASSWORD_KEY: password}, owner=owner
+        )
+        return password
+
+
+def _key(body):
+    return body["metadata"]["namespace"], body["metadata"]["name"]
+
+
+@attr.s(auto_attribs=True)
+class PostgresInformer:
+    """
+    An in-memory copy of all Postgres CRs, fed by the watch stream and
+    indexed by namespace/name and by spec.database so handlers can look
+    them up without calling the API server. A periodic full list replaces
+    the cache to drop objects whose deletion was missed while the watch
+    was reconnecting; until the first one, the cache may miss objects.
+    """
+
+    by_key: Dict[Tuple[str, str], dict] = attr.ib(factory=dict, init=False)
+    by_database: Dict[str, Set[Tuple[str, str]]] = attr.ib(
+        factory=dict, init=False
+    )
+    # Whether the cache holds a full list
+    synced: bool = attr.ib(default=False, init=False)
+    # Events seen while a resync is listing, applied on top of its result
+    _pending: Optional[List[Tuple[str, dict]]] = attr.ib(
+        default=None, init=False
+    )
+
+    def _remove(self, key):
+        body = self.by_key.pop(key, None)
+        if body is None:
+            return
+        database = body.get("spec", {}).get("database")
+        keys = self.by_database.get(database, set())
+        keys.discard(key)
+        if not keys:
+            self.by_database.pop(database, None)
+
+    def _apply(self, event_type, body):
+        key = _key(body)
+        self._remove(key)
+        if event_type == "DELETED":
+            return
+        self.by_key[key] = body
+        database = body.get("spec", {}).get("database")
+        self.by_database.setdefault(database, set()).add(key)
+
+    def observe(self, event_type, body):
+        """
+        Apply a watch event; initial listings have no event type
+        """
+        body = dict(body)
+        if self._pending is not None:
+            self._pending.append((event_type, body))
+        self._apply(event_type, body)
+
+    def get(self, namespace, name):
+        return self.by_key.get((namespace, name))
+
+    def find(self, namespace, database):
+        """
+        Return the Postgres CR declaring a database in a namespace
+        """
+        for ns, name in self.by_database.get(database, ()):
+            if ns == namespace:
+                return self.by_key[(ns, name)]
+        return None
+
+    def replace(self, bodies):
+        self.by_key.clear()
+        self.by_database.clear()
+        for body in bodies:
+            self._apply(None, body)
+        self.synced = True
+
+    async def resync(self, api, resource):
+        """
+        Replace the cache with a full list of ``resource`` objects
+        """
+        self._pending = []
+        try:
+            bodies = await asyncio.get_event_loop().run_in_executor(
+                None,
+                lambda: [
+                    obj.obj
+                    for obj in resource.objects(api).filter(
+                        namespace=pykube.all
+                    )
+                ],
+            )
+            pending = self._pending
+        finally:
+            self._pending = None
+        self.replace(bodies)
+        for event_type, body in pending:
+            self._apply(event_type, body)
@@ -0,0 +1,163 @@
+"""
+Prometheus metrics for handlers, connections and SQL statements
+"""
+
+import functools
+import time
+from contextlib import contextmanager
+
+import kopf  # type: ignore
+from prometheus_client import (  # type: ignore
+    Counter,
+    Gauge,
+    Histogram,
+    start_http_server,
+)
+
+from .events import summarizing
+from .tracing import span
+
+HANDLER_DURATION = Histogram(
+    "dboperator_handler_duration_seconds",
+    "Time spent in a kopf handler",
+    ["handler"],
+)
+HANDLER_ERRORS = Counter(
+    "dboperator_handler_errors_total",
+    "Handler invocations that raised",
+    ["handler"],
+)
+CONNECTION_ACQUIRE = Histogram(
+    "dboperator_connection_acquire_seconds",
+    "Time to get a connection from a pool or connect",
+    ["server", "target"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+STATEMENT_DURATION = Histogram(
+    "dboperator_statement_duration_seconds",
+    "Time to execute a SQL statement or batch",
+    ["kind"],
+)
+STATEMENT_ERRORS = Counter(
+    "dboperator_statement_errors_total",
+    "SQL statements or batches that failed",
+    ["kind"],
+)
+OPERATION_ERRORS = Counter(
+    "dboperator_operation_errors_total",
+    "Database operations that failed",
+    ["operation"],
+)
+CIRCUIT_OPEN = Gauge(
+    "dboperator_circuit_open",
+    "Whether connections to a Postgres server are being refused",
+    ["server"],
+)
+IN_FLIGHT = Gauge(
+    "dboperator_in_flight",
+    "Reconciliations running against a Postgres server",
+    ["server"],
+)
+QUEUED = Gauge(
+    "dboperator_queued",
+    "Reconciliations waiting for a slot on a Postgres server",
+    ["server"],
+)
+SCHEDULER_WAIT = Histogram(
+    "dboperator_scheduler_wait_seconds",
+    "Time reconciliations waited for a slot on a Postgres server",
+    ["server"],
+)
+DRIFT_SCAN_DURATION = Histogram(
+    "dboperator_drift_scan_duration_seconds",
+    "Time taken by a drift scan of a Postgres server",
+    ["server"],
+)
+DRIFTED = Gauge(
+    "dboperator_drifted",
+    "Postgres CRs found drifted by the last scan of a server",
+    ["server"],
+)
+
+_server_started = False
+
+
+def statement_kind(query):
+    """
+    Label a statement by its leading keywords, e.g. "CREATE SCHEMA"
+    """
+    words = query.split(None, 2)[:2]
+    if len(words) == 2 and words[0].upper() in {"CREATE", "DROP", "ALTER"}:
+        return " ".join(w.upper() for w in words)
+    return words[0].upper() if words else ""
+
+
+@contextmanager
+def timed_statement(kind):
+    start = time.monotonic()
+    try:
+        yield
+    except Exception:
+        STATEMENT_ERRORS.labels(kind).inc()
+        raise
+    finally:
+        STATEMENT_DURATION.labels(kind).observe(time.monotonic() - start)
+
+
+class Deferred(kopf.TemporaryError):
+    """
+    A retry a handler asks for to wait for something expected, e.g. the
+    end of a debounce window; not counted as a handler error
+    """
+
+
+def instrumented(fn):
+    """
+    Record the duration and failures of an async handler, trace it and
+    summarize it in an Event
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            with span(
+                fn.__name__,
+                handler=fn.__name__,
+                namespace=kwargs.get("namespace"),
+                name=kwargs.get("name"),
+                database=(kwargs.get("spec") or {}).get("database"),
+                retry=kwargs.get("retry"),
+            ), summarizing(fn.__name__, kwargs.get("body")):
+                return await fn(*args, **kwargs)
+        except Deferred:
+            raise
+        except Exception:
+            HANDLER_ERRORS.labels(fn.__name__).inc()
+            raise
+        finally:
+            HANDLER_DURATION.labels(fn.__name__).observe(
+                time.monotonic() - start
+            )
+
+    return wrapper
+
+
+def watch_server(name, scheduler):
+    """
+    Export the in-flight and queued counts of a server's scheduler
+    """
+    IN_FLIGHT.labels(name).set_function(lambda: scheduler.stats().in_flight)
+    QUEUED.labels(name).set_function(
+        lambda: sum(scheduler.stats().queued.values())
+    )
+
+
+def serve(port):
+    """
+    Serve /metrics on a local port, once per process
+    """
+    global _server_started
+    if port and not _server_started:
+        start_http_server(port)
+        _server_started = True
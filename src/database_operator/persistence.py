@@ -0,0 +1,73 @@
+"""
+Compact storage of the state kopf keeps on each object. By default kopf
+records handler progress both in annotations and in the status, and the
+last handled essence as plain JSON that also copies labels and
+annotations. Here progress is only kept in the status, and the essence
+holds just the spec, compressed when that makes it shorter.
+"""
+
+import base64
+import json
+import zlib
+
+import kopf  # type: ignore
+
+# Marks a compressed essence; plain JSON always starts with "{"
+COMPRESSED = "z:"
+
+
+def encode_essence(essence):
+    """
+    Serialize an essence as JSON or as compressed JSON, whichever is
+    shorter
+    """
+    plain = json.dumps(essence, separators=(",", ":"), sort_keys=True)
+    packed = zlib.compress(plain.encode(), 9)
+    compressed = COMPRESSED + base64.b64encode(packed).decode()
+    return min(plain, compressed, key=len)
+
+
+def decode_essence(encoded):
+    if encoded.startswith(COMPRESSED):
+        packed = base64.b64decode(encoded.replace(COMPRESSED, "", 1))
+        encoded = zlib.decompress(packed).decode()
+    return json.loads(encoded)
+
+
+def without_metadata(essence):
+    return {k: v for k, v in essence.items() if k != "metadata"}
+
+
+class CompactDiffBaseStorage(kopf.AnnotationsDiffBaseStorage):
+    """
+    Keeps the last handled essence in kopf's usual annotation without the
+    labels and annotations, which no handler reacts to. Plain JSON written
+    by kopf's default storage is still read, so objects keep their diff
+    base across the switch.
+    """
+
+    def build(self, *, body, extra_fields=None):
+        essence = super().build(body=body, extra_fields=extra_fields)
+        return without_metadata(essence)
+
+    def fetch(self, *, body):
+        for key in self.make_keys(self.key, body=body):
+            encoded = body.metadata.annotations.get(key)
+            if encoded is not None:
+                return without_metadata(decode_essence(encoded))
+        return None
+
+    def store(self, *, body, patch, essence):
+        encoded = encode_essence(essence)
+        for key in self.make_keys(self.key, body=body):
+            patch.metadata.annotations[key] = encoded
+        self._store_marker(prefix=self.prefix, patch=patch, body=body)
+
+
+def configure(settings):
+    """
+    Persist handler progress in the status subresource only, and the diff
+    base in its compact form
+    """
+    settings.persistence.progress_storage = kopf.StatusProgressStorage()
+    settings.persistence.diffbase_storage = CompactDiffBaseStorage()
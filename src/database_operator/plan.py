@@ -0,0 +1,131 @@
+"""
+Compiling the difference between two Postgres specs into a plan of DDL
+
+The plan for a change can be reviewed without touching a database:
+
+    python -m database_operator.plan old.json new.json
+
+where each file holds a Postgres CR or its spec as JSON, for example from
+``kubectl get postgres NAME -o json``. Without a server to ask what the
+extensions require, they are created in spec order and dropped in reverse.
+"""
+
+import json
+import sys
+from typing import Optional, Tuple
+
+import attr  # type: ignore
+
+from .databases import update_steps
+
+IMMUTABLE_FIELDS = ("database",)
+
+
+class ImmutableFieldError(Exception):
+    def __init__(self, field):
+        super().__init__(f"Changing {field} is not allowed")
+        self.field = field
+
+
+def diff_items(old, new):
+    """
+    Return the items added to and dropped from a list, in list order and
+    without duplicates, using set lookups rather than list scans
+    """
+    old_items, new_items = dict.fromkeys(old), dict.fromkeys(new)
+    added = [item for item in new_items if item not in old_items]
+    dropped = [item for item in old_items if item not in new_items]
+    return added, dropped
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class ReconcilePlan:
+    database: str
+    new_schemas: Tuple[str, ...] = ()
+    dropped_schemas: Tuple[str, ...] = ()
+    new_extensions: Tuple[str, ...] = ()
+    dropped_extensions: Tuple[str, ...] = ()
+    drop_on_delete: Optional[bool] = None
+
+    @classmethod
+    def compile(cls, old, new):
+        """
+        Diff every field of two specs. Fields that cannot be changed raise
+        ImmutableFieldError; drop_on_delete is only set when it changed.
+        """
+        for field in IMMUTABLE_FIELDS:
+            if old.get(field) != new.get(field):
+                raise ImmutableFieldError(field)
+        new_schemas, dropped_schemas = diff_items(
+            old.get("schemas", []), new.get("schemas", [])
+        )
+        new_extensions, dropped_extensions = diff_items(
+            old.get("extensions", []), new.get("extensions", [])
+        )
+        drop_on_delete = new.get("dropOnDelete", False)
+        return cls(
+            new["database"],
+            tuple(new_schemas),
+            tuple(dropped_schemas),
+            tuple(new_extensions),
+            tuple(dropped_extensions),
+            (
+                drop_on_delete
+                if drop_on_delete != old.get("dropOnDelete", False)
+                else None
+            ),
+        )
+
+    @property
+    def is_empty(self):
+        """
+        Whether the plan needs no SQL, and so no database connection
+        """
+        return not self.steps()
+
+    def steps(self, requires=None):
+        """
+        The DDL steps of the plan, in the order update_database runs them
+        given what the server's extensions require
+        """
+        return update_steps(
+            self.database,
+            self.new_extensions,
+            self.dropped_extensions,
+            self.new_schemas,
+            self.dropped_schemas,
+            requires,
+        )
+
+    def sql(self, requires=None):
+        return [
+            stmt for step in self.steps(requires) for stmt in step.statements
+        ]
+
+    def describe(self, requires=None):
+        """
+        A reviewable summary of the plan: changed fields and the SQL to run
+        """
+        lines = [f"-- Plan for database {self.database}"]
+        if self.drop_on_delete is not None:
+            lines.append(f"-- dropOnDelete becomes {self.drop_on_delete}")
+        statements = self.sql(requires)
+        lines.append(f"-- {len(statements)} statement(s)")
+        lines.extend(f"{stmt};" for stmt in statements)
+        return "\n".join(lines)
+
+
+def _load_spec(path):
+    with open(path) as f:
+        body = json.load(f)
+    return body.get("spec", body)
+
+
+def main(argv=None):
+    old_path, new_path = (argv or sys.argv[1:])[:2]
+    plan = ReconcilePlan.compile(_load_spec(old_path), _load_spec(new_path))
+    print(plan.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Long-lived asyncpg connection pools shared by all handlers
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+import asyncpg  # type: ignore
+import attr  # type: ignore
+
+
+@attr.s(auto_attribs=True)
+class _PoolEntry:
+    pool: object
+    size: int
+    last_used: float
+    in_use: int = 0
+
+
+@attr.s(auto_attribs=True)
+class PoolManager:
+    """
+    Keeps one pool for the master database and an LRU of per-database
+    pools. Every pool reserves its ``max_size`` against ``max_connections``
+    so the operator never holds more backends than that on the server.
+    Per-database pools idle for longer than ``idle_ttl`` are closed.
+    Parallel DDL reserves up to ``ddl_width`` more connections while it
+    runs.
+    """
+
+    connstr: Callable[[str], str]
+    master_database: str
+    max_connections: int = 20
+    master_pool_size: int = 4
+    database_pool_size: int = 2
+    idle_ttl: float = 300.0
+    ddl_width: int = 1
+    _extra: int = attr.ib(default=0, init=False)
+    _master: Optional[object] = attr.ib(default=None, init=False)
+    _pools: "OrderedDict[str, _PoolEntry]" = attr.ib(
+        factory=OrderedDict, init=False
+    )
+    _cond: Optional[asyncio.Condition] = attr.ib(default=None, init=False)
+
+    @property
+    def is_open(self):
+        return self._master is not None
+
+    @property
+    def reserved(self):
+        """
+        Number of connections the open pools may hold between them
+        """
+        if not self.is_open:
+            return 0
+        return (
+            self.master_pool_size
+            + self._extra
+            + sum(e.size for e in self._pools.values())
+        )
+
+    async def _create_pool(self, dbname, size):
+        return await asyncpg.create_pool(
+            self.connstr(dbname),
+            min_size=0,
+            max_size=size,
+            max_inactive_connection_lifetime=self.idle_ttl,
+        )
+
+    async def open(self):
+        if self.is_open:
+            return
+        if self.master_pool_size >= self.max_connections:
+            raise ValueError(
+                "max_connections must be larger than the master pool size"
+            )
+        if self.ddl_width > self.max_connections - self.master_pool_size:
+            raise ValueError(
+                "ddl_width must be at most max_connections minus the master "
+                "pool size"
+            )
+        self._cond = asyncio.Condition()
+        self._master = await self._create_pool(
+            self.master_database, self.master_pool_size
+        )
+
+    async def close(self):
+        if not self.is_open:
+            return
+        entries = list(self._pools.values())
+        self._pools.clear()
+        master, self._master = self._master, None
+        await asyncio.gather(
+            master.close(),  # type: ignore
+            *(e.pool.close() for e in entries),  # type: ignore
+        )
+
+    async def discard(self, dbname):
+        """
+        Close the pool for a database, e.g. before it is dropped
+        """
+        if not self.is_open:
+            return
+        async with self._cond:  # type: ignore
+            entry = self._pools.pop(dbname, None)
+            self._cond.notify_all()  # type: ignore
+        if entry is not None:
+            await entry.pool.close()  # type: ignore
+
+    def _reap_idle(self, now):
+        expired = [
+            name
+            for name, e in self._pools.items()
+            if e.in_use == 0 and now - e.last_used > self.idle_ttl
+        ]
+        return [self._pools.pop(name) for name in expired]
+
+    def _evict_lru(self):
+        for name, e in self._pools.items():
+            if e.in_use == 0:
+                return self._pools.pop(name)
+        return None
+
+    async def _free_one(self):
+        victim = self._evict_lru()
+        if victim is not None:
+            await victim.pool.close()  # type: ignore
+        else:
+            await self._cond.wait()  # type: ignore
+
+    async def _checkout(self, dbname):
+        async with self._cond:  # type: ignore
+            # Evicted pools are closed under the lock so that the cap holds
+            # even while their connections are being torn down.
+            for e in self._reap_idle(time.monotonic()):
+                await e.pool.close()  # type: ignore
+            while dbname not in self._pools:
+                if (
+                    self.reserved + self.database_pool_size
+                    <= self.max_connections
+                ):
+                    self._pools[dbname] = _PoolEntry(
+                        await self._create_pool(
+                            dbname, self.database_pool_size
+                        ),
+                        self.database_pool_size,
+                        time.monotonic(),
+                    )
+                    break
+                await self._free_one()
+            entry = self._pools[dbname]
+            self._pools.move_to_end(dbname)
+            entry.in_use += 1
+        return entry
+
+    async def _checkin(self, entry):
+        async with self._cond:  # type: ignore
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            self._cond.notify_all()  # type: ignore
+
+    @asynccontextmanager
+    async def reserve(self, size):
+        """
+        Count ``size`` connections opened outside the pools against
+        ``max_connections`` until the block exits
+        """
+        async with self._cond:  # type: ignore
+            while self.reserved + size > self.max_connections:
+                await self._free_one()
+            self._extra += size
+        try:
+            yield
+        finally:
+            async with self._cond:  # type: ignore
+                self._extra -= size
+                self._cond.notify_all()  # type: ignore
+
+    @asynccontextmanager
+    async def master_connection(self):
+        async with self._master.acquire() as conn:  # type: ignore
+            yield conn
+
+    @asynccontextmanager
+    async def database_connection(self, dbname):
+        entry = await self._checkout(dbname)
+        try:
+            async with entry.pool.acquire() as conn:  # type: ignore
+                yield conn
+        finally:
+            await self._checkin(entry)
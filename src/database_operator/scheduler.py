@@ -0,0 +1,134 @@
+"""
+Admission control between the kopf handlers and the Database methods
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Tuple
+
+import attr  # type: ignore
+
+from .metrics import SCHEDULER_WAIT
+from .tracing import span
+
+PRIORITY_DELETE = 0
+PRIORITY_UPDATE = 1
+PRIORITY_CREATE = 2
+PRIORITIES = (PRIORITY_DELETE, PRIORITY_UPDATE, PRIORITY_CREATE)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class SchedulerStats:
+    in_flight: int
+    queued: Dict[int, int]
+    waited: int
+    total_wait: float
+    max_wait: float
+
+
+@attr.s(auto_attribs=True)
+class Scheduler:
+    """
+    Limits the reconciliations in flight against one Postgres server.
+    Waiting work is served by priority (deletes, then updates, then
+    creates) and round-robin across namespaces within a priority, so a
+    bulk import in one namespace cannot starve the others.
+    """
+
+    limit: int = 10
+    name: str = "default"
+    _in_flight: int = attr.ib(default=0, init=False)
+    _queues: Dict[
+        int, "OrderedDict[str, Deque[Tuple[asyncio.Future, float]]]"
+    ] = attr.ib(
+        default=attr.Factory(lambda: {p: OrderedDict() for p in PRIORITIES}),
+        init=False,
+    )
+    _waited: int = attr.ib(default=0, init=False)
+    _total_wait: float = attr.ib(default=0.0, init=False)
+    _max_wait: float = attr.ib(default=0.0, init=False)
+
+    def stats(self):
+        return SchedulerStats(
+            self._in_flight,
+            {
+                p: sum(len(q) for q in self._queues[p].values())
+                for p in PRIORITIES
+            },
+            self._waited,
+            self._total_wait,
+            self._max_wait,
+        )
+
+    def _has_waiters(self):
+        return any(self._queues[p] for p in PRIORITIES)
+
+    def _next_waiter(self):
+        for p in PRIORITIES:
+            namespaces = self._queues[p]
+            if namespaces:
+                namespace, waiters = next(iter(namespaces.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    namespaces.move_to_end(namespace)
+                else:
+                    del namespaces[namespace]
+                return waiter
+        return None
+
+    def _dispatch(self):
+        while self._in_flight < self.limit and self._has_waiters():
+            future, queued_at = self._next_waiter()  # type: ignore
+            if future.done():
+                continue
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _record_wait(self, wait):
+        SCHEDULER_WAIT.labels(self.name).observe(wait)
+        self._waited += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+    def _remove(self, priority, namespace, entry):
+        waiters = self._queues[priority].get(namespace)
+        if waiters and entry in waiters:
+            waiters.remove(entry)
+            if not waiters:
+                del self._queues[priority][namespace]
+
+    async def _acquire(self, priority, namespace):
+        if self._in_flight < self.limit and not self._has_waiters():
+            self._in_flight += 1
+            self._record_wait(0.0)
+            return
+        entry = (asyncio.get_event_loop().create_future(), time.monotonic())
+        self._queues[priority].setdefault(namespace, deque()).append(entry)
+        try:
+            await entry[0]
+        except asyncio.CancelledError:
+            if entry[0].done() and not entry[0].cancelled():
+                # The slot was granted just as we were cancelled
+                self._release()
+            else:
+                self._remove(priority, namespace, entry)
+            raise
+        self._record_wait(time.monotonic() - entry[1])
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority, namespace):
+        """
+        Wait for a free slot and hold it for the duration of the block
+        """
+        with span("queue", priority=priority, namespace=namespace):
+            await self._acquire(priority, namespace)
+        try:
+            yield
+        finally:
+            self._release()
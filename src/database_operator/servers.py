@@ -0,0 +1,188 @@
+"""
+A registry of the Postgres servers the operator manages databases on
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import attr  # type: ignore
+
+from .databases import PostgresConnection
+
+logger = logging.getLogger(__name__)
+
+LOAD_QUERIES = {
+    "count": "SELECT count(*) FROM pg_database WHERE NOT datistemplate",
+    "size": (
+        "SELECT coalesce(sum(pg_database_size(datname)), 0) "
+        "FROM pg_database WHERE NOT datistemplate"
+    ),
+}
+
+
+class UnknownServerError(Exception):
+    pass
+
+
+class NoHealthyServerError(Exception):
+    pass
+
+
+@attr.s(auto_attribs=True)
+class ServerState:
+    healthy: bool = True
+    load: Optional[int] = None
+    last_error: Optional[str] = None
+
+
+def connection_from_config(name, config):
+    """
+    Build a PostgresConnection from one server entry of POSTGRES_SERVERS.
+    The password may be given directly or as the name of an environment
+    variable so that it can come from a Secret.
+    """
+    password = config.get("password")
+    if password is None:
+        password = os.environ[config["passwordEnv"]]
+    return PostgresConnection(
+        config.get("user", "postgres"),
+        password,
+        config["host"],
+        int(config.get("port", 5432)),
+        config.get("defaultDatabase", "postgres"),
+        max_connections=int(config.get("maxConnections", 20)),
+        pool_idle_ttl=float(config.get("poolIdleTtl", 300)),
+        max_in_flight=int(config.get("maxInFlight", 10)),
+        max_templates=int(config.get("maxTemplates", 0)),
+        drop_batch_window=float(config.get("dropBatchWindow", 0.1)),
+        ddl_width=int(config.get("ddlWidth", 1)),
+        name=name,
+    )
+
+
+@attr.s(auto_attribs=True)
+class ServerRegistry:
+    """
+    Named PostgresConnections with their health and load. Postgres specs
+    may name a server; otherwise new databases are placed on the healthy
+    server with the lowest load, measured as database count or total size.
+    """
+
+    servers: Dict[str, PostgresConnection]
+    placement: str = "count"
+    probe_ttl: float = 30.0
+    states: Dict[str, ServerState] = attr.ib(init=False)
+    _probed_at: float = attr.ib(default=float("-inf"), init=False)
+    _lock: Optional[asyncio.Lock] = attr.ib(default=None, init=False)
+
+    @states.default
+    def _states_default(self):
+        return {name: ServerState() for name in self.servers}
+
+    @classmethod
+    def from_json(cls, data, placement="count"):
+        return cls(
+            {
+                entry["name"]: connection_from_config(entry["name"], entry)
+                for entry in json.loads(data)
+            },
+            placement,
+        )
+
+    def __iter__(self):
+        return iter(self.servers.items())
+
+    def get(self, name):
+        try:
+            return self.servers[name]
+        except KeyError:
+            raise UnknownServerError(f"Unknown Postgres server {name}")
+
+    def mark(self, name, error=None):
+        """
+        Record the outcome of talking to a server
+        """
+        state = self.states[name]
+        state.healthy = error is None
+        state.last_error = None if error is None else str(error)
+
+    async def open(self):
+        await asyncio.gather(*(s.open() for s in self.servers.values()))
+
+    async def close(self):
+        await asyncio.gather(*(s.close() for s in self.servers.values()))
+
+    async def _probe(self, name):
+        try:
+            async with self.servers[name].master_connection() as conn:
+                load = await conn.fetchval(LOAD_QUERIES[self.placement])
+        except Exception as e:
+            logger.warning(f"Postgres server {name} is unhealthy: {e}")
+            self.mark(name, e)
+            return
+        self.mark(name)
+        self.states[name].load = load
+
+    async def locate(self, database):
+        """
+        Return the name of the server that already has a database, or None
+        if none has it. Raises NoHealthyServerError if it was not found
+        but a server could not be asked, since it may be there.
+        """
+        names = list(self.servers)
+        found = await asyncio.gather(
+            *(self.servers[n].catalog.databases() for n in names),
+            return_exceptions=True,
+        )
+        for name, databases in zip(names, found):
+            if not isinstance(databases, BaseException) and (
+                database in databases
+            ):
+                return name
+        failed = [
+            n for n, r in zip(names, found) if isinstance(r, BaseException)
+        ]
+        if failed:
+            raise NoHealthyServerError(
+                f"Cannot tell whether {database} exists on {', '.join(failed)}"
+            )
+        return None
+
+    async def place(self):
+        """
+        Pick the healthy server with the lowest load for a new database.
+        Loads are probed at most every ``probe_ttl`` seconds; in between,
+        placements by count are added to the cached load so that a burst
+        of creates is spread out rather than sent to one server.
+        """
+        if len(self.servers) == 1:
+            return next(iter(self.servers))
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if time.monotonic() - self._probed_at > self.probe_ttl:
+                await asyncio.gather(
+                    *(self._probe(name) for name in self.servers)
+                )
+                self._probed_at = time.monotonic()
+            candidates = [
+                (state.load, name)
+                for name, state in self.states.items()
+                if state.healthy
+                and state.load is not None
+                and not self.servers[name].breaker.is_open
+            ]
+            if not candidates:
+                # Probe again on the next placement
+                self._probed_at = float("-inf")
+                raise NoHealthyServerError(
+                    "No healthy Postgres server available"
+                )
+            name = min(candidates)[1]
+            if self.placement == "count":
+                self.states[name].load += 1  # type: ignore
+            return name
@@ -0,0 +1,215 @@
+"""
+Splitting Postgres and PostgresUser objects between operator replicas
+"""
+
+import asyncio
+import bisect
+import datetime
+import hashlib
+import logging
+from typing import Callable, FrozenSet, List, Optional, Tuple
+
+import attr  # type: ignore
+import pykube  # type: ignore
+
+GROUP_LABEL = "dboperator.p16n.org/shard-group"
+# Each replica blocks deletion of the objects it owns with its own
+# finalizer, since kopf drops the finalizer of objects no handler matches
+FINALIZER_PREFIX = "shard.dboperator.p16n.org/"
+# The finalizer of an operator running without sharding
+KOPF_FINALIZER = "kopf.zalando.org/KopfFinalizerMarker"
+
+logger = logging.getLogger(__name__)
+
+
+class Lease(pykube.objects.NamespacedAPIObject):
+    version = "coordination.k8s.io/v1"
+    endpoint = "leases"
+    kind = "Lease"
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], "big")
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class HashRing:
+    """
+    Consistent hashing of keys onto members. Each member gets ``vnodes``
+    points on the ring, so when one joins or leaves only about 1/N of the
+    keys change owner.
+    """
+
+    members: FrozenSet[str]
+    vnodes: int = 64
+    _points: List[Tuple[int, str]] = attr.ib(init=False, repr=False)
+
+    @_points.default
+    def _points_default(self):
+        return sorted(
+            (_hash(f"{member}#{i}"), member)
+            for member in self.members
+            for i in range(self.vnodes)
+        )
+
+    def owner(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, (_hash(key), ""))
+        return self._points[index % len(self._points)][1]
+
+
+def finalizer_for(identity):
+    return FINALIZER_PREFIX + identity
+
+
+def claim_finalizers(finalizers, identity, members):
+    """
+    The finalizers of an object after ``identity`` takes it over: its own
+    is added, and those of replicas that left the group or of an operator
+    that ran without sharding are removed
+    """
+    claimed = [
+        f
+        for f in finalizers
+        if f != KOPF_FINALIZER
+        and (
+            not f.startswith(FINALIZER_PREFIX)
+            or f.replace(FINALIZER_PREFIX, "", 1) in members
+        )
+    ]
+    if finalizer_for(identity) not in claimed:
+        claimed.append(finalizer_for(identity))
+    return claimed
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _parse_time(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ").replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def live_holders(leases, now):
+    """
+    The holders of the leases that have been renewed within their duration
+    """
+    holders = set()
+    for lease in leases:
+        spec = lease.get("spec", {})
+        holder, renewed = spec.get("holderIdentity"), spec.get("renewTime")
+        if not holder or not renewed:
+            continue
+        duration = spec.get("leaseDurationSeconds", 0)
+        expires = _parse_time(renewed) + datetime.timedelta(seconds=duration)
+        if expires > now:
+            holders.add(holder)
+    return frozenset(holders)
+
+
+@attr.s(auto_attribs=True)
+class ShardMembership:
+    """
+    Keeps a Lease per replica renewed in ``namespace`` and derives the
+    live replicas of the group from the Leases sharing its label. Each
+    replica owns the keys the hash ring of live replicas assigns to it;
+    ``on_change`` is called whenever the membership changes.
+    """
+
+    api: object
+    namespace: str
+    identity: str
+    group: str = "database-operator"
+    lease_duration: float = 30.0
+    on_change: Optional[Callable[[], None]] = None
+    ring: HashRing = attr.ib(init=False)
+    _task: Optional[asyncio.Task] = attr.ib(default=None, init=False)
+
+    @ring.default
+    def _ring_default(self):
+        return HashRing(frozenset({self.identity}))
+
+    @property
+    def lease_name(self):
+        return f"{self.group}-{self.identity}"
+
+    def owns(self, key):
+        return self.ring.owner(key) == self.identity
+
+    def _lease_body(self, now):
+        return {
+            "apiVersion": Lease.version,
+            "kind": Lease.kind,
+            "metadata": {
+                "name": self.lease_name,
+                "namespace": self.namespace,
+                "labels": {GROUP_LABEL: self.group},
+            },
+            "spec": {
+                "holderIdentity": self.identity,
+                "leaseDurationSeconds": int(self.lease_duration),
+                "renewTime": now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            },
+        }
+
+    def _renew_and_list(self):
+        now = _now()
+        body = self._lease_body(now)
+        lease = Lease.objects(self.api, namespace=self.namespace).get_or_none(
+            name=self.lease_name
+        )
+        if lease is None:
+            Lease(self.api, body).create()
+        else:
+            lease.obj["spec"] = body["spec"]
+            lease.update()
+        leases = Lease.objects(self.api, namespace=self.namespace).filter(
+            selector={GROUP_LABEL: self.group}
+        )
+        return live_holders([lease.obj for lease in leases], now)
+
+    def _delete(self):
+        lease = Lease.objects(self.api, namespace=self.namespace).get_or_none(
+            name=self.lease_name
+        )
+        if lease is not None:
+            lease.delete()
+
+    async def heartbeat(self):
+        """
+        Renew this replica's Lease and rebuild the ring if replicas joined
+        or left
+        """
+        members = await asyncio.get_event_loop().run_in_executor(
+            None, self._renew_and_list
+        )
+        members = members | {self.identity}
+        if members != self.ring.members:
+            logger.info(f"Shard members changed: {', '.join(sorted(members))}")
+            self.ring = HashRing(members)
+            if self.on_change is not None:
+                self.on_change()
+
+    async def _heartbeat_forever(self):
+        while True:
+            await asyncio.sleep(self.lease_duration / 3)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Renewing shard lease failed: {e}")
+
+    async def start(self):
+        await self.heartbeat()
+        self._task = asyncio.ensure_future(self._heartbeat_forever())
+
+    async def stop(self):
+        """
+        Stop renewing and delete the Lease so the others take over at once
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.get_event_loop().run_in_executor(None, self._delete)
@@ -0,0 +1,280 @@
+"""
+Trace spans for handler invocations, connections and SQL statements,
+exported as JSON lines or to an OTLP/HTTP collector. Tracing is off until
+``start`` is called, and unsampled reconciles only pay for a context
+variable lookup per span.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import secrets
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+import attr  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "database-operator"
+# Attributes a child span copies from its parent
+INHERITED = ("namespace", "name", "database")
+# Marks the context of a reconcile that was not sampled
+_UNSAMPLED = object()
+_NOOP = contextlib.nullcontext()
+_current: contextvars.ContextVar[Any] = contextvars.ContextVar(
+    "span", default=None
+)
+_tracer = None
+
+
+@attr.s(auto_attribs=True)
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    attributes: Dict[str, Any] = attr.ib(factory=dict)
+    start_ns: int = attr.ib(factory=time.time_ns)
+    end_ns: Optional[int] = None
+    error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def as_json(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": ((self.end_ns or self.start_ns) - self.start_ns)
+            / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def as_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [
+                {"key": k, "value": otlp_value(v)}
+                for k, v in self.attributes.items()
+            ],
+            "status": (
+                {"code": 2, "message": self.error}
+                if self.error is not None
+                else {"code": 1}
+            ),
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+@attr.s(auto_attribs=True)
+class JsonLinesExporter:
+    """
+    Appends each span as one JSON object per line to a file
+    """
+
+    path: str
+
+    def export(self, spans):
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span.as_json(), default=str) + "\n")
+
+
+@attr.s(auto_attribs=True)
+class OtlpExporter:
+    """
+    Posts spans to an OpenTelemetry collector's OTLP/HTTP JSON endpoint
+    """
+
+    endpoint: str = "http://localhost:4318"
+    timeout: float = 10.0
+
+    def payload(self, spans):
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": otlp_value(SERVICE_NAME),
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [span.as_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def export(self, spans):
+        request = urllib.request.Request(
+            self.endpoint.rstrip("/") + "/v1/traces",
+            data=json.dumps(self.payload(spans)).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def exporter_for(kind, path, endpoint):
+    if kind == "jsonl":
+        return JsonLinesExporter(path)
+    if kind == "otlp":
+        return OtlpExporter(endpoint)
+    raise ValueError(f"Unknown trace exporter {kind}")
+
+
+@attr.s(auto_attribs=True)
+class Tracer:
+    """
+    Samples ``ratio`` of traces and hands finished spans to the exporter
+    every ``interval`` seconds, dropping spans beyond ``max_buffered`` if
+    the exporter falls behind
+    """
+
+    exporter: Any
+    ratio: float = 1.0
+    interval: float = 5.0
+    max_buffered: int = 10000
+    dropped: int = 0
+    _spans: List[Span] = attr.ib(factory=list, init=False)
+    _task: Optional[asyncio.Future] = attr.ib(default=None, init=False)
+
+    def sampled(self):
+        return self.ratio >= 1 or random.random() < self.ratio
+
+    def record(self, span):
+        if len(self._spans) < self.max_buffered:
+            self._spans.append(span)
+        else:
+            self.dropped += 1
+
+    async def flush(self):
+        spans, self._spans = self._spans, []
+        if not spans:
+            return
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.exporter.export, spans
+            )
+        except Exception as e:
+            logger.error(f"Exporting {len(spans)} spans failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
+
+
+class _Scope:
+    """
+    Makes a span, or the unsampled marker, current for a block
+    """
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        if self.name is None:
+            self.token = _current.set(_UNSAMPLED)
+            return None
+        attributes = {
+            k: v for k, v in self.attributes.items() if v is not None
+        }
+        if self.parent is None:
+            trace_id, parent_id = secrets.token_hex(16), None
+        else:
+            trace_id, parent_id = self.parent.trace_id, self.parent.span_id
+            for key in INHERITED:
+                if key in self.parent.attributes:
+                    attributes.setdefault(key, self.parent.attributes[key])
+        self.span = Span(
+            self.name, trace_id, secrets.token_hex(8), parent_id, attributes
+        )
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        if self.span is not None:
+            self.span.end_ns = time.time_ns()
+            if exc is not None:
+                self.span.error = f"{exc_type.__name__}: {exc}"
+            self.tracer.record(self.span)
+        return False
+
+
+def span(name, /, **attributes):
+    """
+    Time a block as a child of the current span, or as the root of a new
+    trace if it is sampled. Yields the Span, or None when not traced.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NOOP
+    parent = _current.get()
+    if parent is _UNSAMPLED:
+        return _NOOP
+    if parent is None and not tracer.sampled():
+        return _Scope(tracer, None, None, attributes)
+    return _Scope(tracer, name, parent, attributes)
+
+
+def start(tracer):
+    """
+    Turn tracing on, exporting through ``tracer``
+    """
+    global _tracer
+    _tracer = tracer
+    tracer.start()
+
+
+async def stop():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        await tracer.stop()
@@ -0,0 +1,232 @@
+"""
+Provisioning of login roles and their database privileges for PostgresUsers
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import stringprep
+import unicodedata
+from typing import Tuple
+
+import asyncpg  # type: ignore
+import attr  # type: ignore
+
+from .databases import DDLStep, execute_steps, quote_ident, quote_literal
+from .validation import identifier_errors
+
+DATABASE_PRIVILEGES = {"ALL", "CONNECT", "CREATE", "TEMPORARY", "TEMP"}
+DEFAULT_PRIVILEGES = "CONNECT"
+LOG_ROLE = "Role {} granted {} on database {}"
+LOG_ROLE_DROPPED = "Role {} dropped"
+LOG_ROLE_NOT_MANAGED = "Role {} was not created by the operator, not dropped"
+# Comment of the roles the operator creates; no other role is altered
+ROLE_MARKER = "Managed by database-entity-operator"
+# Iterations of the SCRAM-SHA-256 verifiers, the default of Postgres
+SCRAM_ITERATIONS = 4096
+# What SASLprep prohibits in a password, RFC 4013 section 2.3
+PROHIBITED = (
+    stringprep.in_table_c12,
+    stringprep.in_table_c21_c22,
+    stringprep.in_table_c3,
+    stringprep.in_table_c4,
+    stringprep.in_table_c5,
+    stringprep.in_table_c6,
+    stringprep.in_table_c7,
+    stringprep.in_table_c8,
+    stringprep.in_table_c9,
+)
+
+
+class InvalidPrivilegesError(Exception):
+    pass
+
+
+class ForbiddenRoleError(Exception):
+    pass
+
+
+def check_role(role, master_user):
+    """
+    Reject invalid role names, the roles reserved by Postgres and the
+    operator's own user
+    """
+    errors = identifier_errors("Role", role)
+    if errors:
+        raise ForbiddenRoleError("; ".join(errors))
+    if role.startswith("pg_") or role == master_user:
+        raise ForbiddenRoleError(f"Role {role} cannot be managed")
+
+
+def dollar_quote(body):
+    """
+    Quote a DO block body with a dollar tag that does not occur in it
+    """
+    tag = "$$"
+    while tag in body:
+        tag = f"${tag[1:-1]}q$"
+    return f"{tag}{body}{tag}"
+
+
+def saslprep(password):
+    """
+    Normalize a password with SASLprep as Postgres does before hashing
+    it, keeping it unchanged where Postgres would
+    """
+    mapped = "".join(
+        " " if stringprep.in_table_c12(c) else c
+        for c in password
+        if not stringprep.in_table_b1(c)
+    )
+    normalized = unicodedata.normalize("NFKC", mapped)
+    if not normalized or any(
+        check(c) for c in normalized for check in PROHIBITED
+    ):
+        return password
+    if any(stringprep.in_table_d1(c) for c in normalized):
+        if any(stringprep.in_table_d2(c) for c in normalized) or not (
+            stringprep.in_table_d1(normalized[0])
+            and stringprep.in_table_d1(normalized[-1])
+        ):
+            return password
+    return normalized
+
+
+def scram_verifier(password, salt=None, iterations=SCRAM_ITERATIONS):
+    """
+    The SCRAM-SHA-256 verifier Postgres stores for a password, so the
+    password itself is never sent to the server
+    """
+    salt = os.urandom(16) if salt is None else salt
+    salted = hashlib.pbkdf2_hmac(
+        "sha256", saslprep(password).encode(), salt, iterations
+    )
+    client_key = hmac.new(salted, b"Client Key", "sha256").digest()
+    server_key = hmac.new(salted, b"Server Key", "sha256").digest()
+    stored_key = hashlib.sha256(client_key).digest()
+    return "SCRAM-SHA-256${}:{}${}:{}".format(
+        iterations,
+        *(
+            base64.b64encode(value).decode()
+            for value in (salt, stored_key, server_key)
+        ),
+    )
+
+
+def parse_privileges(privileges):
+    """
+    Parse a comma separated list of database privileges, e.g. "CONNECT,
+    TEMPORARY", rejecting anything that is not a database privilege
+    """
+    parsed = tuple(
+        dict.fromkeys(
+            p.strip().upper()
+            for p in (privileges or DEFAULT_PRIVILEGES).split(",")
+            if p.strip()
+        )
+    )
+    unknown = set(parsed) - DATABASE_PRIVILEGES
+    if unknown or not parsed:
+        raise InvalidPrivilegesError(
+            f"Invalid database privileges: {privileges!r}"
+        )
+    return parsed
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class PostgresUser:
+    role: str
+    database: str
+    privileges: Tuple[str, ...]
+    password: str = attr.ib(repr=False)
+
+    @classmethod
+    def from_spec(cls, spec, password):
+        return cls(
+            spec["role"],
+            spec["database"],
+            parse_privileges(spec.get("privileges")),
+            password,
+        )
+
+    def grant_step(self, revoke_from=()):
+        """
+        Create or update the login role and replace its privileges on the
+        database; ``revoke_from`` lists databases it no longer has access to.
+        An existing role is only updated if the operator created it, which
+        excludes superusers.
+        """
+        role = quote_ident(self.role)
+        name, marker = quote_literal(self.role), quote_literal(ROLE_MARKER)
+        statements = [
+            "DO "
+            + dollar_quote(
+                " BEGIN IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = "
+                f"{name}) THEN CREATE ROLE {role}; "
+                f"COMMENT ON ROLE {role} IS {marker}; "
+                "ELSIF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = "
+                f"{name} AND NOT rolsuper AND "
+                f"shobj_description(oid, 'pg_authid') = {marker}) THEN "
+                "RAISE EXCEPTION 'role % was not created by the operator', "
+                f"{name}; END IF; END "
+            ),
+            f"ALTER ROLE {role} WITH LOGIN PASSWORD "
+            f"{quote_literal(scram_verifier(self.password))}",
+        ]
+        for database in (*revoke_from, self.database):
+            statements.append(
+                f"REVOKE ALL ON DATABASE {quote_ident(database)} FROM {role}"
+            )
+        statements.append(
+            f"GRANT {', '.join(self.privileges)} ON DATABASE "
+            f"{quote_ident(self.database)} TO {role}"
+        )
+        return DDLStep(
+            tuple(statements),
+            LOG_ROLE.format(
+                self.role, ", ".join(self.privileges), self.database
+            ),
+        )
+
+
+async def apply_grants(conn_obj, steps, logger):
+    """
+    Run the grant steps of many roles in one master session and a single
+    transaction, falling back to a transaction per role if that fails.
+    Returns whether each step was applied.
+    """
+    async with conn_obj.master_connection() as conn:
+        return await execute_steps(conn, steps, logger, atomic_steps=True)
+
+
+async def drop_role(conn_obj, role, database, logger):
+    """
+    Hand the objects a role owns in its database to the operator's user
+    and drop the role, if the operator created it
+    """
+    async with conn_obj.master_connection() as conn:
+        managed = await conn.fetchval(
+            "SELECT NOT rolsuper AND "
+            "shobj_description(oid, 'pg_authid') IS NOT DISTINCT FROM $2 "
+            "FROM pg_roles WHERE rolname = $1",
+            role,
+            ROLE_MARKER,
+        )
+    if managed is None:
+        return
+    if not managed:
+        logger.warning(LOG_ROLE_NOT_MANAGED.format(role))
+        return
+    try:
+        async with conn_obj.database_connection(database) as conn:
+            await conn.execute(
+                f"REASSIGN OWNED BY {quote_ident(role)} TO CURRENT_USER;\n"
+                f"DROP OWNED BY {quote_ident(role)}"
+            )
+    except asyncpg.InvalidCatalogNameError:
+        # The database is already gone, and what the role owned with it
+        pass
+    async with conn_obj.master_connection() as conn:
+        await conn.execute(f"DROP ROLE IF EXISTS {quote_ident(role)}")
+    logger.info(LOG_ROLE_DROPPED.format(role))
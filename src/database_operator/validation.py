@@ -0,0 +1,129 @@
+"""
+Admission checks for Postgres and PostgresFleet specs. They only read
+in-memory state, so rejecting a bad spec costs no database query.
+"""
+
+from typing import FrozenSet, List, Optional
+
+from .databases import TEMPLATE_PREFIX
+from .fleet import InvalidFleetError, fleet_members
+
+# NAMEDATALEN - 1; longer names are silently truncated by Postgres
+MAX_IDENTIFIER_LENGTH = 63
+RESERVED_DATABASES = frozenset({"postgres", "template0", "template1"})
+# Members reported by name before the rest are only counted
+MAX_REPORTED = 5
+
+
+def identifier_errors(kind, name):
+    """
+    Return why ``name`` cannot be used as a quoted Postgres identifier
+    """
+    if not isinstance(name, str) or not name:
+        return [f"{kind} name must be a non-empty string"]
+    errors = []
+    if len(name.encode()) > MAX_IDENTIFIER_LENGTH:
+        errors.append(
+            f"{kind} name {name!r} is longer than "
+            f"{MAX_IDENTIFIER_LENGTH} bytes"
+        )
+    if '"' in name or "\x00" in name:
+        errors.append(f"{kind} name {name!r} contains '\"' or NUL")
+    return errors
+
+
+def database_errors(name):
+    errors = identifier_errors("Database", name)
+    if name in RESERVED_DATABASES or str(name).startswith(TEMPLATE_PREFIX):
+        errors.append(f"Database name {name!r} is reserved")
+    return errors
+
+
+def duplicates(items):
+    seen, repeated = set(), []
+    for item in items:
+        if item in seen and item not in repeated:
+            repeated.append(item)
+        seen.add(item)
+    return repeated
+
+
+def objects_errors(
+    schemas, extensions, available=None, known_extensions=()
+) -> List[str]:
+    """
+    Return what is wrong with lists of schemas and extensions. Extensions
+    must be in ``available`` unless that is None (not probed yet) or they
+    are in ``known_extensions``, e.g. the ones an update already had.
+    """
+    errors = []
+    for schema in schemas:
+        errors += identifier_errors("Schema", schema)
+        if str(schema).startswith("pg_"):
+            errors.append(f"Schema name {schema!r} is reserved")
+    for extension in extensions:
+        errors += identifier_errors("Extension", extension)
+    for kind, items in (("schema", schemas), ("extension", extensions)):
+        repeated = duplicates(items)
+        if repeated:
+            errors.append(f"Duplicate {kind}s: {', '.join(repeated)}")
+    if available is not None:
+        missing = [
+            e
+            for e in dict.fromkeys(extensions)
+            if e not in available and e not in known_extensions
+        ]
+        if missing:
+            errors.append(
+                f"Extensions not available on the server: "
+                f"{', '.join(missing)}"
+            )
+    return errors
+
+
+def postgres_errors(
+    spec, available: Optional[FrozenSet[str]] = None, old=None
+) -> List[str]:
+    """
+    Return what is wrong with a Postgres spec; ``old`` is the spec being
+    replaced by an update
+    """
+    old = old or {}
+    errors = database_errors(spec.get("database"))
+    if old and old.get("database") != spec.get("database"):
+        errors.append("The database name cannot be changed, create a new CR")
+    return errors + objects_errors(
+        spec.get("schemas", []),
+        spec.get("extensions", []),
+        available,
+        old.get("extensions", []),
+    )
+
+
+def fleet_errors(
+    spec, available: Optional[FrozenSet[str]] = None, old=None
+) -> List[str]:
+    """
+    Return what is wrong with a PostgresFleet spec: its member names and
+    the schemas and extensions of its template
+    """
+    old = old or {}
+    try:
+        members = fleet_members(spec)
+    except InvalidFleetError as e:
+        return [str(e)]
+    invalid = [name for name in members if database_errors(name)]
+    errors = [
+        e for name in invalid[:MAX_REPORTED] for e in database_errors(name)
+    ]
+    if len(invalid) > MAX_REPORTED:
+        errors.append(
+            f"{len(invalid) - MAX_REPORTED} more invalid database names"
+        )
+    template = spec.get("template", {})
+    return errors + objects_errors(
+        template.get("schemas", []),
+        template.get("extensions", []),
+        available,
+        old.get("template", {}).get("extensions", []),
+    )
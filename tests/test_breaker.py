@@ -0,0 +1,77 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg  # type: ignore
+import pytest  # type: ignore
+
+from database_operator.breaker import (
+    CircuitBreaker,
+    CircuitOpenError,
+    backoff_delay,
+)
+from database_operator.databases import PostgresConnection
+
+
+def test_breaker_opens_and_probes_once(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=2, reset_timeout=10)
+    breaker.record(asyncpg.InvalidCatalogNameError())
+    breaker.record(OSError())
+    breaker.check()
+    breaker.record(asyncpg.TooManyConnectionsError())
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    now[0] += 10
+    breaker.check()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record(OSError())
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.check()
+    assert e.value.retry_after == 10
+    now[0] += 10
+    breaker.check()
+    breaker.record()
+    assert not breaker.is_open
+    breaker.check()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_lets_another_through(monkeypatch):
+    conn = PostgresConnection("user", "password", "host", 5432, "postgres")
+    conn.breaker.threshold, conn.breaker.reset_timeout = 1, 0
+    conn.breaker.record(OSError())
+    connecting = asyncio.Event()
+
+    @asynccontextmanager
+    async def hanging_connection(self, database_name):
+        connecting.set()
+        await asyncio.sleep(60)
+        yield
+
+    monkeypatch.setattr(
+        PostgresConnection, "_direct_connection", hanging_connection
+    )
+
+    async def probe():
+        async with conn.master_connection():
+            pass
+
+    task = asyncio.ensure_future(probe())
+    await connecting.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert conn.breaker.is_open
+    conn.breaker.check()
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    delays = [backoff_delay(retry) for retry in range(10) for _ in range(20)]
+    assert min(delays) >= 2.5
+    assert max(delays) <= 300
+    assert len(set(delays)) > 1
+    assert backoff_delay(0, minimum=60) >= 30
@@ -0,0 +1,110 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest  # type: ignore
+
+from database_operator.catalog import (
+    CapabilityCache,
+    CatalogCache,
+    DatabaseObjects,
+    spec_fingerprint,
+)
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    async def fetch(self, query):
+        self.queries += 1
+        await asyncio.sleep(0)
+        return self.rows
+
+    async def fetchrow(self, query):
+        return (await self.fetch(query))[0]
+
+    @asynccontextmanager
+    async def master_connection(self):
+        yield self
+
+
+def test_spec_fingerprint_ignores_order_and_other_fields():
+    spec = {"database": "db", "schemas": ["a", "b"], "extensions": ["x"]}
+    same = {
+        "database": "db",
+        "schemas": ["b", "a"],
+        "extensions": ["x"],
+        "dropOnDelete": True,
+    }
+    assert spec_fingerprint(spec) == spec_fingerprint(same)
+    assert spec_fingerprint(spec) != spec_fingerprint({"database": "db"})
+
+
+@pytest.mark.asyncio
+async def test_database_objects_missing():
+    conn = FakeConnection(
+        [
+            {"kind": "schema", "name": "public"},
+            {"kind": "schema", "name": "app"},
+            {"kind": "extension", "name": "plpgsql"},
+        ]
+    )
+    objects = await DatabaseObjects.fetch(conn)
+    assert objects.missing(["new", "app", "other"], ["plpgsql", "hstore"]) == (
+        ["new", "other"],
+        ["hstore"],
+    )
+
+
+@pytest.mark.asyncio
+async def test_catalog_cache_shares_one_query():
+    conn = FakeConnection([{"datname": "a"}, {"datname": "b"}])
+    cache = CatalogCache(conn)
+    results = await asyncio.gather(*(cache.databases() for _ in range(10)))
+    assert all(r == frozenset({"a", "b"}) for r in results)
+    await cache.databases()
+    assert conn.queries == 1
+    cache.invalidate()
+    await cache.databases()
+    assert conn.queries == 2
+
+
+@pytest.mark.asyncio
+async def test_capabilities_are_probed_once():
+    conn = FakeConnection(
+        [
+            {
+                "version": 120005,
+                "extensions": ["hstore", "earthdistance", "cube"],
+                "requires": '{"earthdistance": ["cube"], "cube": []}',
+            }
+        ]
+    )
+    cache = CapabilityCache(conn)
+    capabilities = await cache.get()
+    assert "hstore" in capabilities.extensions
+    assert capabilities.requires["earthdistance"] == ("cube",)
+    assert not capabilities.force_drop
+    await cache.get()
+    assert conn.queries == 1
+    conn.rows = [{"version": 160002, "extensions": [], "requires": None}]
+    cache.invalidate()
+    assert (await cache.get()).force_drop
+
+
+@pytest.mark.asyncio
+async def test_peek_refreshes_in_background():
+    conn = FakeConnection(
+        [{"version": 160002, "extensions": ["hstore"], "requires": None}]
+    )
+    cache = CapabilityCache(conn, ttl=0)
+    assert cache.peek() is None
+    await asyncio.sleep(0.01)
+    assert cache.peek().extensions == frozenset({"hstore"})
+    conn.rows = [{"version": 160002, "extensions": [], "requires": None}]
+    assert cache.peek().extensions == frozenset({"hstore"})
+    await asyncio.sleep(0.01)
+    assert cache.peek().extensions == frozenset()
+    await cache.close()
+    assert cache._refresh is None
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import pytest  # type: ignore
+
+from database_operator.coalesce import Batcher, Debouncer
+
+
+@pytest.mark.asyncio
+async def test_items_are_batched_per_key():
+    flushed = []
+
+    async def flush(key, items):
+        flushed.append((key, items))
+        return [ValueError(i) if i < 0 else i * 2 for i in items]
+
+    batcher = Batcher(flush, window=0.01)
+    results = await asyncio.gather(
+        batcher.submit("a", 1),
+        batcher.submit("b", 2),
+        batcher.submit("a", -3),
+        return_exceptions=True,
+    )
+    assert results[:2] == [2, 4]
+    assert isinstance(results[2], ValueError)
+    assert sorted(flushed) == [("a", [1, -3]), ("b", [2])]
+
+
+@pytest.mark.asyncio
+async def test_full_batches_flush_early_and_errors_reach_everyone():
+    async def flush(key, items):
+        raise RuntimeError("server down")
+
+    batcher = Batcher(flush, window=60, max_batch=2)
+    results = await asyncio.wait_for(
+        asyncio.gather(
+            batcher.submit("a", 1),
+            batcher.submit("a", 2),
+            return_exceptions=True,
+        ),
+        timeout=1,
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_debouncer_restarts_on_change(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    debouncer = Debouncer(window=2)
+    assert debouncer.remaining("cr", "v1") == 2
+    now[0] += 1.5
+    assert debouncer.remaining("cr", "v2") == 2
+    now[0] += 1.5
+    assert debouncer.remaining("cr", "v2") == 0.5
+    now[0] += 0.5
+    assert debouncer.remaining("cr", "v2") == 0
+    assert debouncer.waits("cr") == 3
+    debouncer.settle("cr")
+    assert debouncer.waits("cr") == 0
+    debouncer.forget("cr")
+    assert debouncer.remaining("cr", "v2") == 2
+    assert Debouncer(window=0).remaining("cr", "v1") == 0
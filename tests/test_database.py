@@ -1,13 +1,32 @@
 import asyncio  # type: ignore
+import logging
+from contextlib import asynccontextmanager
 
+import asyncpg  # type: ignore
 import pytest  # type: ignore
 from pytest_postgresql.janitor import DatabaseJanitor  # type: ignore
 
+from database_operator.catalog import ServerCapabilities, objects_fingerprint
+from database_operator.coalesce import Batcher
 from database_operator.databases import (
+    TERMINATE_QUERY,
+    CreateQueue,
+    Database,
+    DDLStep,
     PostgresConnection,
+    TemplateCache,
     add_creation,
+    compile_items,
     construct_items_map,
+    creation_graph,
+    creation_steps,
+    drop_databases,
     drop_items,
+    execute_ddl,
+    execute_graph,
+    extension_order,
+    quote_ident,
+    template_name,
 )
 
 test_conn = PostgresConnection(
@@ -21,6 +40,17 @@ test_conn = PostgresConnection(
 EXTENSIONS = ["fuzzstr", "pg_statement"]
 
 
+class RecordingConnection:
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.executed = []
+
+    async def execute(self, query, *args):
+        self.executed.append(query)
+        if any(bad in query for bad in self.failing):
+            raise asyncpg.PostgresError(f"failed: {query}")
+
+
 @pytest.fixture(scope="function")
 @pytest.mark.asyncio
 async def database(postgresql_proc):
@@ -72,3 +102,328 @@ class TestPostgresSpec:
         print("damba")
         async with database as conn:
             await conn.execute('CREATE DATABASE "tanya"')
+
+
+def test_identifiers_are_quoted():
+    assert quote_ident('a"b') == '"a""b"'
+    (step,) = creation_steps('a"b', [], [])[:1]
+    assert step.statements[1] == 'REVOKE ALL ON DATABASE "a""b" FROM PUBLIC'
+
+
+def test_compile_items_skips_empty_maps():
+    steps = compile_items(
+        [
+            construct_items_map(["a", "b"], "SCHEMA", "schemas"),
+            construct_items_map([], "EXTENSION", "extensions"),
+        ],
+        add_creation,
+        "created {} {} in {}",
+        "db",
+    )
+    assert steps == [
+        DDLStep(
+            (
+                'CREATE SCHEMA IF NOT EXISTS "a"',
+                'CREATE SCHEMA IF NOT EXISTS "b"',
+            ),
+            "created schemas ('a', 'b') in db",
+        )
+    ]
+
+
+@pytest.mark.asyncio
+async def test_execute_ddl_is_one_round_trip():
+    conn = RecordingConnection()
+    steps = [DDLStep(("S1", "S2"), "one"), DDLStep(("S3",), "two")]
+    await execute_ddl(conn, steps, logging.getLogger(__name__))
+    assert conn.executed == ["S1;\nS2;\nS3"]
+    await execute_ddl(conn, [], logging.getLogger(__name__))
+    assert len(conn.executed) == 1
+
+
+@pytest.mark.asyncio
+async def test_execute_ddl_falls_back_per_statement(caplog):
+    caplog.set_level(logging.INFO)
+    conn = RecordingConnection(failing=["S2"])
+    steps = [DDLStep(("S1", "S2"), "one"), DDLStep(("S3",), "two")]
+    await execute_ddl(conn, steps, logging.getLogger(__name__))
+    assert conn.executed == ["S1;\nS2;\nS3", "S1", "S2", "S3"]
+    messages = [r.message for r in caplog.records]
+    assert "one" not in messages
+    assert "two" in messages
+
+
+REQUIRES = {
+    "postgis_topology": ("postgis",),
+    "postgis_raster": ("postgis",),
+    "earthdistance": ("cube",),
+}
+
+
+def test_extension_order_puts_requirements_first():
+    assert extension_order(
+        ["postgis_topology", "hstore", "postgis", "earthdistance"], REQUIRES
+    ) == ["postgis", "postgis_topology", "hstore", "earthdistance"]
+    steps = creation_steps("db", [], ["earthdistance", "cube"], REQUIRES)
+    assert steps[1].statements == (
+        'CREATE EXTENSION IF NOT EXISTS "cube"',
+        'CREATE EXTENSION IF NOT EXISTS "earthdistance"',
+    )
+
+
+def test_creation_graph_links_extensions_to_requirements():
+    graph = creation_graph(
+        "db", ["app"], ["postgis_raster", "postgis", "hstore"], REQUIRES
+    )
+    steps = {step.statements[0]: step for step in graph}
+    postgis = steps['CREATE EXTENSION IF NOT EXISTS "postgis"']
+    assert graph[steps['CREATE EXTENSION IF NOT EXISTS "postgis_raster"']] == (
+        postgis,
+    )
+    assert graph[postgis] == ()
+    assert graph[steps['CREATE SCHEMA IF NOT EXISTS "app"']] == ()
+    assert len(graph) == 5
+
+
+@pytest.mark.asyncio
+async def test_execute_graph_runs_independent_steps_in_parallel(caplog):
+    running, peak, executed = 0, 0, []
+
+    class SlowConnection(RecordingConnection):
+        async def execute(self, query, *args):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            executed.append(query)
+            if "bad" in query:
+                raise asyncpg.PostgresError(query)
+
+    @asynccontextmanager
+    async def connect():
+        yield SlowConnection()
+
+    a, b, c = (DDLStep((name,), name) for name in ("a", "b", "bad"))
+    after_a, after_c = DDLStep(("after_a",), ""), DDLStep(("after_c",), "")
+    graph = {after_a: (a,), a: (), b: (), c: (), after_c: (c,)}
+    logger = logging.getLogger(__name__)
+    assert not await execute_graph(connect, graph, 2, logger)
+    assert peak == 2
+    assert executed.index("after_a") > executed.index("a")
+    assert "after_c" not in executed
+    assert "Skipped ('after_c',), a dependency failed" in caplog.text
+
+
+class RecordingServer:
+    def __init__(self, version):
+        self.conn = RecordingConnection()
+        self.capabilities = self
+        self.catalog = self
+        self.version = version
+        self.ddl_width = 1
+        self.creates = CreateQueue(self, delay=0.001)
+        self.templates = TemplateCache(self)
+        self.drops = Batcher(lambda _, names: drop_databases(self, names))
+
+    async def get(self):
+        return ServerCapabilities(self.version, frozenset())
+
+    def invalidate(self):
+        pass
+
+    async def release_database(self, database_name):
+        pass
+
+    @asynccontextmanager
+    async def master_connection(self):
+        yield self.conn
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "version, statements",
+    [
+        (160002, ['DROP DATABASE IF EXISTS "app" WITH (FORCE)']),
+        (120005, [TERMINATE_QUERY, 'DROP DATABASE IF EXISTS "app"']),
+    ],
+)
+async def test_delete_database_force_drops_when_supported(version, statements):
+    server = RecordingServer(version)
+    database = Database("app", True, [], [], server)
+    await database.delete_database(logging.getLogger(__name__))
+    assert server.conn.executed == statements
+
+
+@pytest.mark.asyncio
+async def test_concurrent_deletes_share_one_batch(caplog):
+    server = RecordingServer(120005)
+    server.conn.failing = ['"b"']
+    logger = logging.getLogger(__name__)
+    await asyncio.gather(
+        *(
+            Database(name, True, [], [], server).delete_database(logger)
+            for name in ("a", "b", "c")
+        )
+    )
+    assert server.conn.executed == [
+        TERMINATE_QUERY,
+        'DROP DATABASE IF EXISTS "a"',
+        'DROP DATABASE IF EXISTS "b"',
+        'DROP DATABASE IF EXISTS "c"',
+    ]
+    errors = [r.message for r in caplog.records if r.levelname == "ERROR"]
+    assert errors == ['Error info: failed: DROP DATABASE IF EXISTS "b"']
+
+
+@pytest.mark.asyncio
+async def test_creates_are_serialized_and_retried_while_template_in_use():
+    running, peak = 0, 0
+
+    class BusyConnection(RecordingConnection):
+        async def execute(self, query, *args):
+            nonlocal running, peak
+            await super().execute(query)
+            if not query.startswith("CREATE DATABASE"):
+                return
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+            if self.executed.count(query) < 3:
+                raise asyncpg.ObjectInUseError(
+                    'source database "template1" is being accessed by '
+                    "other users"
+                )
+
+    server = RecordingServer(160002)
+    server.conn = BusyConnection()
+    server.database_connection = lambda name: server.master_connection()
+    logger = logging.getLogger(__name__)
+    created = await asyncio.gather(
+        *(
+            Database(name, True, [], [], server).create_database(logger)
+            for name in ("a", "b", "c")
+        )
+    )
+    assert created == [True] * 3
+    assert peak == 1
+    assert server.conn.executed.count('CREATE DATABASE "a"') == 3
+    server.creates.retries = 1
+    with pytest.raises(asyncpg.ObjectInUseError):
+        await Database("d", True, [], [], server).create_database(logger)
+
+
+@pytest.mark.asyncio
+async def test_create_retried_after_ddl_failure_completes_database():
+    class ExistingConnection(RecordingConnection):
+        async def execute(self, query, *args):
+            await super().execute(query)
+            if query.startswith("CREATE DATABASE"):
+                if self.executed.count(query) > 1:
+                    raise asyncpg.DuplicateDatabaseError("already exists")
+
+    server = RecordingServer(160002)
+    server.conn = ExistingConnection()
+    attempts = 0
+
+    def database_connection(name):
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise ConnectionResetError("connection lost")
+        return server.master_connection()
+
+    server.database_connection = database_connection
+    logger = logging.getLogger(__name__)
+    database = Database("app", True, ["app"], ["vector"], server)
+    with pytest.raises(ConnectionResetError):
+        await database.create_database(logger)
+    assert await database.create_database(logger)
+    assert server.conn.executed[-2:] == [
+        'CREATE DATABASE "app"',
+        "REVOKE CREATE ON SCHEMA public FROM PUBLIC;\n"
+        'REVOKE ALL ON DATABASE "app" FROM PUBLIC;\n'
+        'CREATE SCHEMA IF NOT EXISTS "app";\n'
+        'CREATE EXTENSION IF NOT EXISTS "vector"',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_only_created_databases_get_their_comment():
+    class ExistingConnection(RecordingConnection):
+        async def execute(self, query, *args):
+            await super().execute(query)
+            if query == 'CREATE DATABASE "old"':
+                raise asyncpg.DuplicateDatabaseError("already exists")
+
+    server = RecordingServer(160002)
+    server.conn = ExistingConnection()
+    server.database_connection = lambda name: server.master_connection()
+    logger = logging.getLogger(__name__)
+    for name in ("new", "old"):
+        database = Database(name, True, [], [], server, comment="fleet a/b")
+        assert await database.create_database(logger)
+    comments = [q for q in server.conn.executed if q.startswith("COMMENT")]
+    assert comments == ["COMMENT ON DATABASE \"new\" IS 'fleet a/b'"]
+
+
+class TemplateServer(RecordingServer):
+    def __init__(self):
+        super().__init__(160002)
+        self.templates = TemplateCache(self, max_templates=1)
+
+    def database_connection(self, database_name):
+        return self.master_connection()
+
+
+@pytest.mark.asyncio
+async def test_template_built_on_second_use_and_evicted():
+    server = TemplateServer()
+    logger = logging.getLogger(__name__)
+
+    async def create(name, schemas):
+        server.conn.executed.clear()
+        database = Database(name, True, schemas, [], server)
+        assert await database.create_database(logger)
+        return server.conn.executed
+
+    assert await create("a", ["app"]) == [
+        'CREATE DATABASE "a"',
+        "REVOKE CREATE ON SCHEMA public FROM PUBLIC;\n"
+        'REVOKE ALL ON DATABASE "a" FROM PUBLIC;\n'
+        'CREATE SCHEMA IF NOT EXISTS "app"',
+    ]
+    executed = await create("b", ["app"])
+    template = server.templates.templates[0]
+    assert executed[-2:] == [
+        f'CREATE DATABASE "b" TEMPLATE "{template}"',
+        'REVOKE ALL ON DATABASE "b" FROM PUBLIC',
+    ]
+    assert await create("c", ["app"]) == executed[-2:]
+    await create("d", ["other"])
+    executed = await create("e", ["other"])
+    assert f'DROP DATABASE IF EXISTS "{template}"' in executed
+    assert server.templates.templates == [template_name_of(["other"])]
+
+
+@pytest.mark.asyncio
+async def test_templates_left_by_a_previous_run_are_reused():
+    server = TemplateServer()
+    template = template_name_of(["app"])
+
+    async def fetch(query, *args):
+        return [{"datname": template}]
+
+    server.conn.fetch = fetch
+    await server.templates.load()
+    database = Database("a", True, ["app"], [], server)
+    assert await database.create_database(logging.getLogger(__name__))
+    assert server.conn.executed == [
+        f'CREATE DATABASE "a" TEMPLATE "{template}"',
+        'REVOKE ALL ON DATABASE "a" FROM PUBLIC',
+    ]
+
+
+def template_name_of(schemas):
+    return template_name(objects_fingerprint(schemas, []))
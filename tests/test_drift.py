@@ -0,0 +1,74 @@
+from contextlib import asynccontextmanager
+
+import pytest  # type: ignore
+
+from database_operator.catalog import DatabaseObjects
+from database_operator.drift import Drift, DriftScanner, diff_catalog
+
+OBJECTS = {
+    "app": DatabaseObjects(frozenset({"public", "app"}), frozenset()),
+}
+
+
+class FakeServer:
+    name = "fake"
+
+    def __init__(self, databases, objects):
+        self.databases = databases
+        self.objects = objects
+        self.queries = 0
+
+    @asynccontextmanager
+    async def master_connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def database_connection(self, database):
+        yield FakeDatabase(self, database)
+
+    async def fetch(self, query):
+        self.queries += 1
+        return [{"datname": name} for name in self.databases]
+
+
+class FakeDatabase:
+    def __init__(self, server, database):
+        self.server = server
+        self.database = database
+
+    async def fetch(self, query):
+        self.server.queries += 1
+        objects = self.server.objects[self.database]
+        return [{"kind": "schema", "name": s} for s in objects.schemas] + [
+            {"kind": "extension", "name": e} for e in objects.extensions
+        ]
+
+
+def test_diff_catalog():
+    specs = {
+        ("ns", "ok"): {"database": "app", "schemas": ["app"]},
+        ("ns", "drifted"): {
+            "database": "app",
+            "schemas": ["app", "gone"],
+            "extensions": ["hstore"],
+        },
+        ("ns", "missing"): {"database": "other"},
+    }
+    assert diff_catalog(specs, {"app"}, OBJECTS) == [
+        Drift(("ns", "drifted"), "app", False, ("gone",), ("hstore",)),
+        Drift(("ns", "missing"), "other", True),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_scan_uses_one_query_per_database():
+    server = FakeServer(["app", "unmanaged"], OBJECTS)
+    scanner = DriftScanner(server)
+    scanner.register("ns", "a", {"database": "app", "schemas": ["x"]})
+    scanner.register("ns", "b", {"database": "app"})
+    scanner.register("ns", "c", {"database": "absent"})
+    scanner.forget("ns", "b")
+    report = await scanner.scan()
+    assert server.queries == report.queries == 2
+    assert report.databases == 1
+    assert [d.key for d in report.drifts] == [("ns", "a"), ("ns", "c")]
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+import kopf  # type: ignore
+import pytest  # type: ignore
+
+from database_operator import events
+from database_operator.events import EventAggregator, Summary
+from database_operator.metrics import instrumented
+
+BODY = {"kind": "Postgres", "metadata": {"namespace": "ns", "name": "app"}}
+
+
+def test_summary_message():
+    summary = Summary(
+        "create_fn",
+        levels={logging.INFO: 3, logging.WARNING: 1},
+        seconds=0.5,
+        problem="slow",
+    )
+    assert summary.message() == (
+        "create_fn succeeded in 0.50s (3 info, 1 warning log lines); "
+        "last problem: slow"
+    )
+    later = Summary("on_spec_data", error="boom")
+    merged = summary.merge(later)
+    assert merged.failed
+    assert merged.message() == (
+        "on_spec_data failed: boom in 0.00s (3 info, 1 warning log lines), "
+        "2 reconciles since the last event; last problem: slow"
+    )
+
+
+@pytest.mark.asyncio
+async def test_reconciles_within_an_interval_are_merged():
+    posted = []
+    aggregator = EventAggregator(
+        0.05, lambda body, summary: posted.append(summary)
+    )
+    for _ in range(5):
+        aggregator.report(BODY, Summary("create_fn"))
+    other = {**BODY, "metadata": {"namespace": "ns", "name": "other"}}
+    aggregator.report(other, Summary("create_fn"))
+    assert [s.reconciles for s in posted] == [1, 1]
+    await asyncio.sleep(0.08)
+    assert [s.reconciles for s in posted] == [1, 1, 4]
+    await asyncio.sleep(0.08)
+    aggregator.report(BODY, Summary("create_fn"))
+    assert len(posted) == 4
+
+
+@pytest.mark.asyncio
+async def test_handler_log_lines_are_counted(caplog):
+    posted = []
+    settings = kopf.OperatorSettings()
+    events.start(
+        settings,
+        EventAggregator(60, lambda body, summary: posted.append(summary)),
+    )
+    logger = logging.getLogger("kopf.objects")
+
+    @instrumented
+    async def update_fn(body, logger, **kwargs):
+        logger.warning("extension missing")
+        raise kopf.TemporaryError("Postgres unavailable")
+
+    try:
+        assert settings.posting.level == logging.CRITICAL
+        with pytest.raises(kopf.TemporaryError):
+            await update_fn(body=BODY, logger=logger)
+    finally:
+        events.stop()
+    (summary,) = posted
+    assert summary.levels == {logging.WARNING: 1}
+    assert summary.retrying and not summary.failed
+    assert summary.problem == "extension missing"
@@ -0,0 +1,47 @@
+import pytest  # type: ignore
+
+from database_operator.fleet import (
+    FleetPlan,
+    FleetResult,
+    InvalidFleetError,
+    fleet_members,
+)
+
+FLEET = {
+    "databases": ["main", "t2"],
+    "range": {"prefix": "t", "start": 1, "end": 3},
+    "template": {"schemas": ["app"], "dropOnDelete": True},
+}
+
+
+def test_fleet_members():
+    assert fleet_members(FLEET) == ["main", "t2", "t1", "t3"]
+    with pytest.raises(InvalidFleetError):
+        fleet_members({"range": {"prefix": "t", "end": 10**6}})
+
+
+def test_fleet_plan_is_a_set_difference():
+    new = {
+        "databases": ["main", "t1", "t4"],
+        "template": {"schemas": ["app", "extra"], "dropOnDelete": True},
+    }
+    existing = {"main", "t1", "t3", "other"}
+    plan = FleetPlan.compile(FLEET, new, existing, created=existing)
+    assert plan.create == ("t4",)
+    assert plan.update == ("main", "t1")
+    assert plan.drop == ("t3",)
+    assert plan.template.new_schemas == ("extra",)
+    kept = {**new, "template": {"schemas": ["app", "extra"]}}
+    plan = FleetPlan.compile(new, kept, {"main", "t1", "t4"})
+    assert plan.is_empty
+    existing = {"main", "t3", "other"}
+    plan = FleetPlan.compile(FLEET, None, existing, created={"t3"})
+    assert plan.drop == ("t3",)
+
+
+def test_fleet_status_is_compact():
+    failed = [f"t{i}" for i in range(50)]
+    status = FleetResult(10, 0, failed).status(300)
+    assert status["ready"] == 250
+    assert status["failedCount"] == 50
+    assert len(status["failed"]) == 20
@@ -1,9 +1,28 @@
 import asyncio
+import logging
+from types import SimpleNamespace
 
+import attr  # type: ignore
+import kopf  # type: ignore
 import pytest  # type: ignore
 
+from database_operator import handlers
+from database_operator.catalog import spec_fingerprint
+from database_operator.coalesce import Debouncer
 from database_operator.databases import Database, PostgresConnection
-from database_operator.handlers import filter_on_postgres_update
+from database_operator.handlers import (
+    filter_on_postgres_update,
+    on_spec_data,
+    owns_postgresuser,
+    record_fingerprint,
+    require_informer,
+    resume_fn,
+    update_user_fn,
+    user_server,
+)
+from database_operator.k8s import PostgresInformer
+from database_operator.metrics import Deferred
+from database_operator.servers import ServerRegistry
 
 EXTENSIONS_BEFORE = ["postgis", "postrest"]
 EXTENSIONS_AFTER = ["mathlib", "postgis"]
@@ -38,3 +57,276 @@ async def test_filter_on_postgres_update():
     )
     assert added == ["mathlib"]
     assert dropped == ["postrest"]
+
+
+@pytest.mark.asyncio
+async def test_user_server_requires_postgres_in_namespace(monkeypatch):
+    informer = PostgresInformer()
+    monkeypatch.setattr(handlers, "informer", informer)
+    monkeypatch.setattr(
+        handlers,
+        "servers",
+        ServerRegistry({"default": master_conn}),
+        raising=False,
+    )
+    spec = {"database": "app", "role": "app"}
+    informer.observe(
+        None,
+        {
+            "metadata": {"namespace": "other", "name": "app"},
+            "spec": {"database": "app"},
+        },
+    )
+    with pytest.raises(kopf.TemporaryError):
+        await user_server(spec, "team")
+    assert await user_server(spec, "other") == ("default", master_conn)
+
+
+def test_users_wait_until_postgres_crs_are_listed(monkeypatch):
+    informer = PostgresInformer()
+    monkeypatch.setattr(handlers, "informer", informer)
+    monkeypatch.setattr(handlers, "shard_by", "server")
+    monkeypatch.setattr(
+        handlers, "sharding", SimpleNamespace(owns=lambda key: False)
+    )
+    spec = {"database": "app"}
+    assert owns_postgresuser(spec, "team")
+    with pytest.raises(kopf.TemporaryError):
+        require_informer()
+    informer.replace([])
+    assert not owns_postgresuser(spec, "team")
+    require_informer()
+
+
+@pytest.mark.asyncio
+async def test_user_moved_to_another_server_drops_old_role(monkeypatch):
+    a, b = (attr.evolve(master_conn, name=n) for n in "ab")
+    monkeypatch.setattr(
+        handlers, "servers", ServerRegistry({"a": a, "b": b}), raising=False
+    )
+    informer = PostgresInformer()
+    informer.replace(
+        [
+            {
+                "metadata": {"namespace": "team", "name": db},
+                "spec": {"database": db, "server": server},
+            }
+            for db, server in (("one", "a"), ("two", "a"), ("three", "b"))
+        ]
+    )
+    monkeypatch.setattr(handlers, "informer", informer)
+    dropped, granted = [], []
+
+    async def drop_role(conn, role, database, logger):
+        dropped.append((conn.name, role, database))
+
+    async def grant_user(spec, namespace, body, patch, logger, revoke_from):
+        granted.append((spec["database"], revoke_from))
+
+    monkeypatch.setattr(handlers, "drop_role", drop_role)
+    monkeypatch.setattr(handlers, "grant_user", grant_user)
+
+    async def move(old_db, new_db):
+        spec = {"role": "app", "secretName": "app"}
+        await update_user_fn(
+            old={"spec": dict(spec, database=old_db)},
+            new={"spec": dict(spec, database=new_db)},
+            status={"server": "a"},
+            namespace="team",
+            name="app",
+            body={},
+            patch=kopf.Patch(),
+            logger=logging.getLogger(__name__),
+        )
+
+    await move("one", "two")
+    assert (dropped, granted) == ([], [("two", ("one",))])
+    await move("two", "three")
+    assert dropped == [("a", "app", "two")]
+    assert granted[-1] == ("three", ())
+
+
+@pytest.mark.asyncio
+async def test_webhook_requires_certificate(monkeypatch):
+    monkeypatch.setenv("WEBHOOK_PORT", "8443")
+    monkeypatch.setenv("WEBHOOK_CERTFILE", "/tls/tls.crt")
+    monkeypatch.delenv("WEBHOOK_PKEYFILE", raising=False)
+    with pytest.raises(kopf.PermanentError):
+        await handlers.startup(settings=None)
+
+
+async def change_spec(old, new, retry=0, status=None, patch=None):
+    await on_spec_data(
+        old=old,
+        new=new,
+        status=status or {},
+        namespace="team",
+        name="app",
+        patch=patch if patch is not None else kopf.Patch(),
+        logger=logging.getLogger(__name__),
+        retry=retry,
+    )
+
+
+@pytest.mark.asyncio
+async def test_spec_changes_wait_without_counting_retries(monkeypatch):
+    debouncer = Debouncer(window=0.05)
+    monkeypatch.setattr(handlers, "spec_debouncer", debouncer, raising=False)
+    retries = []
+
+    async def apply_spec_change(*args):
+        retries.append(args[-1])
+        if len(retries) == 1:
+            raise kopf.TemporaryError("Postgres unavailable", delay=1)
+
+    monkeypatch.setattr(handlers, "apply_spec_change", apply_spec_change)
+    old, new = {"database": "app"}, {"database": "app", "schemas": ["a"]}
+    with pytest.raises(Deferred):
+        await change_spec(old, new, retry=0)
+    with pytest.raises(Deferred):
+        await change_spec(old, new, retry=1)
+    await asyncio.sleep(0.06)
+    with pytest.raises(kopf.TemporaryError):
+        await change_spec(old, new, retry=2)
+    # The failed attempt neither waits again nor loses its waits
+    assert debouncer.waits(("team", "app")) == 2
+    await change_spec(old, new, retry=3)
+    assert retries == [0, 1]
+    assert debouncer.waits(("team", "app")) == 0
+    assert debouncer._changed == {}
+    # A new edit settles the waits counted for the previous one
+    debouncer._waits[("team", "app")] = 5
+    with pytest.raises(Deferred):
+        await change_spec(new, old, retry=0)
+    assert debouncer.waits(("team", "app")) == 1
+
+
+@pytest.mark.asyncio
+async def test_spec_change_applied_on_server(monkeypatch):
+    debouncer = Debouncer(window=0)
+    monkeypatch.setattr(handlers, "spec_debouncer", debouncer, raising=False)
+    monkeypatch.setattr(
+        handlers,
+        "servers",
+        ServerRegistry({"default": master_conn}),
+        raising=False,
+    )
+    monkeypatch.setattr(handlers, "dry_run", False, raising=False)
+    registered, updates = [], []
+    monkeypatch.setattr(
+        handlers,
+        "drift_scanners",
+        {"default": SimpleNamespace(register=lambda *a: registered.append(a))},
+        raising=False,
+    )
+
+    async def update_database(self, *changes):
+        updates.append(changes[:-1])
+        return True
+
+    monkeypatch.setattr(Database, "update_database", update_database)
+    old = {"database": "app", "schemas": ["a"]}
+    new = {"database": "app", "schemas": ["b"]}
+    status = {"server": "default"}
+    patch = kopf.Patch()
+    await change_spec(old, new, status=status, patch=patch)
+    assert updates == [((), (), ("b",), ("a",))]
+    assert registered == [("team", "app", new)]
+    assert patch.status["fingerprint"] == spec_fingerprint(new)
+    assert debouncer._changed == {}
+    # Changes that are refused also leave nothing behind
+    await change_spec(old, dict(new, server="other"), status=status)
+    assert len(updates) == 1
+    assert debouncer._changed == {}
+
+
+def test_record_fingerprint_clears_partial_applies():
+    spec = {"database": "app", "extensions": ["citext"]}
+    patch = kopf.Patch()
+    record_fingerprint(patch, spec, True)
+    assert patch.status["fingerprint"] == spec_fingerprint(spec)
+    record_fingerprint(patch, spec, False)
+    assert patch.status["fingerprint"] is None
+
+
+@pytest.fixture
+def resumed(monkeypatch):
+    existing, calls = set(), []
+    results = {"applied": True}
+
+    async def databases():
+        return frozenset(existing)
+
+    conn = SimpleNamespace(
+        catalog=SimpleNamespace(databases=databases),
+        scheduler=master_conn.scheduler,
+    )
+    monkeypatch.setattr(
+        handlers, "servers", ServerRegistry({"a": conn}), raising=False
+    )
+    monkeypatch.setattr(
+        handlers,
+        "drift_scanners",
+        {"a": SimpleNamespace(register=lambda *args: None)},
+        raising=False,
+    )
+
+    def recording(action):
+        async def run(self, logger):
+            calls.append((action, self.database_name))
+            return results["applied"]
+
+        return run
+
+    monkeypatch.setattr(Database, "create_database", recording("create"))
+    monkeypatch.setattr(Database, "sync_database", recording("sync"))
+
+    async def resume(spec, status):
+        patch = kopf.Patch()
+        await resume_fn(
+            spec=spec,
+            status=status,
+            patch=patch,
+            namespace="team",
+            name="app",
+            logger=logging.getLogger(__name__),
+        )
+        return patch
+
+    return SimpleNamespace(
+        existing=existing, calls=calls, results=results, resume=resume
+    )
+
+
+@pytest.mark.asyncio
+async def test_resume_skips_databases_with_matching_fingerprint(resumed):
+    spec = {"database": "app", "schemas": ["a"]}
+    resumed.existing.add("app")
+    status = {"server": "a", "fingerprint": spec_fingerprint(spec)}
+    patch = await resumed.resume(spec, status)
+    assert resumed.calls == []
+    assert "fingerprint" not in patch.status
+
+
+@pytest.mark.asyncio
+async def test_resume_creates_missing_and_syncs_changed(resumed):
+    spec = {"database": "app", "schemas": ["a"]}
+    status = {"server": "a", "fingerprint": spec_fingerprint(spec)}
+    patch = await resumed.resume(spec, status)
+    assert resumed.calls == [("create", "app")]
+    assert patch.status["fingerprint"] == spec_fingerprint(spec)
+    resumed.existing.add("app")
+    changed = dict(spec, schemas=["a", "b"])
+    patch = await resumed.resume(changed, status)
+    assert resumed.calls[-1] == ("sync", "app")
+    assert patch.status["fingerprint"] == spec_fingerprint(changed)
+
+
+@pytest.mark.asyncio
+async def test_resume_clears_fingerprint_on_partial_apply(resumed):
+    spec = {"database": "app", "extensions": ["missing"]}
+    resumed.existing.add("app")
+    resumed.results["applied"] = False
+    patch = await resumed.resume(spec, {"server": "a"})
+    assert resumed.calls == [("sync", "app")]
+    assert patch.status["fingerprint"] is None
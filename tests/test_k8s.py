@@ -0,0 +1,111 @@
+import pykube  # type: ignore
+import pytest  # type: ignore
+
+from database_operator.k8s import (
+    MissingPasswordError,
+    PostgresInformer,
+    SecretCache,
+)
+
+
+def postgres(namespace, name, database):
+    return {
+        "metadata": {"namespace": namespace, "name": name},
+        "spec": {"database": database},
+    }
+
+
+class FakeObj:
+    def __init__(self, obj):
+        self.obj = obj
+
+
+class FakeResource:
+    """
+    Lists objects like a pykube query, firing a watch event mid-list
+    """
+
+    def __init__(self, informer, bodies, event):
+        self.informer = informer
+        self.bodies = bodies
+        self.event = event
+
+    def objects(self, api):
+        return self
+
+    def filter(self, namespace):
+        self.informer.observe(*self.event)
+        return [FakeObj(b) for b in self.bodies]
+
+
+def test_informer_indexes():
+    informer = PostgresInformer()
+    informer.observe(None, postgres("a", "one", "db1"))
+    informer.observe("ADDED", postgres("b", "two", "db1"))
+    assert informer.find("a", "db1")["metadata"]["name"] == "one"
+    assert informer.find("c", "db1") is None
+    informer.observe("MODIFIED", postgres("a", "one", "db2"))
+    assert informer.find("a", "db1") is None
+    assert informer.get("a", "one")["spec"]["database"] == "db2"
+    informer.observe("DELETED", postgres("b", "two", "db1"))
+    assert informer.by_database == {"db2": {("a", "one")}}
+
+
+@pytest.mark.asyncio
+async def test_informer_resync_drops_missed_deletes():
+    informer = PostgresInformer()
+    informer.observe(None, postgres("a", "stale", "db1"))
+    assert not informer.synced
+    listed = [postgres("a", "kept", "db2")]
+    added_during_list = ("ADDED", postgres("a", "new", "db3"))
+    await informer.resync(
+        None, FakeResource(informer, listed, added_during_list)
+    )
+    assert informer.synced
+    assert set(informer.by_key) == {("a", "kept"), ("a", "new")}
+    assert informer.find("a", "db1") is None
+
+
+@pytest.mark.asyncio
+async def test_secret_cache(monkeypatch):
+    cache = SecretCache(None)
+    gets, created = [], []
+
+    def get(namespace, name):
+        gets.append(name)
+        return {"nopassword": "x"} if name == "broken" else None
+
+    def create(body):
+        created.append(body)
+
+    monkeypatch.setattr(cache, "_get", get)
+    monkeypatch.setattr(cache, "_create", create)
+    password = await cache.ensure_password("ns", "creds", {"username": "u"})
+    assert password == await cache.ensure_password("ns", "creds", {})
+    assert gets == ["creds"]
+    assert created[0]["metadata"] == {"name": "creds", "namespace": "ns"}
+    assert set(created[0]["data"]) == {"username", "password"}
+    with pytest.raises(MissingPasswordError):
+        await cache.ensure_password("ns", "broken", {})
+
+
+@pytest.mark.asyncio
+async def test_secret_cache_retries_failed_create(monkeypatch):
+    cache = SecretCache(None)
+    gets, existing = [], {}
+
+    def get(namespace, name):
+        gets.append(name)
+        return existing.get(name)
+
+    def create(body):
+        raise pykube.exceptions.HTTPError(409, "already exists")
+
+    monkeypatch.setattr(cache, "_get", get)
+    monkeypatch.setattr(cache, "_create", create)
+    with pytest.raises(pykube.exceptions.HTTPError):
+        await cache.ensure_password("ns", "creds", {})
+    # Created meanwhile, e.g. by another replica
+    existing["creds"] = {"password": "theirs"}
+    assert await cache.ensure_password("ns", "creds", {}) == "theirs"
+    assert gets == ["creds", "creds"]
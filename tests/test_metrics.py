@@ -0,0 +1,54 @@
+import pytest  # type: ignore
+
+from database_operator.metrics import (
+    HANDLER_ERRORS,
+    STATEMENT_ERRORS,
+    Deferred,
+    instrumented,
+    statement_kind,
+    timed_statement,
+)
+
+
+def sample(metric, *labels):
+    return metric.labels(*labels)._value.get()
+
+
+def test_statement_kind():
+    assert statement_kind("CREATE SCHEMA IF NOT EXISTS x") == "CREATE SCHEMA"
+    assert statement_kind("drop database x") == "DROP DATABASE"
+    assert statement_kind("SELECT 1") == "SELECT"
+    assert statement_kind("") == ""
+
+
+def test_timed_statement_counts_errors():
+    before = sample(STATEMENT_ERRORS, "TEST")
+    with timed_statement("TEST"):
+        pass
+    with pytest.raises(ValueError):
+        with timed_statement("TEST"):
+            raise ValueError()
+    assert sample(STATEMENT_ERRORS, "TEST") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_instrumented_handler():
+    @instrumented
+    async def failing_fn():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        await failing_fn()
+    assert failing_fn.__name__ == "failing_fn"
+    assert sample(HANDLER_ERRORS, "failing_fn") == 1
+
+
+@pytest.mark.asyncio
+async def test_deferred_handler_is_not_an_error():
+    @instrumented
+    async def waiting_fn():
+        raise Deferred("waiting", delay=1)
+
+    with pytest.raises(Deferred):
+        await waiting_fn()
+    assert sample(HANDLER_ERRORS, "waiting_fn") == 0
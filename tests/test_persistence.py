@@ -0,0 +1,62 @@
+import json
+
+import kopf  # type: ignore
+
+from database_operator.persistence import (
+    COMPRESSED,
+    CompactDiffBaseStorage,
+    decode_essence,
+    encode_essence,
+)
+
+KEY = "kopf.zalando.org/last-handled-configuration"
+
+
+def postgres(schemas, annotations=None):
+    return kopf.Body(
+        {
+            "apiVersion": "dboperator.p16n.org/v1",
+            "kind": "Postgres",
+            "metadata": {
+                "name": "app",
+                "namespace": "default",
+                "labels": {"team": "a"},
+                "annotations": annotations or {},
+            },
+            "spec": {"database": "app", "schemas": schemas},
+            "status": {"server": "default"},
+        }
+    )
+
+
+def test_large_essences_are_compressed():
+    small = {"spec": {"database": "app"}}
+    assert encode_essence(small) == '{"spec":{"database":"app"}}'
+    large = {"spec": {"schemas": [f"schema_{i}" for i in range(200)]}}
+    encoded = encode_essence(large)
+    assert encoded.startswith(COMPRESSED)
+    assert len(encoded) < len(json.dumps(large)) / 3
+    assert decode_essence(encoded) == large
+
+
+def test_diff_base_holds_only_the_spec():
+    storage = CompactDiffBaseStorage()
+    body = postgres(["a", "b"])
+    essence = storage.build(body=body)
+    assert essence == {"spec": {"database": "app", "schemas": ["a", "b"]}}
+    patch = kopf.Patch()
+    storage.store(body=body, patch=patch, essence=essence)
+    annotations = patch["metadata"]["annotations"]
+    stored = postgres(["a", "b"], annotations)
+    assert storage.fetch(body=stored) == essence
+
+
+def test_diff_base_of_default_storage_is_read():
+    legacy = kopf.AnnotationsDiffBaseStorage()
+    body = postgres(["a"])
+    patch = kopf.Patch()
+    legacy.store(body=body, patch=patch, essence=legacy.build(body=body))
+    stored = postgres(["a"], patch["metadata"]["annotations"])
+    storage = CompactDiffBaseStorage()
+    assert KEY in stored.metadata.annotations
+    assert storage.fetch(body=stored) == storage.build(body=stored)
@@ -0,0 +1,82 @@
+import json
+
+import pytest  # type: ignore
+
+from database_operator.plan import (
+    ImmutableFieldError,
+    ReconcilePlan,
+    diff_items,
+    main,
+)
+
+OLD = {
+    "database": "db",
+    "schemas": ["a", "b"],
+    "extensions": ["hstore"],
+}
+
+
+def test_diff_items_keeps_order_and_drops_duplicates():
+    assert diff_items(["a", "b", "c"], ["d", "c", "a", "d", "e"]) == (
+        ["d", "e"],
+        ["b"],
+    )
+
+
+def test_compile_plan():
+    new = {
+        "database": "db",
+        "schemas": ["b", "c"],
+        "extensions": ["hstore", "postgis"],
+        "dropOnDelete": True,
+    }
+    plan = ReconcilePlan.compile(OLD, new)
+    assert plan == ReconcilePlan("db", ("c",), ("a",), ("postgis",), (), True)
+    assert plan.sql() == [
+        'CREATE SCHEMA IF NOT EXISTS "c"',
+        'CREATE EXTENSION IF NOT EXISTS "postgis"',
+        'DROP SCHEMA IF EXISTS "a"',
+    ]
+
+
+def test_extensions_follow_what_they_require():
+    old = dict(OLD, extensions=["postgis_topology", "postgis"])
+    new = dict(OLD, extensions=["earthdistance", "cube"])
+    requires = {
+        "earthdistance": ("cube",),
+        "postgis_topology": ("postgis",),
+    }
+    plan = ReconcilePlan.compile(old, new)
+    assert plan.sql(requires) == [
+        'CREATE EXTENSION IF NOT EXISTS "cube"',
+        'CREATE EXTENSION IF NOT EXISTS "earthdistance"',
+        'DROP EXTENSION IF EXISTS "postgis_topology"',
+        'DROP EXTENSION IF EXISTS "postgis"',
+    ]
+    assert plan.describe(requires).splitlines()[2:] == [
+        f"{stmt};" for stmt in plan.sql(requires)
+    ]
+
+
+def test_reordering_is_a_no_op():
+    new = dict(OLD, schemas=["b", "a"])
+    plan = ReconcilePlan.compile(OLD, new)
+    assert plan.is_empty
+    assert plan.drop_on_delete is None
+
+
+def test_database_is_immutable():
+    with pytest.raises(ImmutableFieldError):
+        ReconcilePlan.compile(OLD, dict(OLD, database="other"))
+
+
+def test_dry_run_cli(tmp_path, capsys):
+    old, new = tmp_path / "old.json", tmp_path / "new.json"
+    old.write_text(json.dumps({"kind": "Postgres", "spec": OLD}))
+    new.write_text(json.dumps(dict(OLD, extensions=[])))
+    main([str(old), str(new)])
+    assert capsys.readouterr().out.splitlines() == [
+        "-- Plan for database db",
+        "-- 1 statement(s)",
+        'DROP EXTENSION IF EXISTS "hstore";',
+    ]
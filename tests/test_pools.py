@@ -0,0 +1,98 @@
+from contextlib import asynccontextmanager
+
+import pytest  # type: ignore
+
+from database_operator import pools
+from database_operator.pools import PoolManager
+
+
+class FakePool:
+    def __init__(self, dsn, max_size):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.closed = False
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.dsn
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_pools(monkeypatch):
+    created = []
+
+    async def create_pool(dsn, min_size, max_size, **kwargs):
+        pool = FakePool(dsn, max_size)
+        created.append(pool)
+        return pool
+
+    monkeypatch.setattr(pools.asyncpg, "create_pool", create_pool)
+    return created
+
+
+def manager(**kwargs):
+    return PoolManager(lambda db: f"postgres://h/{db}", "postgres", **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_pools_are_reused(fake_pools):
+    pm = manager()
+    await pm.open()
+    for _ in range(3):
+        async with pm.database_connection("a") as conn:
+            assert conn == "postgres://h/a"
+    async with pm.master_connection() as conn:
+        assert conn == "postgres://h/postgres"
+    assert len(fake_pools) == 2
+    await pm.close()
+    assert all(p.closed for p in fake_pools)
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_respects_cap(fake_pools):
+    pm = manager(max_connections=8, master_pool_size=4, database_pool_size=2)
+    await pm.open()
+    for db in ["a", "b", "a", "c"]:
+        async with pm.database_connection(db):
+            pass
+    assert pm.reserved <= 8
+    assert list(pm._pools) == ["a", "c"]
+    assert [p.dsn for p in fake_pools if p.closed] == ["postgres://h/b"]
+
+
+@pytest.mark.asyncio
+async def test_idle_pools_are_reaped_and_discarded(fake_pools):
+    pm = manager(idle_ttl=-1)
+    await pm.open()
+    async with pm.database_connection("a"):
+        pass
+    async with pm.database_connection("b"):
+        pass
+    assert list(pm._pools) == ["b"]
+    await pm.discard("b")
+    assert pm._pools == {}
+    assert all(p.closed for p in fake_pools[1:])
+
+
+@pytest.mark.asyncio
+async def test_ddl_width_must_fit_beside_the_master_pool(fake_pools):
+    pm = manager(max_connections=20, master_pool_size=4, ddl_width=17)
+    with pytest.raises(ValueError):
+        await pm.open()
+
+
+@pytest.mark.asyncio
+async def test_reserve_evicts_idle_pools_and_releases(fake_pools):
+    pm = manager(max_connections=8, master_pool_size=4, database_pool_size=2)
+    await pm.open()
+    for db in ["a", "b"]:
+        async with pm.database_connection(db):
+            pass
+    async with pm.reserve(2):
+        assert pm.reserved == 8
+        assert list(pm._pools) == ["b"]
+    assert pm.reserved == 6
+    assert all(p.max_size == 2 for p in fake_pools[1:])
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest  # type: ignore
+
+from database_operator.scheduler import (
+    PRIORITY_CREATE,
+    PRIORITY_DELETE,
+    PRIORITY_UPDATE,
+    Scheduler,
+)
+
+
+async def run_queued(scheduler, jobs):
+    """
+    Hold the only slot while queueing jobs, then record the order in which
+    they are admitted
+    """
+    order = []
+    gate = asyncio.Event()
+
+    async def job(priority, namespace, label):
+        async with scheduler.slot(priority, namespace):
+            order.append(label)
+
+    async def blocker():
+        async with scheduler.slot(PRIORITY_CREATE, "blocker"):
+            await gate.wait()
+
+    tasks = [asyncio.ensure_future(blocker())]
+    await asyncio.sleep(0)
+    for priority, namespace, label in jobs:
+        tasks.append(asyncio.ensure_future(job(priority, namespace, label)))
+        await asyncio.sleep(0)
+    assert scheduler.stats().queued[PRIORITY_CREATE] == sum(
+        1 for p, _, _ in jobs if p == PRIORITY_CREATE
+    )
+    gate.set()
+    await asyncio.gather(*tasks)
+    return order
+
+
+@pytest.mark.asyncio
+async def test_priorities():
+    order = await run_queued(
+        Scheduler(1),
+        [
+            (PRIORITY_CREATE, "a", "create"),
+            (PRIORITY_UPDATE, "a", "update"),
+            (PRIORITY_DELETE, "a", "delete"),
+        ],
+    )
+    assert order == ["delete", "update", "create"]
+
+
+@pytest.mark.asyncio
+async def test_namespace_fairness():
+    jobs = [(PRIORITY_CREATE, "bulk", f"bulk{i}") for i in range(3)]
+    jobs.append((PRIORITY_CREATE, "small", "small"))
+    order = await run_queued(Scheduler(1), jobs)
+    assert order == ["bulk0", "small", "bulk1", "bulk2"]
+
+
+@pytest.mark.asyncio
+async def test_limit_and_cancellation():
+    scheduler = Scheduler(2)
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with scheduler.slot(PRIORITY_CREATE, "ns"):
+            peak = max(peak, scheduler.stats().in_flight)
+            await asyncio.sleep(0.01)
+
+    tasks = [asyncio.ensure_future(job()) for _ in range(6)]
+    await asyncio.sleep(0)
+    tasks[-1].cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    stats = scheduler.stats()
+    assert peak == 2
+    assert stats.in_flight == 0
+    assert stats.queued[PRIORITY_CREATE] == 0
+    assert stats.waited == 5
@@ -0,0 +1,90 @@
+import json
+from contextlib import asynccontextmanager
+
+import pytest  # type: ignore
+
+from database_operator.breaker import CircuitBreaker
+from database_operator.servers import (
+    NoHealthyServerError,
+    ServerRegistry,
+    UnknownServerError,
+)
+
+
+class FakeServer:
+    def __init__(self, load):
+        self.load = load
+        self.probes = 0
+        self.breaker = CircuitBreaker()
+        self.catalog = self
+        self.existing = frozenset()
+
+    async def databases(self):
+        if self.load is None:
+            raise OSError("connection refused")
+        return self.existing
+
+    @asynccontextmanager
+    async def master_connection(self):
+        if self.load is None:
+            raise OSError("connection refused")
+        yield self
+
+    async def fetchval(self, query):
+        self.probes += 1
+        return self.load
+
+
+def test_from_json(monkeypatch):
+    monkeypatch.setenv("B_PASSWORD", "from-env")
+    registry = ServerRegistry.from_json(
+        json.dumps(
+            [
+                {"name": "a", "host": "a.db", "password": "pw"},
+                {
+                    "name": "b",
+                    "host": "b.db",
+                    "port": 6432,
+                    "passwordEnv": "B_PASSWORD",
+                    "maxInFlight": 3,
+                },
+            ]
+        )
+    )
+    assert (
+        registry.get("a").connstr("x") == "postgres://postgres:pw@a.db:5432/x"
+    )
+    assert registry.get("b").master_password == "from-env"
+    assert registry.get("b").scheduler.limit == 3
+    with pytest.raises(UnknownServerError):
+        registry.get("c")
+
+
+@pytest.mark.asyncio
+async def test_place_on_least_loaded_healthy_server():
+    a, b, down = FakeServer(5), FakeServer(3), FakeServer(None)
+    registry = ServerRegistry({"a": a, "b": b, "down": down})
+    placed = [await registry.place() for _ in range(4)]
+    assert placed == ["b", "b", "a", "b"]
+    assert (a.probes, b.probes) == (1, 1)
+    assert not registry.states["down"].healthy
+
+
+@pytest.mark.asyncio
+async def test_place_without_healthy_servers():
+    registry = ServerRegistry({"a": FakeServer(None), "b": FakeServer(None)})
+    with pytest.raises(NoHealthyServerError):
+        await registry.place()
+
+
+@pytest.mark.asyncio
+async def test_locate_finds_existing_database():
+    a, b = FakeServer(1), FakeServer(5)
+    b.existing = frozenset({"app"})
+    registry = ServerRegistry({"a": a, "b": b})
+    assert await registry.locate("app") == "b"
+    assert await registry.locate("new") is None
+    registry.servers["c"] = FakeServer(None)
+    assert await registry.locate("app") == "b"
+    with pytest.raises(NoHealthyServerError):
+        await registry.locate("new")
@@ -0,0 +1,73 @@
+import datetime
+
+import pytest  # type: ignore
+
+from database_operator.sharding import (
+    KOPF_FINALIZER,
+    HashRing,
+    ShardMembership,
+    claim_finalizers,
+    finalizer_for,
+    live_holders,
+)
+
+KEYS = [f"ns/db{i}" for i in range(1000)]
+
+
+def test_hash_ring_moves_few_keys():
+    before = HashRing(frozenset({"a", "b", "c"}))
+    after = HashRing(frozenset({"a", "b", "c", "d"}))
+    owners = [before.owner(k) for k in KEYS]
+    assert set(owners) == {"a", "b", "c"}
+    assert min(owners.count(m) for m in "abc") > 200
+    moved = [k for k in KEYS if before.owner(k) != after.owner(k)]
+    assert all(after.owner(k) == "d" for k in moved)
+    assert 150 < len(moved) < 350
+    assert HashRing(frozenset()).owner("ns/db") is None
+
+
+def test_live_holders_ignores_expired_leases():
+    now = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+
+    def lease(holder, seconds_ago):
+        renewed = now - datetime.timedelta(seconds=seconds_ago)
+        return {
+            "spec": {
+                "holderIdentity": holder,
+                "leaseDurationSeconds": 30,
+                "renewTime": renewed.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            }
+        }
+
+    leases = [lease("a", 5), lease("b", 60), {"spec": {}}]
+    assert live_holders(leases, now) == frozenset({"a"})
+
+
+def test_claim_finalizers():
+    finalizers = [
+        "other/keep",
+        KOPF_FINALIZER,
+        finalizer_for("gone"),
+        finalizer_for("b"),
+    ]
+    assert claim_finalizers(finalizers, "a", {"a", "b"}) == [
+        "other/keep",
+        finalizer_for("b"),
+        finalizer_for("a"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_membership_rebuilds_ring_on_change(monkeypatch):
+    changes = []
+    membership = ShardMembership(
+        None, "ns", "a", on_change=lambda: changes.append(1)
+    )
+    assert all(membership.owns(k) for k in KEYS[:10])
+    members = frozenset({"b"})
+    monkeypatch.setattr(membership, "_renew_and_list", lambda: members)
+    await membership.heartbeat()
+    await membership.heartbeat()
+    assert membership.ring.members == {"a", "b"}
+    assert len(changes) == 1
+    assert not all(membership.owns(k) for k in KEYS)
@@ -0,0 +1,82 @@
+import json
+
+import pytest  # type: ignore
+
+from database_operator import tracing
+from database_operator.tracing import (
+    JsonLinesExporter,
+    OtlpExporter,
+    Tracer,
+    span,
+)
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans += spans
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    tracer = Tracer(ListExporter())
+    monkeypatch.setattr(tracing, "_tracer", tracer)
+    return tracer
+
+
+def test_off_by_default():
+    with span("handler") as s:
+        assert s is None
+
+
+@pytest.mark.asyncio
+async def test_children_inherit_trace_and_attributes(tracer):
+    with span("create_fn", name="cr", database="app", namespace=None):
+        with span("sql", kind="CREATE SCHEMA"):
+            pass
+        with pytest.raises(ValueError):
+            with span("connect"):
+                raise ValueError("refused")
+    await tracer.flush()
+    sql, connect, root = tracer.exporter.spans
+    assert root.parent_id is None
+    assert root.attributes == {"name": "cr", "database": "app"}
+    assert {sql.trace_id, connect.trace_id} == {root.trace_id}
+    assert sql.parent_id == connect.parent_id == root.span_id
+    assert sql.attributes == {
+        "kind": "CREATE SCHEMA",
+        "name": "cr",
+        "database": "app",
+    }
+    assert connect.error == "ValueError: refused"
+    assert root.end_ns >= sql.end_ns
+
+
+def test_unsampled_traces_record_nothing(tracer):
+    tracer.ratio = 0
+    with span("create_fn") as root:
+        with span("sql") as child:
+            assert root is child is None
+    assert tracer._spans == []
+
+
+@pytest.mark.asyncio
+async def test_exporters(tracer, tmp_path):
+    with span("create_fn", retry=2, database="app"):
+        pass
+    spans = tracer._spans
+    path = tmp_path / "traces.jsonl"
+    JsonLinesExporter(str(path)).export(spans)
+    record = json.loads(path.read_text())
+    assert record["name"] == "create_fn"
+    assert record["attributes"] == {"retry": 2, "database": "app"}
+    otlp = OtlpExporter().payload(spans)["resourceSpans"][0]
+    (exported,) = otlp["scopeSpans"][0]["spans"]
+    assert exported["traceId"] == spans[0].trace_id
+    assert exported["attributes"] == [
+        {"key": "retry", "value": {"intValue": "2"}},
+        {"key": "database", "value": {"stringValue": "app"}},
+    ]
+    assert exported["status"] == {"code": 1}
@@ -0,0 +1,81 @@
+import pytest  # type: ignore
+
+from database_operator.users import (
+    ForbiddenRoleError,
+    InvalidPrivilegesError,
+    PostgresUser,
+    check_role,
+    dollar_quote,
+    parse_privileges,
+    quote_literal,
+    saslprep,
+    scram_verifier,
+)
+
+
+def test_parse_privileges():
+    assert parse_privileges(None) == ("CONNECT",)
+    assert parse_privileges("connect, Temporary,CONNECT") == (
+        "CONNECT",
+        "TEMPORARY",
+    )
+    with pytest.raises(InvalidPrivilegesError):
+        parse_privileges("SELECT")
+    with pytest.raises(InvalidPrivilegesError):
+        parse_privileges(" , ")
+
+
+def test_quote_literal():
+    assert quote_literal("it's") == "'it''s'"
+
+
+def test_dollar_quote_avoids_the_body():
+    assert dollar_quote(" BEGIN END ") == "$$ BEGIN END $$"
+    assert dollar_quote("$$ $q$") == "$qq$$$ $q$$qq$"
+
+
+def test_check_role():
+    check_role("app", "postgres")
+    for role in ("postgres", "pg_monitor", "", 'a"b', "x" * 64):
+        with pytest.raises(ForbiddenRoleError):
+            check_role(role, "postgres")
+
+
+def test_scram_verifier():
+    # Logs in as "secret" on Postgres 16
+    assert scram_verifier("secret", salt=bytes(range(16))) == (
+        "SCRAM-SHA-256$4096:AAECAwQFBgcICQoLDA0ODw==$"
+        "THoPhoTAuqyoQsK4dUHncUzgfD8fdmhsgKZhWVqNP5U=:"
+        "7YiHMMi2OcXGRogub03Ek06JRZ9bkhTOdCzHa5iPLiQ="
+    )
+    assert saslprep("I\u00adX\u00a0\u2168") == "IX IX"
+    assert saslprep("a\u0007b") == "a\u0007b"
+
+
+def test_grant_step():
+    user = PostgresUser.from_spec(
+        {"role": "app", "database": "db", "privileges": "ALL"}, "secret"
+    )
+    assert "secret" not in repr(user)
+    step = user.grant_step(revoke_from=("olddb",))
+    assert "COMMENT ON ROLE" in step.statements[0]
+    assert "NOT rolsuper" in step.statements[0]
+    assert step.statements[1].startswith(
+        'ALTER ROLE "app" WITH LOGIN PASSWORD \'SCRAM-SHA-256$4096:'
+    )
+    assert "secret" not in step.statements[1]
+    assert step.statements[2:] == (
+        'REVOKE ALL ON DATABASE "olddb" FROM "app"',
+        'REVOKE ALL ON DATABASE "db" FROM "app"',
+        'GRANT ALL ON DATABASE "db" TO "app"',
+    )
+    assert step.message == "Role app granted ALL on database db"
+
+
+def test_grant_step_quotes_identifiers():
+    role = 'x"; ALTER ROLE app SUPERUSER; --'
+    user = PostgresUser(role, 'db"1', ("CONNECT",), "secret")
+    statements = user.grant_step().statements
+    quoted = '"x""; ALTER ROLE app SUPERUSER; --"'
+    assert statements[1].startswith(f"ALTER ROLE {quoted} WITH LOGIN")
+    assert statements[-1] == f'GRANT CONNECT ON DATABASE "db""1" TO {quoted}'
@@ -0,0 +1,69 @@
+from database_operator.validation import fleet_errors, postgres_errors
+
+AVAILABLE = frozenset({"hstore", "vector"})
+
+
+def test_valid_postgres_spec():
+    spec = {
+        "database": "app",
+        "schemas": ["app", "audit"],
+        "extensions": ["hstore"],
+    }
+    assert postgres_errors(spec, AVAILABLE) == []
+    assert postgres_errors({"database": "app"}) == []
+
+
+def test_invalid_names():
+    errors = postgres_errors(
+        {
+            "database": "x" * 64,
+            "schemas": ["pg_app", 'a"b', "ok", "ok"],
+            "extensions": [""],
+        }
+    )
+    assert errors == [
+        f"Database name {'x' * 64!r} is longer than 63 bytes",
+        "Schema name 'pg_app' is reserved",
+        "Schema name 'a\"b' contains '\"' or NUL",
+        "Extension name must be a non-empty string",
+        "Duplicate schemas: ok",
+    ]
+    assert postgres_errors({"database": "template1"}) == [
+        "Database name 'template1' is reserved"
+    ]
+
+
+def test_extensions_must_be_available():
+    spec = {"database": "app", "extensions": ["hstore", "postgis"]}
+    assert postgres_errors(spec, AVAILABLE) == [
+        "Extensions not available on the server: postgis"
+    ]
+    # Unknown until the server has been probed
+    assert postgres_errors(spec, None) == []
+    # An update keeps extensions the old spec already had
+    assert postgres_errors(spec, AVAILABLE, old=spec) == []
+
+
+def test_database_is_immutable():
+    assert postgres_errors({"database": "b"}, old={"database": "a"}) == [
+        "The database name cannot be changed, create a new CR"
+    ]
+
+
+def test_fleet_errors():
+    spec = {
+        "databases": ["ok", "postgres"],
+        "range": {"prefix": "x" * 62, "start": 9, "end": 12},
+        "template": {"extensions": ["hstore", "postgis"]},
+    }
+    assert fleet_errors(spec, AVAILABLE) == [
+        "Database name 'postgres' is reserved",
+        f"Database name {'x' * 62 + '10'!r} is longer than 63 bytes",
+        f"Database name {'x' * 62 + '11'!r} is longer than 63 bytes",
+        f"Database name {'x' * 62 + '12'!r} is longer than 63 bytes",
+        "Extensions not available on the server: postgis",
+    ]
+    too_many = {"range": {"prefix": "db", "end": 20000}}
+    assert fleet_errors(too_many) == [
+        "A fleet may have at most 10000 databases"
+    ]